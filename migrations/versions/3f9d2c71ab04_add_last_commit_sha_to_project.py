@@ -0,0 +1,26 @@
+"""add last_commit_sha to project
+
+Revision ID: 3f9d2c71ab04
+Revises: 94be817851ab
+Create Date: 2026-10-17 09:12:44.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9d2c71ab04'
+down_revision = '94be817851ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "projects", sa.Column("last_commit_sha", sa.String(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("projects", "last_commit_sha")
@@ -0,0 +1,29 @@
+"""index webpages parent_id and project_id
+
+Revision ID: 7b2e4d9a1c38
+Revises: 3f9d2c71ab04
+Create Date: 2026-10-17 14:05:31.402117
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e4d9a1c38'
+down_revision = '3f9d2c71ab04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_webpages_parent_id", "webpages", ["parent_id"], unique=False
+    )
+    op.create_index(
+        "ix_webpages_project_id", "webpages", ["project_id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_webpages_project_id", table_name="webpages")
+    op.drop_index("ix_webpages_parent_id", table_name="webpages")
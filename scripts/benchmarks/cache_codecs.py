@@ -0,0 +1,152 @@
+"""Compare the size and speed of the available cache codecs on a site tree.
+
+Run from the repository root:
+    python scripts/benchmarks/cache_codecs.py [--pages 10000] [--runs 5]
+
+The tree has the shape of get_tree_struct output, with an owner, project,
+reviewer, Jira task and product on every page. Codecs that depend on packages
+that are not installed are skipped.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from webapp.cache import COMPRESSORS, SERIALIZERS, Codec  # noqa: E402
+
+TIMESTAMP = "2025-06-01T12:00:00"
+
+
+def make_user(user_id):
+    return {
+        "id": user_id,
+        "name": f"User {user_id}",
+        "email": f"user{user_id}@example.com",
+        "jira_account_id": f"{user_id:024x}",
+        "team": "Web",
+        "department": "Marketing",
+        "hrc_id": user_id,
+        "job_title": "Web Developer",
+        "role": "developer",
+        "mattermost": f"user{user_id}",
+        "launchpad_id": None,
+    }
+
+
+def make_page(page_id, name, parent_id):
+    user = make_user(page_id % 50)
+    return {
+        "id": page_id,
+        "name": name,
+        "url": name,
+        "title": f"Title of {name}",
+        "description": f"A description of the page at {name}, for search.",
+        "copy_doc_link": f"https://docs.google.com/document/d/{page_id:044x}",
+        "parent_id": parent_id,
+        "ext": ".html",
+        "content_jira_id": None,
+        "file_path": f"templates{name}.html",
+        "figma_link": None,
+        "status": "AVAILABLE",
+        "created_at": TIMESTAMP,
+        "updated_at": TIMESTAMP,
+        "owner": {**user, "created_at": TIMESTAMP, "updated_at": TIMESTAMP},
+        "project": {
+            "id": 1,
+            "name": "ubuntu.com",
+            "last_commit_sha": "0" * 40,
+            "created_at": TIMESTAMP,
+            "updated_at": TIMESTAMP,
+        },
+        "reviewers": [
+            {
+                **user,
+                "user_id": user["id"],
+                "webpage_id": page_id,
+                "created_at": TIMESTAMP,
+                "updated_at": TIMESTAMP,
+            }
+        ],
+        "jira_tasks": [
+            {
+                **user,
+                "jira_id": f"WD-{page_id}",
+                "user_id": user["id"],
+                "webpage_id": page_id,
+                "status": "DONE",
+                "summary": f"Copy update for {name}",
+                "request_type": "COPY_UPDATE",
+                "created_at": TIMESTAMP,
+                "updated_at": TIMESTAMP,
+            }
+        ],
+        "products": [
+            {
+                "id": page_id % 20,
+                "slug": f"product-{page_id % 20}",
+                "name": f"Product {page_id % 20}",
+                "created_at": TIMESTAMP,
+                "updated_at": TIMESTAMP,
+            }
+        ],
+        "children": [],
+    }
+
+
+def make_tree(pages, pages_per_section=20):
+    tree = make_page(1, "", None)
+    page_id = 1
+    for s in range(max(1, pages // pages_per_section)):
+        page_id += 1
+        section = make_page(page_id, f"/section-{s}", tree["id"])
+        tree["children"].append(section)
+        for p in range(pages_per_section - 1):
+            page_id += 1
+            section["children"].append(
+                make_page(page_id, f"/section-{s}/page-{p}", section["id"])
+            )
+    return tree
+
+
+def best_time(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    tree = make_tree(args.pages)
+    legacy = json.dumps(tree).encode("utf-8")
+    print(f"{'codec':<16} {'size':>12} {'encode':>10} {'decode':>10}")
+    print(
+        f"{'legacy json':<16} {len(legacy):>12,} "
+        f"{best_time(lambda: json.dumps(tree), args.runs) * 1000:>8.1f}ms "
+        f"{best_time(lambda: json.loads(legacy), args.runs) * 1000:>8.1f}ms"
+    )
+    for serializer, compressor in itertools.product(SERIALIZERS, COMPRESSORS):
+        codec = Codec(serializer, compressor)
+        data = codec.encode(tree)
+        assert Codec.decode(data) == tree
+        encode = best_time(lambda: codec.encode(tree), args.runs)
+        decode = best_time(lambda: Codec.decode(data), args.runs)
+        print(
+            f"{codec.name:<16} {len(data):>12,} "
+            f"{encode * 1000:>8.1f}ms {decode * 1000:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Time Jira API calls made with a new session each, against calls made with
+the pooled session.
+
+Run from the repository root:
+    python scripts/benchmarks/jira_session.py [--calls 200] [--no-tls]
+
+The Jira client talks to a local fake Jira server, over HTTPS with a
+throwaway self-signed certificate unless --no-tls is given. A new session
+opens a new connection, with its TCP and TLS handshakes, for every call.
+"""
+
+import argparse
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from webapp.jira import Jira  # noqa: E402
+from webapp.tests.jira_server import SITE_URL, FakeJira  # noqa: E402
+
+
+def make_certificate(directory):
+    cert, key = f"{directory}/cert.pem", f"{directory}/key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def time_calls(jira, calls):
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        jira.get_issue_statuses("WD-1")
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--no-tls", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ssl_context = None
+        if not args.no_tls:
+            cert, key = make_certificate(directory)
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(cert, key)
+            os.environ["REQUESTS_CA_BUNDLE"] = cert
+
+        with FakeJira({"WD-1": "Done"}, ssl_context=ssl_context) as server:
+            Jira.API_URL = Jira.AUTH_URL = server.url
+            jira = Jira(
+                url=SITE_URL,
+                client_id="id",
+                client_secret="secret",
+                labels=[],
+                copy_updates_epic="WD-1",
+                sites_maintenance_epic=None,
+            )
+            pooled = time_calls(jira, args.calls)
+
+            # The previous behaviour, a new session for every call
+            jira.get_session = requests.Session
+            unpooled = time_calls(jira, args.calls)
+
+    print(f"{'session':<10} {'mean':>8} {'p50':>8} {'p95':>8}")
+    for name, times in (("new", unpooled), ("pooled", pooled)):
+        p95 = statistics.quantiles(times, n=20)[-1]
+        print(
+            f"{name:<10} {statistics.mean(times):>6.2f}ms "
+            f"{statistics.median(times):>6.2f}ms {p95:>6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
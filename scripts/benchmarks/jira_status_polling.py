@@ -0,0 +1,81 @@
+"""Time fetching the statuses of Jira tasks, one request per issue against
+batched JQL searches.
+
+Run from the repository root:
+    python scripts/benchmarks/jira_status_polling.py [--tasks 100 1000 5000]
+
+The Jira client talks to a local fake Jira server, which waits --latency
+seconds before answering each request, to stand in for the round trip to
+Jira Cloud. The per-issue loop is timed up to --serial-limit tasks.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from webapp.jira import Jira  # noqa: E402
+from webapp.tests.jira_server import SITE_URL, FakeJira  # noqa: E402
+
+
+def per_issue(jira, keys):
+    """The previous implementation, kept for comparison"""
+    return {
+        key: jira.get_issue_statuses(key)["fields"]["status"]["name"]
+        for key in keys
+    }
+
+
+def run(function, jira, server, keys):
+    server.requests.clear()
+    start = time.perf_counter()
+    statuses = function(jira, keys)
+    elapsed = time.perf_counter() - start
+    assert len(statuses) == len(keys)
+    return elapsed, len(server.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--tasks", type=int, nargs="+", default=[100, 1_000, 5_000]
+    )
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--serial-limit", type=int, default=1_000)
+    args = parser.parse_args()
+
+    print(
+        f"{'tasks':>8} {'batched':>10} {'requests':>9} "
+        f"{'per issue':>10} {'requests':>9}"
+    )
+    for tasks in args.tasks:
+        keys = [f"WD-{i}" for i in range(tasks)]
+        with FakeJira(
+            {key: "In Progress" for key in keys}, latency=args.latency
+        ) as server:
+            Jira.API_URL = Jira.AUTH_URL = server.url
+            jira = Jira(
+                url=SITE_URL,
+                client_id="id",
+                client_secret="secret",
+                labels=[],
+                copy_updates_epic="WD-1",
+                sites_maintenance_epic=None,
+            )
+            batched, batched_requests = run(
+                Jira.get_issues_statuses, jira, server, keys
+            )
+            serial = (
+                "{:>9.2f}s {:>9}".format(*run(per_issue, jira, server, keys))
+                if tasks <= args.serial_limit
+                else f"{'-':>10} {'-':>9}"
+            )
+            print(
+                f"{tasks:>8} {batched:>9.2f}s {batched_requests:>9} {serial}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Compare the single-pass template metadata extractor with the per-tag
+parsing functions on a synthetic tree.
+
+Run from the repository root:
+    python scripts/benchmarks/parse_tree.py [--pages 10000]
+"""
+
+import argparse
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from templates import generate_templates  # noqa: E402
+
+from webapp.parse_tree import (  # noqa: E402
+    TAG_MAPPING,
+    create_node,
+    extends_base,
+    extract_template_metadata,
+    extract_text_from_tag,
+    get_tags_from_metadata,
+    is_template,
+    is_valid_page,
+)
+
+# The per-tag parsers scan_directory used before the single-pass extractor
+
+
+def get_tags_rolling_buffer(path):
+    """
+    Parse an html file and return a dictionary of its tags
+    """
+
+    tags = create_node()
+    available_tags = list(TAG_MAPPING.keys())
+
+    # We create a map of the selected variants for each tag
+    variants_mapping = {v: "" for v in available_tags}
+
+    # check if the path is html or md file
+    is_md = path.suffix == ".md"
+
+    with path.open("r") as f:
+        for tag in available_tags:
+            buffer = []
+            is_buffering = False
+            tag_found = False
+
+            variants = TAG_MAPPING[tag]
+
+            for variant in variants:
+                is_buffering = False
+                # Return to start of file
+                f.seek(0)
+
+                if not is_md:
+
+                    for line in f.readlines():
+                        if is_buffering:
+                            buffer.append(line)
+
+                        if not is_buffering and (
+                            match := re.search(
+                                f"{{% block {variant}( *)%}}", line
+                            )
+                        ):
+                            # We remove line contents before the tag
+                            line = line[match.start() :]  # noqa: E203
+
+                            buffer.append(line)
+                            is_buffering = True
+                            variants_mapping[tag] = variant
+
+                        # We search for the end of the tag in the existing
+                        # buffer
+                        buffer_string = "".join(buffer)
+                        if is_buffering and re.search(
+                            "(.*){%( *)endblock", buffer_string
+                        ):
+                            # We save the buffer contents to the tags
+                            # dictionary
+                            tags[tag] = buffer_string
+
+                            # We extract the text within the tags
+                            tags[tag] = extract_text_from_tag(
+                                variants_mapping[tag], tags[tag]
+                            )
+
+                            # We now reset the buffer
+                            buffer = []
+                            is_buffering = False
+                            tag_found = True
+                            break
+
+                else:
+                    for line in f:
+                        match = re.match(
+                            rf"^\s*{variant}\s*:\s*\"?(.+?)\"?\s*$",
+                            line,
+                            re.IGNORECASE,
+                        )
+                        if match:
+                            variants_mapping[tag] = variant
+                            tags[tag] = match.group(1).strip()
+                            tag_found = True
+                            break
+
+                if tag_found:
+                    break
+
+    # We add the name from the path
+    raw_name = re.sub(r"(?i)(.html|/index.html|/index.md)", "", str(path))
+    tags["name"] = raw_name.split("/templates", 1)[-1]
+
+    return tags
+
+
+def get_extended_path(path):
+    """Get the path extended by the file"""
+    with path.open("r") as f:
+        for line in f.readlines():
+            if ".html" in str(path):
+                if match := re.search("{% extends [\"'](.*?)[\"'] %}", line):
+                    return match.group(1)
+
+
+def parse_per_tag(path):
+    """Parse a page the way scan_directory used to."""
+    extended_path = get_extended_path(path)
+    valid = extends_base(path)
+    return extended_path, valid, get_tags_rolling_buffer(path)
+
+
+def parse_single_pass(path):
+    metadata = extract_template_metadata(path)
+    valid = is_valid_page(path, None, metadata=metadata)
+    return metadata["extends"], valid, get_tags_from_metadata(path, metadata)
+
+
+def run(paths, parse):
+    start = time.perf_counter()
+    results = [parse(path) for path in paths]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        templates = generate_templates(Path(root), pages=args.pages)
+        paths = sorted(
+            path
+            for path in templates.rglob("*.html")
+            if not is_template(path) and "layouts" not in path.parts
+        )
+        print(f"Parsing {len(paths)} templates")
+
+        per_tag, expected = run(paths, parse_per_tag)
+        single_pass, results = run(paths, parse_single_pass)
+
+        assert results == expected, "Both parsers must agree"
+        print(f"per-tag:     {per_tag:8.2f}s")
+        print(f"single-pass: {single_pass:8.2f}s")
+        print(f"speedup:     {per_tag / single_pass:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compare serial and parallel scans of a synthetic templates tree.
+
+Run from the repository root:
+    python scripts/benchmarks/scan_directory.py [--pages 10000] [--workers 4]
+
+On a warm page cache the scan is CPU bound, so --io-latency-ms can be used to
+add a delay to every file open, emulating cold or network storage.
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from templates import generate_templates  # noqa: E402
+
+from webapp.parse_tree import scan_directory  # noqa: E402
+
+
+def sort_tree(tree):
+    tree["children"].sort(key=lambda child: child["name"])
+    for child in tree["children"]:
+        sort_tree(child)
+    return tree
+
+
+def run(templates, workers):
+    start = time.perf_counter()
+    tree = scan_directory(str(templates), workers=workers)
+    return time.perf_counter() - start, sort_tree(tree)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--io-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.io_latency_ms:
+        path_open = Path.open
+
+        def slow_open(path, *open_args, **open_kwargs):
+            time.sleep(args.io_latency_ms / 1000)
+            return path_open(path, *open_args, **open_kwargs)
+
+        Path.open = slow_open
+
+    with tempfile.TemporaryDirectory() as root:
+        templates = generate_templates(Path(root), pages=args.pages)
+        print(f"Scanning {args.pages} pages")
+
+        serial, expected = run(templates, workers=1)
+        parallel, tree = run(templates, workers=args.workers)
+
+        assert tree == expected, "Both scans must return the same tree"
+        print(f"serial:              {serial:8.2f}s")
+        print(f"parallel ({args.workers} workers): {parallel:8.2f}s")
+        print(f"speedup:             {serial / parallel:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Generate a synthetic site templates tree for the benchmarks."""
+
+from pathlib import Path
+
+BODY_LINES = 150
+
+PAGE = """{{% extends "{extends}" %}}
+
+{{% block title %}}{title}{{% endblock %}}
+
+{{% block meta_description %}}
+  Description of {title}, which spans
+  a couple of lines.
+{{% endblock %}}
+
+{{% block meta_copydoc %}}https://docs.google.com/document/d/{slug}/edit\
+{{% endblock meta_copydoc %}}
+
+{{% block content %}}
+{body}
+{{% endblock content %}}
+"""
+
+LAYOUT = """{{% extends "{extends}" %}}
+
+{{% block content %}}{{{{ self.content() }}}}{{% endblock %}}
+"""
+
+
+def generate_templates(
+    root: Path, pages: int = 10_000, pages_per_directory: int = 20
+):
+    """Write a templates folder with the given number of pages to
+    root/repositories/site.com/templates, and return its path.
+
+    Every directory has an index page that extends a shared layout, which
+    extends a second layout that extends base.html, and pages that extend the
+    same layout as their index.
+    """
+    templates = root / "repositories" / "site.com" / "templates"
+    templates.mkdir(parents=True, exist_ok=True)
+    (templates / "base.html").write_text("<html>{% block content %}\n")
+    (templates / "_base-layout.html").write_text("")
+    (templates / "layouts").mkdir(exist_ok=True)
+    (templates / "layouts" / "_site.html").write_text(
+        LAYOUT.format(extends="base.html")
+    )
+    (templates / "layouts" / "_section.html").write_text(
+        LAYOUT.format(extends="/layouts/_site.html")
+    )
+
+    body = "\n".join(
+        f"  <p>Paragraph {line} of the page body.</p>"
+        for line in range(BODY_LINES)
+    )
+
+    written = 0
+    directory_index = 0
+    while written < pages:
+        # Spread directories over two levels
+        directory = (
+            templates
+            / f"section-{directory_index % 25}"
+            / f"topic-{directory_index}"
+        )
+        directory.mkdir(parents=True, exist_ok=True)
+        for page in range(min(pages_per_directory, pages - written)):
+            name = "index" if page == 0 else f"page-{page}"
+            title = f"{directory.name} {name}"
+            (directory / f"{name}.html").write_text(
+                PAGE.format(
+                    extends="/layouts/_section.html",
+                    title=title,
+                    slug=f"{directory_index}-{page}",
+                    body=body,
+                )
+            )
+            written += 1
+        directory_index += 1
+
+    return templates
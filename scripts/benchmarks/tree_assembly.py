@@ -0,0 +1,130 @@
+"""Time the assembly of the webpages tree from database rows.
+
+Run from the repository root:
+    python scripts/benchmarks/tree_assembly.py [--pages 1000 10000 50000]
+
+Each size is synced into a throwaway SQLite database, then loading the rows
+with their relationships and running get_tree_struct on them is timed. The
+previous implementation, which scanned every row for the children of every
+node, is timed alongside it up to --quadratic-limit pages.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import select
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from webapp import create_app  # noqa: E402
+from webapp.cache import FileCache  # noqa: E402
+from webapp.helper import convert_webpage_to_dict  # noqa: E402
+from webapp.helper import get_tree_struct  # noqa: E402
+from webapp.models import Project, User, Webpage, db  # noqa: E402
+from webapp.models import get_or_create  # noqa: E402
+from webapp.site_repository import TREE_LOAD_OPTIONS  # noqa: E402
+from webapp.site_repository import SiteRepository  # noqa: E402
+
+
+def make_tree(pages, pages_per_section=20):
+    def node(name, children=()):
+        return {
+            "name": name,
+            "title": name,
+            "description": None,
+            "link": None,
+            "ext": ".html",
+            "file_path": f"templates{name}.html",
+            "children": list(children),
+        }
+
+    sections = max(1, pages // pages_per_section)
+    return node(
+        "",
+        [
+            node(
+                f"/section-{s}",
+                [
+                    node(f"/section-{s}/page-{p}")
+                    for p in range(pages_per_section - 1)
+                ],
+            )
+            for s in range(sections)
+        ],
+    )
+
+
+def quadratic_build_tree(session, page, webpages):
+    """The previous implementation, kept for comparison"""
+    for child_page in filter(lambda p: p.parent_id == page["id"], webpages):
+        project = get_or_create(session, Project, id=child_page.project_id)
+        owner = get_or_create(session, User, id=child_page.owner_id)
+        new_child = convert_webpage_to_dict(child_page, owner, project)
+        new_child["children"] = []
+        page["children"].append(new_child)
+        quadratic_build_tree(session, new_child, webpages)
+
+
+def quadratic_get_tree_struct(session, webpages):
+    webpages_list = sorted(webpages, key=lambda p: p.name.rsplit("/", 1)[-1])
+    parent_page = next(p for p in webpages_list if p.parent_id is None)
+    project = get_or_create(session, Project, id=parent_page.project_id)
+    owner = get_or_create(session, User, id=parent_page.owner_id)
+    tree = convert_webpage_to_dict(parent_page, owner, project)
+    tree["children"] = []
+    quadratic_build_tree(session, tree, webpages_list)
+    return tree
+
+
+def run(function, pages):
+    db.session.expire_all()
+    start = time.perf_counter()
+    webpages = (
+        db.session.execute(select(Webpage).options(*TREE_LOAD_OPTIONS))
+        .scalars()
+        .all()
+    )
+    function(db.session, webpages)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--pages", type=int, nargs="+", default=[1_000, 10_000, 50_000]
+    )
+    parser.add_argument("--quadratic-limit", type=int, default=10_000)
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(10_000)
+    print(f"{'pages':>8} {'indexed':>10} {'quadratic':>10}")
+    for pages in args.pages:
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+            app = create_app()
+            app.config["BASE_DIR"] = directory
+            app.config["CACHE"] = FileCache(app)
+            with app.app_context():
+                db.create_all()
+                SiteRepository("site.com", app).sync_webpages(
+                    db, make_tree(pages)
+                )
+                db.session.commit()
+
+                indexed = run(get_tree_struct, pages)
+                quadratic = (
+                    f"{run(quadratic_get_tree_struct, pages):>9.2f}s"
+                    if pages <= args.quadratic_limit
+                    else f"{'-':>10}"
+                )
+                print(f"{pages:>8} {indexed:>9.2f}s {quadratic}")
+                db.session.remove()
+                db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -95,7 +95,10 @@ def set_cache_control_headers(response):
         # The base path is also uncached to ensure that we don't cache the base
         # state after logging in. We can do this as we serve a single page app
         # from a unique url.
-        response.cache_control.no_store = True
+        # Responses that must be revalidated with their ETag (no-cache) can
+        # still be stored by the client.
+        if not response.cache_control.no_cache:
+            response.cache_control.no_store = True
 
     elif (
         response.status_code == 200
@@ -1,7 +1,21 @@
+import contextlib
+import fcntl
 import json
+import mmap
 import os
-import shutil
+import pickle
+import re
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Any
 
@@ -9,6 +23,133 @@ import redis
 from flask import Flask
 from redis import exceptions as redis_exceptions
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Serializers and compressors, by name, as (encode, decode) pairs
+SERIALIZERS = {
+    "json": (
+        lambda value: json.dumps(value).encode("utf-8"),
+        lambda data: json.loads(bytes(data)),
+    ),
+}
+if orjson:
+    SERIALIZERS["orjson"] = (
+        lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS),
+        orjson.loads,
+    )
+if msgpack:
+    SERIALIZERS["msgpack"] = (
+        lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False),
+    )
+
+COMPRESSORS = {
+    "none": (lambda data: data, lambda data: data),
+    "zlib": (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+if zstandard:
+    COMPRESSORS["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+
+KEY_PREFIX_PATTERN = re.compile(r"[A-Z][A-Z_]*[A-Z]")
+# Seconds after which a lock expires, unless its owner renews it
+LOCK_TTL = 60
+
+
+class CodecError(Exception):
+    """Exception raised for values that can't be decoded"""
+
+
+class LockTimeout(Exception):
+    """Exception raised for locks that can't be acquired in time"""
+
+
+class Codec:
+    """Encode cached values as bytes, with a serializer and a compressor.
+
+    Encoded values start with a header naming both, so values written with
+    another codec can still be read, as can plain JSON written before codecs
+    were introduced.
+    """
+
+    HEADER_MARK = b"\x00"
+    MAX_HEADER_SIZE = 64
+    # Needs no optional package, so every process can read what others
+    # wrote. Faster codecs are opted into with CACHE_CODEC.
+    DEFAULT = "json:zlib"
+
+    def __init__(self, serializer: str, compressor: str):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"Serializer {serializer} is not available")
+        if compressor not in COMPRESSORS:
+            raise ValueError(f"Compressor {compressor} is not available")
+        self.serializer = serializer
+        self.compressor = compressor
+        self.header = self.HEADER_MARK + f"{serializer}:{compressor}\n".encode(
+            "ascii"
+        )
+
+    @property
+    def name(self) -> str:
+        return f"{self.serializer}:{self.compressor}"
+
+    @classmethod
+    def from_name(cls, name: str | None = None) -> "Codec":
+        """Return the codec named "serializer:compressor", or the default
+        one if no name is given.
+        """
+        serializer, _, compressor = (name or cls.DEFAULT).partition(":")
+        return cls(serializer, compressor or "none")
+
+    def encode(self, value: Any) -> bytes:
+        serialize, _ = SERIALIZERS[self.serializer]
+        compress, _ = COMPRESSORS[self.compressor]
+        return self.header + compress(serialize(value))
+
+    @classmethod
+    def decode(cls, data: bytes | str | mmap.mmap | None) -> Any:
+        """Decode a value from bytes or any other buffer, such as a memory
+        map, without copying it where the codec allows.
+        """
+        if data is None:
+            return None
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        # Values written before codecs were introduced are plain JSON
+        head = bytes(data[: cls.MAX_HEADER_SIZE])
+        if not head.startswith(cls.HEADER_MARK):
+            return json.loads(bytes(data))
+
+        header_end = head.find(b"\n")
+        header = head[1:header_end]
+        serializer, _, compressor = header.decode("ascii").partition(":")
+        try:
+            _, deserialize = SERIALIZERS[serializer]
+            _, decompress = COMPRESSORS[compressor]
+        except KeyError:
+            raise CodecError(f"Codec {header} is not available")
+        # Slice a view of the payload, to avoid copying it
+        payload_start = header_end + 1
+        with memoryview(data) as view, view[payload_start:] as payload:
+            return deserialize(decompress(payload))
+
 
 class Cache(ABC):
     """Abstract Cache class"""
@@ -16,30 +157,144 @@ class Cache(ABC):
     KIND = "Cache"
     CACHE_PREFIX = "WEBSITES_CONTENT_SYSTEM"
 
+    codec: Codec = Codec.from_name()
+
+    def encode(self, value: Any) -> bytes:
+        """Encode a value with the cache's codec"""
+        return self.codec.encode(value)
+
+    def decode(self, data: bytes | str | None) -> Any:
+        """Decode a cached value, written with any codec. Values that can't
+        be decoded are treated as missing.
+        """
+        try:
+            return self.codec.decode(data)
+        except CodecError as e:
+            self.logger.warning(f"Unable to decode cached value: {e}")
+            return None
+
     @abstractmethod
     def get(self, key: str):
         """Get a value from the cache"""
 
     @abstractmethod
-    def set(self, key: str, value: Any):
-        """Set a value in the cache"""
+    def set(self, key: str, value: Any, ttl: int | None = None):
+        """Set a value in the cache, expiring after ttl seconds if given"""
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: int | None = None) -> bool:
+        """Set a value only if the key isn't set, atomically across
+        processes. Return False if it is already set.
+        """
 
     @abstractmethod
     def delete(self, key: str):
         """Delete a value from the cache"""
 
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        """Get the values of several keys at once, by key"""
+
+    @abstractmethod
+    def set_many(self, values: dict[str, Any], ttl: int | None = None):
+        """Set several values at once, expiring after ttl seconds if given"""
+
+    @abstractmethod
+    def delete_many(self, keys: Iterable[str]):
+        """Delete several values at once"""
+
+    @abstractmethod
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        """Take a lock under an owner token if it is free, for ttl seconds.
+        Return False if another owner holds it.
+        """
+
+    @abstractmethod
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        """Extend a lock for ttl seconds. Return False if the token no longer
+        owns it.
+        """
+
+    @abstractmethod
+    def release_lock(self, name: str, token: str) -> bool:
+        """Release a lock, if the token still owns it"""
+
+    @abstractmethod
+    def get_lock_owners(self, names: Iterable[str]) -> dict[str, str | None]:
+        """Return the owner token of several locks, or None for free locks"""
+
+    def get_lock(
+        self, name: str, ttl: float = LOCK_TTL, timeout: float | None = None
+    ) -> "CacheLock":
+        """Return a lock shared by every process using the cache"""
+        return CacheLock(self, name, ttl=ttl, timeout=timeout)
+
     @abstractmethod
     def is_available(self):
         """Check if the cache is available"""
 
+    @abstractmethod
+    def get_stamp(self, key: str) -> str | None:
+        """Return a stamp that changes whenever the value is set, or None if
+        the key is not set.
+        """
+
+    @abstractmethod
+    def get_with_stamp(self, key: str) -> tuple[Any, str | None, int]:
+        """Return the value of a key, its stamp and its encoded size"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Return the number of entries and their size in bytes, in total
+        and per key prefix.
+        """
+
+    @staticmethod
+    def get_key_prefix(key: str) -> str:
+        """Return the prefix of a key, its leading upper case words, e.g.
+        SITE_REPOSITORY for SITE_REPOSITORY_ubuntu.com.
+        """
+        match = KEY_PREFIX_PATTERN.match(key)
+        return match.group(0) if match else key
+
+    @classmethod
+    def summarize(cls, sizes: dict) -> dict:
+        """Summarize the sizes of entries, by key, per key prefix"""
+        prefixes = {}
+        for key, size in sizes.items():
+            prefix = prefixes.setdefault(
+                cls.get_key_prefix(key), {"entries": 0, "bytes": 0}
+            )
+            prefix["entries"] += 1
+            prefix["bytes"] += size
+        return {
+            "entries": len(sizes),
+            "bytes": sum(sizes.values()),
+            "prefixes": prefixes,
+        }
+
 
 class RedisCache(Cache):
     """Cache interface"""
 
     KIND = "RedisCache"
+    # Renew or delete a lock only if it is still held by the given token
+    RENEW_LOCK_SCRIPT = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("pexpire", KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    RELEASE_LOCK_SCRIPT = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+    """
 
     def __init__(self, app: Flask):
         self.logger = app.logger
+        self.codec = Codec.from_name(app.config.get("CACHE_CODEC"))
         self.instance = self.connect(app)
 
     def connect(self, app):
@@ -58,26 +313,154 @@ class RedisCache(Cache):
         return f"{self.CACHE_PREFIX}_{key}"
 
     def __serialize__(self, value: Any):
-        """Save files to the cache as JSON"""
-        return json.dumps(value)
+        """Encode values with the cache's codec"""
+        return self.encode(value)
 
-    def __deserialize__(self, value: str):
-        """Deserialize cached JSON"""
-        try:
-            return json.loads(value)
-        except TypeError:
-            return value
+    def __deserialize__(self, value: bytes | None):
+        """Decode cached values"""
+        return self.decode(value)
+
+    def __get_stamp_key__(self, key: str):
+        return f"{self.__get_prefixed_key__(key)}_STAMP"
 
     def get(self, key: str):
         value = self.instance.get(self.__get_prefixed_key__(key))
         return self.__deserialize__(value)
 
-    def set(self, key: str, value: str):
+    def set(self, key: str, value: str, ttl: int | None = None):
         value = self.__serialize__(value)
-        return self.instance.set(self.__get_prefixed_key__(key), value)
+        # Change the stamp along with the value, so other workers can tell
+        # their in-process copies are out of date. The stamp expires with the
+        # value, and is random so it is never reused.
+        pipeline = self.instance.pipeline()
+        pipeline.set(self.__get_prefixed_key__(key), value, ex=ttl)
+        pipeline.set(self.__get_stamp_key__(key), uuid.uuid4().hex, ex=ttl)
+        return pipeline.execute()[0]
+
+    def add(self, key: str, value: Any, ttl: int | None = None) -> bool:
+        if not self.instance.set(
+            self.__get_prefixed_key__(key),
+            self.__serialize__(value),
+            nx=True,
+            ex=ttl,
+        ):
+            return False
+        self.instance.set(
+            self.__get_stamp_key__(key), uuid.uuid4().hex, ex=ttl
+        )
+        return True
+
+    def get_stamp(self, key: str) -> str | None:
+        stamp = self.instance.get(self.__get_stamp_key__(key))
+        return stamp.decode("ascii") if stamp else None
+
+    def get_with_stamp(self, key: str) -> tuple[Any, str | None, int]:
+        pipeline = self.instance.pipeline()
+        pipeline.get(self.__get_prefixed_key__(key))
+        pipeline.get(self.__get_stamp_key__(key))
+        data, stamp = pipeline.execute()
+        return (
+            self.__deserialize__(data),
+            stamp.decode("ascii") if stamp else None,
+            len(data) if data else 0,
+        )
 
     def delete(self, key: str):
-        return self.instance.delete(key)
+        return self.instance.delete(
+            self.__get_prefixed_key__(key), self.__get_stamp_key__(key)
+        )
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.instance.mget(
+            [self.__get_prefixed_key__(key) for key in keys]
+        )
+        return {
+            key: self.__deserialize__(value)
+            for key, value in zip(keys, values)
+        }
+
+    def set_many(self, values: dict[str, Any], ttl: int | None = None):
+        pipeline = self.instance.pipeline()
+        for key, value in values.items():
+            pipeline.set(
+                self.__get_prefixed_key__(key),
+                self.__serialize__(value),
+                ex=ttl,
+            )
+            pipeline.set(self.__get_stamp_key__(key), uuid.uuid4().hex, ex=ttl)
+        return pipeline.execute()
+
+    def delete_many(self, keys: Iterable[str]):
+        names = [
+            name
+            for key in keys
+            for name in (
+                self.__get_prefixed_key__(key),
+                self.__get_stamp_key__(key),
+            )
+        ]
+        return self.instance.delete(*names) if names else 0
+
+    def __get_lock_key__(self, name: str):
+        return self.__get_prefixed_key__(f"LOCK_{name}")
+
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        return bool(
+            self.instance.set(
+                self.__get_lock_key__(name), token, nx=True, px=int(ttl * 1000)
+            )
+        )
+
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        return bool(
+            self.instance.eval(
+                self.RENEW_LOCK_SCRIPT,
+                1,
+                self.__get_lock_key__(name),
+                token,
+                int(ttl * 1000),
+            )
+        )
+
+    def release_lock(self, name: str, token: str) -> bool:
+        return bool(
+            self.instance.eval(
+                self.RELEASE_LOCK_SCRIPT, 1, self.__get_lock_key__(name), token
+            )
+        )
+
+    def get_lock_owners(self, names: Iterable[str]) -> dict[str, str | None]:
+        names = list(names)
+        if not names:
+            return {}
+        tokens = self.instance.mget(
+            [self.__get_lock_key__(name) for name in names]
+        )
+        return {
+            name: token.decode("ascii") if token else None
+            for name, token in zip(names, tokens)
+        }
+
+    def stats(self) -> dict:
+        prefix = f"{self.CACHE_PREFIX}_"
+        keys = [
+            key
+            for key in self.instance.scan_iter(match=f"{prefix}*")
+            if not key.endswith(b"_STAMP")
+        ]
+        pipeline = self.instance.pipeline()
+        for key in keys:
+            pipeline.strlen(key)
+        sizes = pipeline.execute()
+        return self.summarize(
+            {
+                key.decode("utf-8").removeprefix(prefix): size
+                for key, size in zip(keys, sizes)
+            }
+        )
 
     def is_available(self):
         try:
@@ -94,10 +477,31 @@ class FileCache(Cache):
 
     KIND = "FileCache"
     CACHE_DIR = "tree-cache"
+    # Lock files are kept apart from the cached values
+    LOCK_DIR = ".locks"
+    # Values set with a TTL are stored after this mark and their expiry time
+    EXPIRY_MARK = b"\x01"
+    EXPIRY_FORMAT = struct.Struct(">d")
+    # Threads used to read and write several files at once
+    MAX_WORKERS = 8
+    # Seconds between measures of the cache directory. In between, its size
+    # is tracked as this process writes, and other processes' writes are
+    # only accounted for by the next measure.
+    MEASURE_INTERVAL = 300
 
     def __init__(self, app: Flask):
         self.cache_path = app.config["BASE_DIR"] + "/" + self.CACHE_DIR
         self.logger = app.logger
+        self.codec = Codec.from_name(app.config.get("CACHE_CODEC"))
+        self.mmap_min_size = app.config.get("CACHE_MMAP_MIN_SIZE")
+        self.max_size = app.config.get("CACHE_FILE_MAX_SIZE")
+        # Estimated size of the cache files, None until measured
+        self.size = None
+        self.measured_at = 0.0
+        self.size_lock = threading.Lock()
+        # Open lock files of the locks held by this process, by owner token
+        self.held_locks = {}
+        self.held_locks_lock = threading.Lock()
         # Create directory
         Path(self.cache_path).mkdir(parents=True, exist_ok=True)
         self.connect()
@@ -119,56 +523,583 @@ class FileCache(Cache):
         if not path_exists and path_writable:
             raise ConnectionError("Cache directory is not writable")
 
-    def save_to_file(self, key: str, value: Any):
-        """
-        Dump the python object to JSON and save it to a file.
+    def get_file_path(self, key: str) -> str:
+        return f"{self.cache_path}/{key}"
+
+    @contextmanager
+    def lock(self, key: str, shared: bool = False) -> Generator:
+        """Hold a lock on a key, across processes, for as long as the context
+        is active. Writers take an exclusive lock, so only one process writes
+        a key at a time.
         """
-        data = json.dumps(value)
-        # Delete the file if it exists
-        if Path(self.cache_path + "/" + key).exists():
+        lock_directory = Path(self.cache_path) / self.LOCK_DIR
+        lock_directory.mkdir(parents=True, exist_ok=True)
+        with open(lock_directory / key, "a") as lock_file:
+            fcntl.flock(
+                lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            )
             try:
-                os.remove(self.cache_path + "/" + key)
-            except FileNotFoundError:
-                # We catch this as due to different processes potentially
-                # accessing this method, deleting a file could face a race
-                # condition.
-                self.logger.info("File already removed")
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def get_lock_path(self, name: str) -> Path:
+        lock_directory = Path(self.cache_path) / self.LOCK_DIR
+        lock_directory.mkdir(parents=True, exist_ok=True)
+        return lock_directory / self.__get_prefixed_key__(f"LOCK_{name}")
+
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        """Take an exclusive flock on the lock's file, and record the token
+        in it. The kernel releases the lock if the process dies, so the ttl
+        isn't needed.
+        """
+        lock_file = open(self.get_lock_path(name), "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.truncate(0)
+        lock_file.write(token)
+        lock_file.flush()
+        with self.held_locks_lock:
+            self.held_locks[token] = lock_file
+        return True
+
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        with self.held_locks_lock:
+            return token in self.held_locks
+
+    def release_lock(self, name: str, token: str) -> bool:
+        with self.held_locks_lock:
+            lock_file = self.held_locks.pop(token, None)
+        if lock_file is None:
+            return False
+        with lock_file:
+            lock_file.truncate(0)
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        return True
+
+    def get_lock_owners(self, names: Iterable[str]) -> dict[str, str | None]:
+        owners = {}
+        for name in names:
+            owners[name] = None
+            with (
+                contextlib.suppress(FileNotFoundError),
+                open(self.get_lock_path(name)) as lock_file,
+            ):
+                try:
+                    fcntl.flock(
+                        lock_file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB
+                    )
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                except BlockingIOError:
+                    # The owner may not have written its token yet
+                    owners[name] = lock_file.read() or "unknown"
+        return owners
+
+    def save_to_file(
+        self,
+        key: str,
+        value: Any,
+        ttl: int | None = None,
+        if_absent: bool = False,
+    ) -> bool:
+        """
+        Encode the python object and save it to a file, expiring after ttl
+        seconds if given. If if_absent is set, the file is only saved if there
+        is no unexpired one, and False is returned otherwise.
+
+        The data is written to a temporary file that then replaces the key's
+        file, so readers see either the old or the new value, never a partial
+        one.
+        """
+        data = self.encode(value)
+        if ttl is not None:
+            expires_at = self.EXPIRY_FORMAT.pack(time.time() + ttl)
+            data = self.EXPIRY_MARK + expires_at + data
         # Create base directory if it does not exist
-        if not Path(self.cache_path).exists():
-            Path(self.cache_path).mkdir(parents=True, exist_ok=True)
-        with open(self.cache_path + "/" + key, "w") as f:
-            f.write(data)
+        Path(self.cache_path).mkdir(parents=True, exist_ok=True)
+        with self.lock(key):
+            if if_absent and self.is_saved(key):
+                return False
+            fd, temp_path = tempfile.mkstemp(
+                dir=self.cache_path, prefix=f".{key}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                old_size = self.get_file_size(key)
+                os.replace(temp_path, self.get_file_path(key))
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(temp_path)
+                raise
+        self.add_size(len(data) - old_size)
+        return True
 
-    def load_from_file(self, key: str):
+    def is_saved(self, key: str) -> bool:
+        """Check whether a key has a file that hasn't expired"""
+        try:
+            with open(self.get_file_path(key), "rb") as f:
+                expires_at, _ = self.get_expiry(
+                    f.read(1 + self.EXPIRY_FORMAT.size)
+                )
+        except FileNotFoundError:
+            return False
+        return expires_at is None or expires_at > time.time()
+
+    def get_file_size(self, key: str) -> int:
+        try:
+            return os.stat(self.get_file_path(key)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def add_size(self, delta: int):
+        """Track a change of the size of the cache files"""
+        if not self.max_size:
+            return
+        with self.size_lock:
+            if self.size is not None:
+                self.size += delta
+
+    def get_expiry(self, data) -> tuple[float | None, int]:
+        """Return the expiry time of file contents, if any, and the offset of
+        the encoded value.
         """
-        Load the JSON data from a file and return the python object.
+        if data[:1] != self.EXPIRY_MARK:
+            return None, 0
+        end = 1 + self.EXPIRY_FORMAT.size
+        (expires_at,) = self.EXPIRY_FORMAT.unpack(bytes(data[1:end]))
+        return expires_at, end
+
+    def decode_file(self, key: str, data) -> Any:
+        """Decode the contents of a key's file. Expired files are removed,
+        and read as None.
         """
-        file_path = Path(f"{self.cache_path}/{key}")
-        # Check if the file exists
-        if not file_path.exists():
+        expires_at, offset = self.get_expiry(data)
+        if expires_at is not None and expires_at <= time.time():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.get_file_path(key))
+                self.add_size(-len(data))
             return None
-        with file_path.open("r") as f:
-            data = f.read()
-            return json.loads(data)
+        with memoryview(data) as view, view[offset:] as value:
+            return self.decode(value)
+
+    def load_from_file(self, key: str) -> tuple[Any, int]:
+        """
+        Load the encoded data from a file and return the python object, and
+        the size of the data. Return (None, 0) if the file doesn't exist.
+
+        Files of at least mmap_min_size bytes are memory mapped and decoded
+        without copying them into memory first.
+        """
+        try:
+            f = open(self.get_file_path(key), "rb")
+        except FileNotFoundError:
+            return None, 0
+        with f:
+            stat = os.fstat(f.fileno())
+            # Record the read, for the least recently used files to be
+            # evicted first, whatever the atime mount options
+            os.utime(f.fileno(), ns=(time.time_ns(), stat.st_mtime_ns))
+            if self.mmap_min_size and stat.st_size >= self.mmap_min_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self.decode_file(key, data), stat.st_size
+            return self.decode_file(key, f.read()), stat.st_size
 
     def __get_prefixed_key__(self, key: str):
         return f"{self.CACHE_PREFIX}_{key}"
 
     def get(self, key: str):
-        return self.load_from_file(self.__get_prefixed_key__(key))
+        value, _ = self.load_from_file(self.__get_prefixed_key__(key))
+        return value
 
-    def set(self, key: str, value: Any):
-        return self.save_to_file(self.__get_prefixed_key__(key), value)
+    def get_stamp(self, key: str) -> str | None:
+        """Return a stamp that changes whenever the file is rewritten"""
+        try:
+            stat = os.stat(self.get_file_path(self.__get_prefixed_key__(key)))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+    def get_with_stamp(self, key: str) -> tuple[Any, str | None, int]:
+        # Take the stamp first, so a file replaced in between is reloaded on
+        # the next read
+        stamp = self.get_stamp(key)
+        value, size = self.load_from_file(self.__get_prefixed_key__(key))
+        return value, stamp, size
+
+    def set(self, key: str, value: Any, ttl: int | None = None):
+        self.save_to_file(self.__get_prefixed_key__(key), value, ttl)
+        self.evict_if_needed()
+
+    def add(self, key: str, value: Any, ttl: int | None = None) -> bool:
+        # Writers of a key hold its lock, so checking and writing it under
+        # the lock is atomic
+        added = self.save_to_file(
+            self.__get_prefixed_key__(key), value, ttl, if_absent=True
+        )
+        if added:
+            self.evict_if_needed()
+        return added
 
     def delete(self, key: str):
         """
         Delete the file from the cache directory.
         """
+        key = self.__get_prefixed_key__(key)
+        with self.lock(key), contextlib.suppress(FileNotFoundError):
+            size = self.get_file_size(key)
+            os.remove(self.get_file_path(key))
+            self.add_size(-size)
+
+    def run_in_threads(self, function, items: list) -> list:
+        """Apply a function to several items, on a pool of threads"""
+        if len(items) <= 1:
+            return list(map(function, items))
+        workers = min(len(items), self.MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, items))
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        keys = list(keys)
+        return dict(zip(keys, self.run_in_threads(self.get, keys)))
+
+    def set_many(self, values: dict[str, Any], ttl: int | None = None):
+        self.run_in_threads(
+            lambda item: self.save_to_file(
+                self.__get_prefixed_key__(item[0]), item[1], ttl
+            ),
+            list(values.items()),
+        )
+        # Check the size once for the whole batch
+        self.evict_if_needed()
+
+    def delete_many(self, keys: Iterable[str]):
+        self.run_in_threads(self.delete, list(keys))
+
+    def list_files(self) -> list[tuple[str, os.stat_result]]:
+        """Return the names and stats of the cache files"""
+        files = []
+        with os.scandir(self.cache_path) as entries:
+            for entry in entries:
+                # Skip the lock directory and temporary files
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    files.append((entry.name, entry.stat()))
+        return files
+
+    def evict_if_needed(self):
+        """Evict files if the cache has grown past max_size bytes, or if its
+        size is due to be measured.
+        """
+        if not self.max_size:
+            return
+        with self.size_lock:
+            if (
+                self.size is not None
+                and self.size <= self.max_size
+                and time.monotonic() - self.measured_at < self.MEASURE_INTERVAL
+            ):
+                return
+        self.evict()
+
+    def evict(self):
+        """Measure the cache, and remove the least recently read files until
+        it fits in max_size bytes.
+
+        Only the directory entries are read. Expired files are removed when
+        they are read, or evicted like the others once they aren't.
+        """
+        files = sorted(
+            (stat.st_atime_ns, name, stat.st_size)
+            for name, stat in self.list_files()
+        )
+        size = sum(file_size for _, _, file_size in files)
+        for _, name, file_size in files:
+            if size <= self.max_size:
+                break
+            with self.lock(name), contextlib.suppress(FileNotFoundError):
+                os.remove(self.get_file_path(name))
+            size -= file_size
+            self.logger.info(f"Evicted {name} from the cache")
+        with self.size_lock:
+            self.size = size
+            self.measured_at = time.monotonic()
+
+    def stats(self) -> dict:
+        prefix = f"{self.CACHE_PREFIX}_"
+        return self.summarize(
+            {
+                name.removeprefix(prefix): stat.st_size
+                for name, stat in self.list_files()
+            }
+        )
+
+
+class LRUCache:
+    """A thread safe, in-memory LRU cache, bounded by the total size of its
+    entries. Entries expire after ttl seconds.
+
+    Each entry keeps the stamp it was read under and when that stamp was
+    last checked, so they go away with the entry when it is evicted.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> tuple[Any, str, float] | None:
+        """Return the value of a key, its stamp and when the stamp was last
+        checked, if cached.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, stamp, size, expires_at, checked_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value, stamp, checked_at
+
+    def set(self, key: str, value: Any, stamp: str, size: int):
+        with self.lock:
+            self._remove(key)
+            if size > self.max_size:
+                return
+            now = time.monotonic()
+            self.entries[key] = (value, stamp, size, now + self.ttl, now)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def mark_checked(self, key: str, stamp: str):
+        """Record that the stamp of a key was checked, if it is still the
+        cached one.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] == stamp:
+                self.entries[key] = (*entry[:4], time.monotonic())
+
+    def delete(self, key: str):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        if (entry := self.entries.pop(key, None)) is not None:
+            self.size -= entry[2]
+
+
+class TieredCache(Cache):
+    """An in-process LRU cache (L1) in front of another cache (L2).
+
+    Values are kept in L1 pickled, along with the stamp of the L2 entry they
+    were read from. Unpickling is several times faster than decoding them
+    again, and gives every caller its own copy to modify.
+
+    L1 hits check the stamp in L2 at most every check_interval seconds, so
+    values set or deleted by other workers are reloaded within that time.
+    Values set or deleted by this worker are dropped from L1 right away.
+    """
+
+    KIND = "TieredCache"
+
+    def __init__(self, app: Flask, backend: Cache):
+        self.logger = app.logger
+        self.backend = backend
+        self.codec = backend.codec
+        self.l1 = LRUCache(
+            max_size=app.config.get("CACHE_L1_MAX_SIZE"),
+            ttl=app.config.get("CACHE_L1_TTL"),
+        )
+        self.check_interval = app.config.get("CACHE_L1_CHECK_INTERVAL", 0)
+        self.counters = {"hits": 0, "misses": 0, "stale": 0}
+
+    def get(self, key: str):
+        if entry := self.l1.get(key):
+            snapshot, stamp, checked_at = entry
+            fresh = time.monotonic() - checked_at < self.check_interval
+            if not fresh and self.backend.get_stamp(key) == stamp:
+                self.l1.mark_checked(key, stamp)
+                fresh = True
+            if fresh:
+                self.count("hits")
+                return pickle.loads(snapshot)
+            self.count("stale")
+            self.drop(key)
+
+        self.count("misses")
+        value, stamp, _ = self.backend.get_with_stamp(key)
+        if value is not None and stamp is not None:
+            snapshot = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self.l1.set(key, snapshot, stamp, len(snapshot))
+        return value
+
+    def count(self, counter: str):
+        """Increment an L1 counter"""
+        with self.l1.lock:
+            self.counters[counter] += 1
+
+    def drop(self, key: str):
+        """Remove a key from L1"""
+        self.l1.delete(key)
+
+    def set(self, key: str, value: Any, ttl: int | None = None):
+        # The value is only cached in L1 once read back
+        self.drop(key)
+        return self.backend.set(key, value, ttl)
+
+    def add(self, key: str, value: Any, ttl: int | None = None) -> bool:
+        self.drop(key)
+        return self.backend.add(key, value, ttl)
+
+    def delete(self, key: str):
+        self.drop(key)
+        return self.backend.delete(key)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        # Checking the stamps of L1 entries would take a round trip of its
+        # own, so batches are always read from L2
+        return self.backend.get_many(keys)
+
+    def set_many(self, values: dict[str, Any], ttl: int | None = None):
+        for key in values:
+            self.drop(key)
+        return self.backend.set_many(values, ttl)
+
+    def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self.drop(key)
+        return self.backend.delete_many(keys)
+
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        return self.backend.acquire_lock(name, token, ttl)
+
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        return self.backend.renew_lock(name, token, ttl)
+
+    def release_lock(self, name: str, token: str) -> bool:
+        return self.backend.release_lock(name, token)
+
+    def get_lock_owners(self, names: Iterable[str]) -> dict[str, str | None]:
+        return self.backend.get_lock_owners(names)
+
+    def is_available(self):
+        return self.backend.is_available()
+
+    def get_stamp(self, key: str) -> str | None:
+        return self.backend.get_stamp(key)
+
+    def get_with_stamp(self, key: str) -> tuple[Any, str | None, int]:
+        return self.backend.get_with_stamp(key)
+
+    def stats(self) -> dict:
+        """Return the stats of L2, along with the L1 hit, miss and eviction
+        counters, and its size.
+        """
+        with self.l1.lock:
+            l1 = {
+                **self.counters,
+                "evictions": self.l1.evictions,
+                "entries": len(self.l1.entries),
+                "bytes": self.l1.size,
+            }
+        return {**self.backend.stats(), "l1": l1}
+
 
-        def onerror(*args, **kwargs):
-            os.chmod(self.cache_path + "/" + key, 0o777)
+class CacheLock:
+    """A lock shared by every process using the same cache.
 
-        return shutil.rmtree(self.cache_path + "/" + key, onerror=onerror)
+    The lock is held under a random owner token, so only its owner can renew
+    or release it. It expires ttl seconds after it was last renewed, so a
+    crashed owner can't hold it forever. While the lock is held, a heartbeat
+    thread renews it every ttl / 3 seconds.
+
+    Args:
+        timeout: Seconds to wait for the lock, forever if None, or a single
+            attempt if 0.
+    """
+
+    def __init__(
+        self,
+        cache: Cache,
+        name: str,
+        ttl: float = LOCK_TTL,
+        timeout: float | None = None,
+        poll_interval: float = 0.1,
+    ):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.token = None
+        self.heartbeat = None
+        self.stopped = threading.Event()
+        # Set if the lock expired or was taken over while held
+        self.lost = False
+
+    def acquire(self) -> bool:
+        """Wait for the lock. Return False if the timeout is reached."""
+        token = uuid.uuid4().hex
+        deadline = (
+            None if self.timeout is None else time.monotonic() + self.timeout
+        )
+        while not self.cache.acquire_lock(self.name, token, self.ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+        self.token = token
+        self.lost = False
+        self.stopped.clear()
+        self.heartbeat = threading.Thread(
+            target=self.renew, name=f"lock-{self.name}", daemon=True
+        )
+        self.heartbeat.start()
+        return True
+
+    def renew(self):
+        """Renew the lock until it is released"""
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                renewed = self.cache.renew_lock(
+                    self.name, self.token, self.ttl
+                )
+            except redis_exceptions.RedisError as e:
+                self.cache.logger.warning(f"Unable to renew {self.name}: {e}")
+                continue
+            if not renewed:
+                self.lost = True
+                self.cache.logger.warning(f"Lost the {self.name} lock")
+                return
+
+    def release(self):
+        if self.token is None:
+            return
+        self.stopped.set()
+        self.heartbeat.join()
+        self.cache.release_lock(self.name, self.token)
+        self.token = None
+
+    def __enter__(self) -> "CacheLock":
+        if not self.acquire():
+            raise LockTimeout(f"Unable to acquire the {self.name} lock")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
 
 
 class CacheFactory:
@@ -176,12 +1107,16 @@ class CacheFactory:
     def create(app: Flask) -> Cache:
         if app.config.get("REDIS_HOST"):
             app.logger.info("Using RedisCache.")
-            return RedisCache(app)
+            cache = RedisCache(app)
         else:
             app.logger.info(
                 "Redis cache not available. Using FileCache instead."
             )
-            return FileCache(app)
+            cache = FileCache(app)
+
+        if app.config.get("CACHE_L1_MAX_SIZE"):
+            return TieredCache(app, cache)
+        return cache
 
 
 def init_cache(app: Flask) -> Cache:
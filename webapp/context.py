@@ -2,7 +2,6 @@ import os
 from collections.abc import Generator
 from contextlib import contextmanager
 from hashlib import md5
-from time import sleep
 from urllib.parse import unquote, urlparse, urlunparse
 
 from flask import current_app, redirect, request
@@ -52,20 +51,26 @@ def clear_trailing_slash():
 
 
 DB_LOCK_NAME = "db_lock"
+# Seconds to wait for another process to finish its migrations
+DB_LOCK_TIMEOUT = 600
 
 
 @contextmanager
-def database_lock() -> Generator:
+def database_lock(timeout: float = DB_LOCK_TIMEOUT) -> Generator:
     """A context manager for acquiring a lock to control access
     to a shared db.
 
     This function creates a distributed lock using the available Cache to
     ensure only one process can access a protected resource at a time. If the
-    lock is already acquired by another process, this will poll every 2 seconds
-    until the lock is released.
+    lock is already acquired by another process, this waits for it to be
+    released, for up to timeout seconds. The lock is renewed while held, and
+    expires if its owner dies, so a crashed process can't hold it forever.
 
     Yields:
-        The current lock status from the cache
+        The held lock
+
+    Raises:
+        LockTimeout: If the lock wasn't released in time
 
     Example:
         with database_lock():
@@ -73,14 +78,8 @@ def database_lock() -> Generator:
 
     """
     cache = init_cache(current_app)
-    locked = cache.get(DB_LOCK_NAME)
-    while locked:
-        sleep(2)
-    try:
-        cache.set(DB_LOCK_NAME, 1)
-        yield cache.get(DB_LOCK_NAME)
-    finally:
-        cache.set(DB_LOCK_NAME, 0)
+    with cache.get_lock(DB_LOCK_NAME, timeout=timeout) as lock:
+        yield lock
 
 
 class RegexConverter(BaseConverter):
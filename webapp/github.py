@@ -1,15 +1,17 @@
 import json
 import logging
 import shutil
+import time
 from pathlib import Path
 
 import flask
 import requests
 from git import Repo
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 from flask.app import Flask
 
-from webapp.settings import BASE_DIR, GH_TOKEN, REPO_ORG
-from webapp.site_repository import BACKGROUND_TASK_RUNNING_PREFIX
+from webapp.settings import BASE_DIR, GH_TOKEN, REPO_CLONE_DEPTH, REPO_ORG
+from webapp.site_repository import get_sync_lock_name
 
 # Configure logger
 logging.basicConfig(
@@ -28,6 +30,7 @@ class Tree:
 
 GITHUB_API_URL = "https://api.github.com/"
 MAX_RETRIES = 5
+SYNC_METRICS_KEY = "GIT_SYNC_METRICS"
 
 
 class GithubError(Exception):
@@ -80,7 +83,109 @@ class GitHub:
         )
         raise GithubError(err)
 
-    def clone_repository(self, repository: str):
+    def clone_repository(self, repository: str) -> bool:
+        """Bring the local checkout of a repository up to date.
+
+        If a checkout already exists, only the new objects are fetched into
+        it and the working tree is moved to the fetched commit. A full
+        (shallow) clone is only made on the first run, or when the existing
+        checkout is missing or corrupt. Other failures, like network errors,
+        are raised, and the checkout is kept as it is.
+
+        Args:
+            repository (str): The repository name.
+
+        Returns:
+            bool: False if another process is already syncing the repository.
+        """
+        repository_path = self.REPOSITORY_PATH / repository
+
+        # The lock is renewed while the sync runs, and expires if the process
+        # dies, so a crashed sync doesn't block the next ones
+        lock = self.cache.get_lock(get_sync_lock_name(repository), timeout=0)
+        if not lock.acquire():
+            logger.info(f"{repository} is already being synced")
+            return False
+
+        try:
+            start = time.perf_counter()
+            try:
+                mode = "fetch"
+                self.fetch_repository(repository, repository_path)
+            except (InvalidGitRepositoryError, NoSuchPathError) as e:
+                if repository_path.exists():
+                    logger.warning(
+                        f"Unable to update {repository} in place, "
+                        f"falling back to a full clone: {e}"
+                    )
+                mode = "clone"
+                self.full_clone_repository(repository)
+            self.record_sync_timing(
+                repository, mode, time.perf_counter() - start
+            )
+        finally:
+            lock.release()
+        return True
+
+    def fetch_repository(self, repository: str, repository_path: Path):
+        """Fetch the latest commit of the checked out branch into an existing
+        checkout, and reset the working tree to it.
+
+        Raises:
+            NoSuchPathError, InvalidGitRepositoryError: If there is no usable
+                checkout at repository_path, or it is corrupt.
+            GitCommandError: If fetching or resetting fails otherwise, e.g.
+                because the remote can't be reached.
+
+        Returns:
+            bool: Whether the working tree changed.
+        """
+        repo = self.open_checkout(repository_path)
+        branch = repo.active_branch.name
+        remote_ref = f"refs/remotes/origin/{branch}"
+        fetch_args = {"depth": REPO_CLONE_DEPTH} if REPO_CLONE_DEPTH else {}
+        logger.info(f"Fetching {repository} ({branch}) into {repository_path}")
+        try:
+            repo.remotes.origin.fetch(
+                f"+refs/heads/{branch}:{remote_ref}",
+                **fetch_args,
+            )
+
+            fetched = repo.commit(remote_ref).hexsha
+            if fetched == repo.head.commit.hexsha:
+                logger.info(f"{repository} is already up to date at {fetched}")
+                return False
+
+            # Only files that differ between both commits are rewritten
+            repo.git.reset("--hard", remote_ref)
+            repo.git.clean("-fd")
+        except GitCommandError as e:
+            # Only a corrupt checkout is worth cloning again
+            try:
+                repo.git.fsck("--connectivity-only")
+            except GitCommandError:
+                raise InvalidGitRepositoryError(repository_path) from e
+            raise
+        logger.info(f"Updated {repository} to {fetched}")
+        return True
+
+    def open_checkout(self, repository_path: Path) -> Repo:
+        """Open a checkout, on a branch whose head commit can be read.
+
+        Raises:
+            NoSuchPathError, InvalidGitRepositoryError: If there is no usable
+                checkout at repository_path.
+        """
+        repo = Repo(repository_path)
+        if repo.bare or repo.head.is_detached:
+            raise InvalidGitRepositoryError(repository_path)
+        try:
+            repo.git.rev_parse("--verify", "HEAD^{commit}")
+        except GitCommandError as e:
+            raise InvalidGitRepositoryError(repository_path) from e
+        return repo
+
+    def full_clone_repository(self, repository: str):
         """Clone repository into a duplicate folder, then replace the original.
 
         Args:
@@ -93,10 +198,10 @@ class GitHub:
         if temp_path.exists():
             shutil.rmtree(temp_path)
 
-        # Set the lock
-        self.cache.set(
-            f"{BACKGROUND_TASK_RUNNING_PREFIX}-{repository}",
-            1,
+        clone_args = (
+            {"depth": REPO_CLONE_DEPTH, "single_branch": True}
+            if REPO_CLONE_DEPTH
+            else {}
         )
 
         retries = 1
@@ -109,6 +214,7 @@ class GitHub:
                 Repo.clone_from(
                     f"{REPO_ORG}/{repository}.git",
                     temp_path,
+                    **clone_args,
                 )
                 logger.info(
                     f"Finished cloning {repository} in {retries} retries"
@@ -140,10 +246,6 @@ class GitHub:
                     # Clean up temp folder if cloning failed
                     if temp_path.exists():
                         shutil.rmtree(temp_path)
-                    self.cache.set(
-                        f"{BACKGROUND_TASK_RUNNING_PREFIX}-{repository}",
-                        0,
-                    )
                     raise GithubError(
                         f"Failed to clone {repository} after "
                         f"{retries} retries."
@@ -154,9 +256,34 @@ class GitHub:
                 )
                 retries += 1
 
+    def record_sync_timing(self, repository: str, mode: str, seconds: float):
+        """Keep per-repository timings of the fetch and clone sync paths in
+        the cache, so both can be compared.
+        """
+        metrics = self.cache.get(SYNC_METRICS_KEY) or {}
+        # Build new dicts rather than update the cached ones in place
+        previous = metrics.get(repository, {}).get(
+            mode, {"count": 0, "total_seconds": 0.0}
+        )
+        repository_metrics = {
+            **metrics.get(repository, {}),
+            mode: {
+                "count": previous["count"] + 1,
+                "total_seconds": previous["total_seconds"] + seconds,
+                "last_seconds": seconds,
+            },
+        }
         self.cache.set(
-            f"{BACKGROUND_TASK_RUNNING_PREFIX}-{repository}",
-            0,
+            SYNC_METRICS_KEY, {**metrics, repository: repository_metrics}
+        )
+
+        averages = ", ".join(
+            f"{name}: {m['total_seconds'] / m['count']:.2f}s avg over "
+            f"{m['count']} runs"
+            for name, m in repository_metrics.items()
+        )
+        logger.info(
+            f"Synced {repository} via {mode} in {seconds:.2f}s ({averages})"
         )
 
 
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from enum import Enum
 
 import requests
@@ -6,6 +7,9 @@ from requests.models import Response
 
 from webapp.models import JiraTask, Project, User, Webpage, db, get_or_create
 
+# Statements are sent to the database in batches of this many rows
+BULK_BATCH_SIZE = 1000
+
 
 class RequestType(Enum):
     COPY_UPDATE = 0
@@ -13,6 +17,12 @@ class RequestType(Enum):
     NEW_WEBPAGE = 2
 
 
+def batches(rows: list, size: int = BULK_BATCH_SIZE):
+    """Split rows into lists of at most size rows"""
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]  # noqa: E203
+
+
 def get_or_create_user_id(user, return_obj=False):
     # If user does not exist, create a new user in the "users" table
     user_email = user.get("email")
@@ -161,6 +171,9 @@ def convert_webpage_to_dict(webpage, owner, project):
         for reviewer in reviewers:
             reviewer_dict = reviewer.__dict__.copy()
             reviewer_dict.pop("_sa_instance_state", None)
+            # Loaded relationships are expanded below, or not serialized
+            reviewer_dict.pop("user", None)
+            reviewer_dict.pop("webpages", None)
             reviewer_dict["created_at"] = reviewer.created_at.isoformat()
             reviewer_dict["updated_at"] = reviewer.updated_at.isoformat()
             # Expand the user object
@@ -180,6 +193,9 @@ def convert_webpage_to_dict(webpage, owner, project):
         for jira_task in jira_tasks:
             jira_task_dict = jira_task.__dict__.copy()
             jira_task_dict.pop("_sa_instance_state", None)
+            # Loaded relationships are expanded below, or not serialized
+            jira_task_dict.pop("user", None)
+            jira_task_dict.pop("webpages", None)
             jira_task_dict["created_at"] = jira_task.created_at.isoformat()
             jira_task_dict["updated_at"] = jira_task.updated_at.isoformat()
             # Expand the user object
@@ -227,33 +243,106 @@ def create_copy_doc(app, webpage):
     return f"https://docs.google.com/document/d/{task['id']}" if task else None
 
 
-# recursively build tree from webpages table rows
-def build_tree(session, page, webpages):
-    child_pages = list(filter(lambda p: p.parent_id == page["id"], webpages))
-    for child_page in child_pages:
-        project = get_or_create(session, Project, id=child_page.project_id)
-        owner = get_or_create(session, User, id=child_page.owner_id)
-        new_child = convert_webpage_to_dict(child_page, owner, project)
-        new_child["children"] = []
-        page["children"].append(new_child)
-        build_tree(session, new_child, webpages)
+def index_children(webpages):
+    """Group webpages by their parent_id, keeping their order"""
+    children = defaultdict(list)
+    for webpage in webpages:
+        children[webpage.parent_id].append(webpage)
+    return children
+
+
+def load_owners_and_projects(session, webpages):
+    """Load the owners and projects of webpages with one query each, and
+    return them indexed by id.
+
+    The instances stay in the session, so accessing webpage.owner or
+    webpage.project afterwards doesn't query the database.
+    """
+    owner_ids = {webpage.owner_id for webpage in webpages} - {None}
+    project_ids = {webpage.project_id for webpage in webpages} - {None}
+    owners = (
+        session.query(User).filter(User.id.in_(owner_ids)).all()
+        if owner_ids
+        else []
+    )
+    projects = (
+        session.query(Project).filter(Project.id.in_(project_ids)).all()
+        if project_ids
+        else []
+    )
+    return (
+        {owner.id: owner for owner in owners},
+        {project.id: project for project in projects},
+    )
+
+
+# build tree from webpages table rows
+def build_tree(
+    session, page, webpages, children=None, owners=None, projects=None
+):
+    """Append the descendants of page, found in webpages, to
+    page["children"].
+
+    Children are looked up in an index of webpages by parent_id, so the tree
+    is built in a single pass over webpages.
+    """
+    if children is None:
+        children = index_children(webpages)
+    if owners is None or projects is None:
+        owners, projects = load_owners_and_projects(session, webpages)
+
+    visited = {page["id"]}
+    stack = [page]
+    while stack:
+        node = stack.pop()
+        for child_page in children.get(node["id"], []):
+            # Guard against parent_id cycles
+            if child_page.id in visited:
+                continue
+            visited.add(child_page.id)
+            new_child = convert_webpage_to_dict(
+                child_page,
+                owners.get(child_page.owner_id),
+                projects.get(child_page.project_id),
+            )
+            new_child["children"] = []
+            node["children"].append(new_child)
+            stack.append(new_child)
 
 
-def get_tree_struct(session, webpages):
+def get_tree_struct(session, webpages, root_id=None):
+    """Return the tree of webpages rooted at the webpage with root_id, or at
+    the webpage without a parent if root_id is not given.
+    """
     # sort webpages list by their name
     webpages_list = sorted(
         list(webpages), key=lambda p: p.name.rsplit("/", 1)[-1]
     )
-    parent_page = next(
-        filter(lambda p: p.parent_id is None, webpages_list), None
-    )
+    if root_id is None:
+        parent_page = next(
+            filter(lambda p: p.parent_id is None, webpages_list), None
+        )
+    else:
+        parent_page = next(
+            filter(lambda p: p.id == root_id, webpages_list), None
+        )
 
     if parent_page:
-        project = get_or_create(session, Project, id=parent_page.project_id)
-        owner = get_or_create(session, User, id=parent_page.owner_id)
-        tree = convert_webpage_to_dict(parent_page, owner, project)
+        owners, projects = load_owners_and_projects(session, webpages_list)
+        tree = convert_webpage_to_dict(
+            parent_page,
+            owners.get(parent_page.owner_id),
+            projects.get(parent_page.project_id),
+        )
         tree["children"] = []
-        build_tree(session, tree, webpages_list)
+        build_tree(
+            session,
+            tree,
+            webpages_list,
+            children=index_children(webpages_list),
+            owners=owners,
+            projects=projects,
+        )
         return tree
 
     return None
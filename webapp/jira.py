@@ -1,15 +1,21 @@
 from __future__ import annotations
 
 import json
+import math
+import os
+import random
 import threading
 import time
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 from flask import request
 import redis
 import requests
+from requests.adapters import HTTPAdapter
 
-from webapp.helper import RequestType
+from webapp.helper import RequestType, batches
 from webapp.models import User, db
 
 
@@ -17,6 +23,118 @@ class JiraError(Exception):
     pass
 
 
+class JiraRequestError(JiraError):
+    """Exception raised for Jira requests that failed, after their retries"""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class JiraUnavailableError(JiraError):
+    """Exception raised instead of calling Jira while it is failing"""
+
+
+class RateLimiter:
+    """A token bucket, which lets through `rate` requests per second on
+    average, and bursts of up to `rate` requests.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        # Set when Jira asks to slow down, to hold every request back
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: float | None = None) -> float | None:
+        """Wait for a token.
+
+        Args:
+            timeout (float): The most seconds to wait.
+
+        Returns:
+            float: The seconds waited, or None if no token was available in
+                time.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate,
+                )
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(
+                    self.paused_until - now, (1 - self.tokens) / self.rate
+                )
+            if timeout is not None and waited + delay > timeout:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float):
+        """Hold all the requests back for a number of seconds"""
+        with self.lock:
+            self.paused_until = max(
+                self.paused_until, time.monotonic() + seconds
+            )
+
+
+class CircuitBreaker:
+    """Fail fast once Jira has failed `threshold` calls in a row.
+
+    The circuit stays open for `reset_timeout` seconds, after which a single
+    call is let through to probe Jira. The circuit closes again if it
+    succeeds, and stays open for another `reset_timeout` if it fails. A
+    throttled call is neither, and lets another call probe Jira.
+
+    Every call let through must record its outcome.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or (
+                time.monotonic() - self.opened_at < self.reset_timeout
+            ):
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_throttled(self):
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
 class Jira:
     headers = {
         "Accept": "application/json",
@@ -26,11 +144,39 @@ class Jira:
     SUBTASK = "10013"
     BUG = "10015"
 
+    API_URL = "https://api.atlassian.com"
+    AUTH_URL = "https://auth.atlassian.com"
+    # Issues are searched for in batches of this many keys, which keeps the
+    # JQL short and fits a page of results
+    SEARCH_BATCH_SIZE = 100
+
+    # Failed requests are retried after an exponential backoff, from
+    # RETRY_BACKOFF seconds, with jitter. Jira's Retry-After is followed, up
+    # to MAX_RETRY_DELAY seconds.
+    RETRY_BACKOFF = 0.5
+    MAX_RETRY_DELAY = 60
+    # Seconds a request is retried for, at most, unless the client is given
+    # another max_retry_time
+    MAX_RETRY_TIME = 10
+    # Jira is throttling, and didn't process the request
+    THROTTLED_STATUSES = (429, 503)
+    # The request might have been processed, only retry idempotent ones
+    SERVER_ERROR_STATUSES = (500, 502, 504)
+
     REDIS_TOKEN_KEY = "JIRA_OAUTH_TOKEN"
     REDIS_CLOUD_ID_KEY = "JIRA_CLOUD_ID"
 
     _token_lock = threading.Lock()
 
+    # One pooled session per process, shared by the Jira clients in it,
+    # along with its rate limit, circuit breaker and request counters
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+    _rate_limiter = None
+    _circuit_breaker = None
+    stats = Counter()
+
     def __init__(
         self,
         url: str,
@@ -40,6 +186,13 @@ class Jira:
         copy_updates_epic: str,
         sites_maintenance_epic: str,
         redis_url: str | None = None,
+        pool_size: int = 10,
+        timeout: tuple[float, float] = (5, 30),
+        rate_limit: float = 10,
+        max_retries: int = 4,
+        max_retry_time: float = MAX_RETRY_TIME,
+        circuit_threshold: int = 5,
+        circuit_reset_timeout: float = 60,
     ):
         """
         Initialize the Jira object.
@@ -53,6 +206,19 @@ class Jira:
             sites_maintenance_epic (str): The key of the epic for sites
                 maintenance.
             redis_url (str): Redis connection URL for shared token caching.
+            pool_size (int): The number of connections kept open to each
+                Jira host.
+            timeout (tuple): The connect and read timeouts of requests, in
+                seconds.
+            rate_limit (float): The requests per second sent to Jira.
+            max_retries (int): The retries of failed requests.
+            max_retry_time (float): The most seconds spent retrying a
+                request, waits included. Keep it short for requests made
+                while a user waits for a response.
+            circuit_threshold (int): The failed requests in a row after
+                which Jira isn't called anymore.
+            circuit_reset_timeout (float): The seconds after which Jira is
+                called again.
         """
         self.url = url
         self.labels = labels
@@ -61,26 +227,69 @@ class Jira:
         self.copy_updates_epic = copy_updates_epic
         self.sites_maintenance_epic = sites_maintenance_epic
         self._redis = redis.from_url(redis_url) if redis_url else None
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.max_retry_time = max_retry_time
+        self.circuit_threshold = circuit_threshold
+        self.circuit_reset_timeout = circuit_reset_timeout
         self._cloud_id = None
         self._access_token = None
         self._expires_at = 0
         self._connect()
 
     def __request__(
-        self, method: str, path: str, data: dict = {}, params: dict = {}
+        self,
+        method: str,
+        path: str,
+        data: dict = {},
+        params: dict = {},
+        idempotent: bool | None = None,
     ):
+        """Make a request to the Jira API.
+
+        Requests are rate limited, and retried for up to max_retry_time
+        seconds when Jira is throttling or failing. Requests that might have
+        been processed, like timed out ones, are only retried if they are
+        idempotent, which by default only GET, PUT and DELETE requests are.
+
+        Raises:
+            JiraRequestError: If the request fails.
+            JiraUnavailableError: If Jira has been failing, and isn't called.
+        """
         if data:
             data = json.dumps(data)
+        if idempotent is None:
+            idempotent = method in ("GET", "PUT", "DELETE")
         session = self.get_jira_client()
-        base = "https://api.atlassian.com/ex/jira"
+        breaker = Jira._circuit_breaker
+        if not breaker.allow():
+            Jira.stats["short_circuited"] += 1
+            raise JiraUnavailableError(
+                "Jira is unavailable, not retrying for "
+                f"{breaker.reset_timeout}s"
+            )
+
+        base = f"{self.API_URL}/ex/jira"
         url = f"{base}/{self._cloud_id}/rest/api/3/{path}"
-        response = session.request(
-            method,
-            url,
-            data=data,
-            headers=self.headers,
-            params=params,
-        )
+        # Whatever happens, the outcome is recorded, or a failed probe would
+        # leave the circuit open for good
+        record_outcome = breaker.record_failure
+        try:
+            response = self._send(
+                session, method, url, data, params, idempotent
+            )
+            if response.status_code == 429:
+                record_outcome = breaker.record_throttled
+            elif response.status_code < 500:
+                record_outcome = breaker.record_success
+        except JiraRequestError as error:
+            if error.status_code == 429:
+                record_outcome = breaker.record_throttled
+            raise
+        finally:
+            record_outcome()
 
         if response.status_code == 200 or response.status_code == 201:
             return response.json()
@@ -90,12 +299,131 @@ class Jira:
                 "response": "No content",
             }
 
-        raise Exception(
+        Jira.stats["failures"] += 1
+        raise JiraRequestError(
             "Failed to make a request to Jira. Status code:"
             f" {path} {method} {data} {params}"
-            f" {response.status_code}. Response: {response.text}"
+            f" {response.status_code}. Response: {response.text}",
+            status_code=response.status_code,
         )
 
+    def _send(
+        self,
+        session: requests.Session,
+        method: str,
+        url: str,
+        data,
+        params: dict,
+        idempotent: bool,
+    ) -> requests.Response:
+        """Send a request, rate limited, and retry it while it fails and
+        max_retry_time isn't spent.
+
+        Returns:
+            requests.Response: The last response.
+
+        Raises:
+            JiraRequestError: If the request couldn't be sent, or no rate
+                limit token was available in time.
+        """
+        deadline = time.monotonic() + self.max_retry_time
+        for attempt in range(self.max_retries + 1):
+            waited = Jira._rate_limiter.acquire(
+                timeout=max(0, deadline - time.monotonic())
+            )
+            if waited is None:
+                Jira.stats["failures"] += 1
+                raise JiraRequestError(
+                    f"Jira is throttling requests: {method} {url}",
+                    status_code=429,
+                )
+            if waited:
+                Jira.stats["rate_limited"] += 1
+            Jira.stats["requests"] += 1
+            error = response = None
+            try:
+                response = session.request(
+                    method,
+                    url,
+                    data=data,
+                    headers=self.headers,
+                    params=params,
+                    timeout=self.timeout,
+                )
+            except requests.exceptions.RequestException as e:
+                error = e
+                retry = idempotent or isinstance(
+                    e, requests.exceptions.ConnectTimeout
+                )
+                delay = self.get_retry_delay(attempt)
+            else:
+                status_code = response.status_code
+                if status_code in self.THROTTLED_STATUSES:
+                    Jira.stats["throttled"] += 1
+                retry = status_code in self.THROTTLED_STATUSES or (
+                    idempotent and status_code in self.SERVER_ERROR_STATUSES
+                )
+                delay = self.get_retry_delay(attempt, response)
+                if status_code == 429 and delay is not None:
+                    # Jira is throttling the client, not this request
+                    Jira._rate_limiter.pause(delay)
+
+            if (
+                not retry
+                or attempt == self.max_retries
+                or delay is None
+                or time.monotonic() + delay > deadline
+            ):
+                break
+            Jira.stats["retries"] += 1
+            if response is None or response.status_code != 429:
+                time.sleep(delay)
+
+        if error is not None:
+            Jira.stats["failures"] += 1
+            raise JiraRequestError(
+                f"Failed to make a request to Jira: {method} {url}. "
+                f"Error: {error}"
+            ) from error
+        return response
+
+    def get_retry_delay(
+        self, attempt: int, response: requests.Response | None = None
+    ) -> float | None:
+        """Return the seconds to wait before retrying a request.
+
+        Jira's Retry-After header is followed when it is set. Otherwise the
+        delay doubles with each attempt, and is picked at random up to that,
+        so that clients that failed together don't retry together.
+
+        Returns:
+            float: The delay, or None if Jira asks to wait longer than
+                MAX_RETRY_DELAY.
+        """
+        # Responses with an error status are falsy
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                except (TypeError, ValueError):
+                    retry_at = None
+                if retry_at is not None:
+                    now = datetime.now(timezone.utc)
+                    delay = (retry_at - now).total_seconds()
+                else:
+                    delay = 0
+            if delay > self.MAX_RETRY_DELAY:
+                return None
+            if delay > 0:
+                return delay
+        backoff = min(self.MAX_RETRY_DELAY, self.RETRY_BACKOFF * 2**attempt)
+        return random.uniform(0, backoff)
+
     def _connect(self):
         """
         Connect to Jira API and obtain access token, then resolve the cloud ID.
@@ -118,9 +446,10 @@ class Jira:
             if cached:
                 return cached.decode()
 
-        response = requests.get(
-            "https://api.atlassian.com/oauth/token/accessible-resources",
+        response = self.get_session().get(
+            f"{self.API_URL}/oauth/token/accessible-resources",
             headers={"Authorization": f"Bearer {access_token}"},
+            timeout=self.timeout,
         )
 
         if response.status_code != 200:
@@ -183,12 +512,41 @@ class Jira:
             except redis.exceptions.RedisError:
                 return
 
+    def get_session(self) -> requests.Session:
+        """Return the pooled session of the process, creating it on first
+        use.
+
+        Connections to Jira are kept open and reused by every request of the
+        process, from any thread. Forked processes create their own session,
+        rather than share the sockets of their parent's, and their own rate
+        limiter, circuit breaker and counters.
+        """
+        pid = os.getpid()
+        if Jira._session is None or Jira._session_pid != pid:
+            with self._session_lock:
+                if Jira._session is None or Jira._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    Jira._rate_limiter = RateLimiter(self.rate_limit)
+                    Jira._circuit_breaker = CircuitBreaker(
+                        self.circuit_threshold, self.circuit_reset_timeout
+                    )
+                    Jira.stats = Counter()
+                    Jira._session, Jira._session_pid = session, pid
+        return Jira._session
+
     def _build_session(self):
-        """Build a requests.Session with the current bearer token set."""
-        session = requests.Session()
-        session.headers.update(
-            {"Authorization": f"Bearer {self._access_token}"}
-        )
+        """Return the pooled session, with the current bearer token set.
+
+        Only the Authorization header changes when the token is rotated, so
+        the open connections are kept.
+        """
+        session = self.get_session()
+        authorization = f"Bearer {self._access_token}"
+        if session.headers.get("Authorization") != authorization:
+            session.headers["Authorization"] = authorization
         return session
 
     def _token_is_valid(self, buffer_seconds: int = 300) -> bool:
@@ -241,7 +599,7 @@ class Jira:
         Raises:
             JiraError: If the token request fails.
         """
-        token_url = "https://auth.atlassian.com/oauth/token"
+        token_url = f"{self.AUTH_URL}/oauth/token"
 
         data = {
             "grant_type": "client_credentials",
@@ -250,10 +608,15 @@ class Jira:
             "audience": "api.atlassian.com",
         }
 
-        response = requests.post(
+        response = self.get_session().post(
             token_url,
             json=data,
-            headers={"Content-Type": "application/json"},
+            # Don't send the expired token along
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": None,
+            },
+            timeout=self.timeout,
         )
 
         if response.status_code != 200:
@@ -473,6 +836,112 @@ class Jira:
             path=f"issue/{jira_id}?fields=status",
         )
 
+    def search_issues(self, jql: str, fields: list[str]):
+        """Search for Jira issues, following the pages of results.
+
+        Args:
+            jql (str): The JQL query.
+            fields (list[str]): The fields to return for each issue.
+
+        Yields:
+            dict: The issues matching the query.
+        """
+        payload = {
+            "jql": jql,
+            "fields": fields,
+            "maxResults": self.SEARCH_BATCH_SIZE,
+        }
+        while True:
+            # Searches only read issues
+            response = self.__request__(
+                method="POST",
+                path="search/jql",
+                data=payload,
+                idempotent=True,
+            )
+            yield from response.get("issues", [])
+            if response.get("isLast", True) or not response.get(
+                "nextPageToken"
+            ):
+                return
+            payload["nextPageToken"] = response["nextPageToken"]
+
+    def get_issues_statuses(self, jira_ids: list[str]) -> dict[str, str]:
+        """Get the statuses of several Jira issues, with one search per
+        batch of keys instead of one request per issue.
+
+        A search is rejected as a whole if one of its keys doesn't exist
+        anymore, so the issues of a rejected batch are fetched one at a time,
+        and the missing ones are left out. Other failures are raised, rather
+        than returning the statuses of some of the issues.
+
+        Args:
+            jira_ids (list[str]): The keys of the Jira issues.
+
+        Returns:
+            dict: The status name of each issue, by key.
+        """
+        statuses = {}
+        for keys in batches(jira_ids, self.SEARCH_BATCH_SIZE):
+            jql = self.get_keys_jql(keys)
+            try:
+                for issue in self.search_issues(jql, fields=["status"]):
+                    statuses[issue["key"]] = issue["fields"]["status"]["name"]
+            except JiraRequestError as error:
+                if error.status_code != 400:
+                    raise
+                for key in keys:
+                    try:
+                        issue = self.get_issue_statuses(key)
+                    except JiraRequestError as error:
+                        if error.status_code != 404:
+                            raise
+                        continue
+                    statuses[key] = issue["fields"]["status"]["name"]
+        return statuses
+
+    @staticmethod
+    def get_keys_jql(keys: list[str]) -> str:
+        return "key in ({})".format(", ".join(f'"{key}"' for key in keys))
+
+    def get_updated_issues_statuses(
+        self, project: str, jira_ids: list[str], since: float
+    ) -> dict[str, str]:
+        """Get the statuses of some issues of a Jira project, of the ones
+        updated since a given time, with a single search per batch of keys if
+        nothing changed.
+
+        Only the given issues are searched for, not every issue of the
+        project, most of which aren't tracked. Batches rejected because one
+        of their issues doesn't exist anymore are fetched like in
+        get_issues_statuses.
+
+        Args:
+            project (str): The key of the Jira project.
+            jira_ids (list[str]): The keys of the issues, in the project.
+            since (float): The timestamp to look for updates from.
+
+        Returns:
+            dict: The status name of each updated issue, by key.
+        """
+        # JQL dates are read in the time zone of the user, relative ones
+        # aren't. They are precise to the minute, so round up.
+        minutes = math.ceil((time.time() - since) / 60) + 1
+        statuses = {}
+        for keys in batches(jira_ids, self.SEARCH_BATCH_SIZE):
+            jql = (
+                f'project = "{project}" AND updated >= "-{minutes}m" '
+                f"AND {self.get_keys_jql(keys)}"
+            )
+            try:
+                for issue in self.search_issues(jql, fields=["status"]):
+                    statuses[issue["key"]] = issue["fields"]["status"]["name"]
+            except JiraRequestError as error:
+                if error.status_code != 400:
+                    raise
+                statuses.update(self.get_issues_statuses(keys))
+        return statuses
+
     def bulk_change_issue_status(self, payload) -> bool:
         """Change the status of a Jira issue.
 
@@ -578,6 +1047,16 @@ def init_jira(app):
             copy_updates_epic=app.config["JIRA_COPY_UPDATES_EPIC"],
             sites_maintenance_epic=app.config.get("SITES_MAINTENANCE_EPIC"),
             redis_url=app.config.get("REDIS_DB_CONNECT_STRING"),
+            pool_size=app.config["JIRA_POOL_SIZE"],
+            timeout=(
+                app.config["JIRA_CONNECT_TIMEOUT"],
+                app.config["JIRA_READ_TIMEOUT"],
+            ),
+            rate_limit=app.config["JIRA_RATE_LIMIT"],
+            max_retries=app.config["JIRA_MAX_RETRIES"],
+            max_retry_time=app.config["JIRA_MAX_RETRY_TIME"],
+            circuit_threshold=app.config["JIRA_CIRCUIT_THRESHOLD"],
+            circuit_reset_timeout=app.config["JIRA_CIRCUIT_RESET_TIMEOUT"],
         )
     except Exception as error:
         app.logger.info(f"Unable to initialize jira: {error}")
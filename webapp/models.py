@@ -82,6 +82,8 @@ class Project(db.Model, DateTimeMixin):
 
     id: int = Column(Integer, primary_key=True)
     name: str = Column(String, nullable=False)
+    # Repository commit the webpages were last synchronised from
+    last_commit_sha: str = Column(String, nullable=True)
     webpages = relationship("Webpage", back_populates="project")
 
 
@@ -89,13 +91,13 @@ class Webpage(db.Model, DateTimeMixin):
     __tablename__ = "webpages"
 
     id: int = Column(Integer, primary_key=True)
-    project_id: int = Column(Integer, ForeignKey("projects.id"))
+    project_id: int = Column(Integer, ForeignKey("projects.id"), index=True)
     name: str = Column(String, nullable=False)
     url: str = Column(String, nullable=False)
     title: str = Column(String)
     description: str = Column(String)
     copy_doc_link: str = Column(String)
-    parent_id: int = Column(Integer, ForeignKey("webpages.id"))
+    parent_id: int = Column(Integer, ForeignKey("webpages.id"), index=True)
     owner_id: int = Column(Integer, ForeignKey("users.id"))
     status: str = Column(Enum(WebpageStatus), default=WebpageStatus.AVAILABLE)
     ext: str = Column(String, nullable=True)
@@ -1,4 +1,6 @@
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from pathlib import Path
 
@@ -25,20 +27,28 @@ TAG_MAPPING = {
 
 EXCLUDE_PATHS = ["partials", "shared"]
 
+EXTENDS_PATTERN = re.compile("{% extends [\"'](.*?)[\"'] %}")
+WRAPPER_TEMPLATE_PATTERN = re.compile(
+    r"wrapper_template:\s*[\"']?(.*?)[\"']?$", re.MULTILINE
+)
+ENDBLOCK_PATTERN = re.compile("{%( *)endblock")
+BLOCK_PATTERNS = {
+    variant: re.compile(f"{{% block {variant}( *)%}}")
+    for variants in TAG_MAPPING.values()
+    for variant in variants
+}
+MARKDOWN_TAG_PATTERNS = {
+    variant: re.compile(rf"^\s*{variant}\s*:\s*\"?(.+?)\"?\s*$", re.IGNORECASE)
+    for variants in TAG_MAPPING.values()
+    for variant in variants
+}
+NAME_PATTERN = re.compile(r"(?i)(.html|/index.html|/index.md)")
+
 
 def is_index(path):
     return path.name == "index.html" or path.name == "index.md"
 
 
-def check_has_index(path):
-    if (path / "index.html").exists():
-        return True, ".html"
-    elif (path / "index.md").exists():
-        return True, ".md"
-    else:
-        return False, None
-
-
 def is_template(path):
     """
     Return True if the file name starts with a template prefix.
@@ -79,30 +89,72 @@ def append_base_path(base, path_name):
     return new_path.absolute()
 
 
-def extends_base(path, base="templates"):
-    """Return true if path extends templates/base.html"""
-    # TODO: Investigate whether path.read_text performs better than opening
-    # a file
+class TemplateCache:
+    """
+    Layouts resolved while scanning a tree. Sites have thousands of pages
+    that share a handful of layouts, so a cache is kept for each
+    scan_directory call to read and resolve every layout at most once.
+    """
+
+    def __init__(self):
+        # Template path -> {"reaches_base": bool, "parent": str | None}
+        self.extends = {}
+        # Template path -> copydoc link
+        self.copydocs = {}
+
+
+def extends_base(path, base="templates", cache=None, chain=()):
+    """Return true if path extends templates/base.html
+
+    Args:
+        cache (TemplateCache): Resolutions to reuse and update.
+        chain (tuple): Templates already visited while resolving the current
+            extends chain, used to detect cycles.
+    """
+    key = str(path)
+    if cache is not None and key in cache.extends:
+        return cache.extends[key]["reaches_base"]
+    if key in chain:
+        # A template that (indirectly) extends itself never reaches a base
+        return False
+
+    parent = None
+    reaches_base = False
     with suppress(FileNotFoundError):
         with path.open("r") as f:
-            for line in f.readlines():
-                match = re.search("{% extends [\"'](.*?)[\"'] %}", line)
-                if match:
-                    if match.group(1) in BASE_TEMPLATES:
-                        return True
-                    else:
-                        # extract absolute path from the parent path
-                        absolute_path = str(path)[
-                            0 : str(path).find(base) + len(base)  # noqa: E203
-                        ]
-                        # check if the file from which the current file
-                        # extends extends from the base template
-                        new_path = append_base_path(
-                            absolute_path, match.group(1)
-                        )
-                        return extends_base(new_path, base=base)
+            for line in f:
+                if match := EXTENDS_PATTERN.search(line):
+                    parent = match.group(1)
+                    reaches_base = extended_template_reaches_base(
+                        path,
+                        parent,
+                        base=base,
+                        cache=cache,
+                        chain=(*chain, key),
+                    )
+                    break
+
+    if cache is not None:
+        cache.extends[key] = {"reaches_base": reaches_base, "parent": parent}
+    return reaches_base
 
-    return False
+
+def extended_template_reaches_base(
+    path, extended_path, base="templates", cache=None, chain=()
+):
+    """Return true if the template extended by path is, or extends, one of
+    the base templates.
+    """
+    if extended_path in BASE_TEMPLATES:
+        return True
+    # extract absolute path from the parent path
+    absolute_path = str(path)[
+        0 : str(path).find(base) + len(base)  # noqa: E203
+    ]
+    # check if the file from which the current file
+    # extends extends from the base template
+    new_path = append_base_path(absolute_path, extended_path)
+    return extends_base(new_path, base=base, cache=cache, chain=chain)
 
 
 def resolve_if_tag(text):
@@ -142,110 +194,94 @@ def extract_text_from_tag(tag, data):
     return data
 
 
-def get_extended_copydoc(path, base):
+def get_extended_copydoc(path, base, cache=None):
     """
     Get the copydoc for the extended file
     """
-    if str(path).startswith("/"):
-        path = path[1:]
-    with base.joinpath(path).open("r") as f:
+    if cache is not None and path in cache.copydocs:
+        return cache.copydocs[path]
+
+    copydoc = None
+    relative_path = path[1:] if str(path).startswith("/") else path
+    with base.joinpath(relative_path).open("r") as f:
         file_data = f.read()
         if match := re.search(
             r"\{\% block meta_copydoc *\%\}(.*)\{\%( *)endblock", file_data
         ):
-            return match.group(1)
-
-
-def get_tags_rolling_buffer(path):
-    """
-    Parse an html file and return a dictionary of its tags
-    """
+            copydoc = match.group(1)
 
-    tags = create_node()
-    available_tags = list(TAG_MAPPING.keys())
+    if cache is not None:
+        cache.copydocs[path] = copydoc
+    return copydoc
 
-    # We create a map of the selected variants for each tag
-    variants_mapping = {v: "" for v in available_tags}
 
-    # check if the path is html or md file
-    is_md = path.suffix == ".md"
+def extract_template_metadata(path):
+    """
+    Read a template once and return its title, description, copydoc link,
+    the template it extends and its markdown wrapper template.
 
+    For each tag, the first variant in TAG_MAPPING that has a block (or a
+    front matter field in markdown files) is used.
+    """
     with path.open("r") as f:
-        for tag in available_tags:
-            buffer = []
-            is_buffering = False
-            tag_found = False
-
-            variants = TAG_MAPPING[tag]
-
-            for variant in variants:
-                is_buffering = False
-                # Return to start of file
-                f.seek(0)
-
-                if not is_md:
-
-                    for line in f.readlines():
-                        if is_buffering:
-                            buffer.append(line)
-
-                        if not is_buffering and (
-                            match := re.search(
-                                f"{{% block {variant}( *)%}}", line
-                            )
-                        ):
-                            # We remove line contents before the tag
-                            line = line[match.start() :]  # noqa: E203
-
-                            buffer.append(line)
-                            is_buffering = True
-                            variants_mapping[tag] = variant
-
-                        # We search for the end of the tag in the existing
-                        # buffer
-                        buffer_string = "".join(buffer)
-                        if is_buffering and re.search(
-                            "(.*){%( *)endblock", buffer_string
-                        ):
-                            # We save the buffer contents to the tags
-                            # dictionary
-                            tags[tag] = buffer_string
-
-                            # We extract the text within the tags
-                            tags[tag] = extract_text_from_tag(
-                                variants_mapping[tag], tags[tag]
-                            )
-
-                            # We now reset the buffer
-                            buffer = []
-                            is_buffering = False
-                            tag_found = True
-                            break
-
-                else:
-                    for line in f:
-                        match = re.match(
-                            rf"^\s*{variant}\s*:\s*\"?(.+?)\"?\s*$",
-                            line,
-                            re.IGNORECASE,
-                        )
-                        if match:
-                            variants_mapping[tag] = variant
-                            tags[tag] = match.group(1).strip()
-                            tag_found = True
-                            break
-
-                if tag_found:
-                    break
+        text = f.read()
+
+    metadata = {"extends": None, "wrapper_template": None}
+    if match := EXTENDS_PATTERN.search(text):
+        metadata["extends"] = match.group(1)
+    if match := WRAPPER_TEMPLATE_PATTERN.search(text):
+        metadata["wrapper_template"] = match.group(1)
+
+    if path.suffix == ".md":
+        lines = text.splitlines(keepends=True)
+        for tag, variants in TAG_MAPPING.items():
+            metadata[tag] = next(
+                (
+                    match.group(1).strip()
+                    for variant in variants
+                    for line in lines
+                    if (match := MARKDOWN_TAG_PATTERNS[variant].match(line))
+                ),
+                None,
+            )
+        return metadata
+
+    for tag, variants in TAG_MAPPING.items():
+        metadata[tag] = None
+        for variant in variants:
+            if not (start := BLOCK_PATTERNS[variant].search(text)):
+                continue
+            if not (end := ENDBLOCK_PATTERN.search(text, start.start())):
+                continue
+            # The block runs until the end of the line closing it
+            line_end = text.find("\n", end.end())
+            block_end = None if line_end == -1 else line_end + 1
+            block = text[start.start() : block_end]  # noqa: E203
+            metadata[tag] = extract_text_from_tag(variant, block)
+            break
+
+    return metadata
+
+
+def get_tags_from_metadata(path, metadata):
+    """
+    Return the tags of a template from its extracted metadata, as a node
+    named after its path.
+    """
+    tags = create_node()
+    for tag in TAG_MAPPING:
+        tags[tag] = metadata[tag]
 
     # We add the name from the path
-    raw_name = re.sub(r"(?i)(.html|/index.html|/index.md)", "", str(path))
+    raw_name = NAME_PATTERN.sub("", str(path))
     tags["name"] = raw_name.split("/templates", 1)[-1]
 
     return tags
 
 
-def is_valid_page(path, extended_path, is_index=True):
+def is_valid_page(
+    path, extended_path, is_index=True, metadata=None, template_cache=None
+):
     """
     Determine if path is a valid page. Pages are valid if:
     - They contain the same extended path as the index html.
@@ -256,35 +292,25 @@ def is_valid_page(path, extended_path, is_index=True):
     if is_template(path):
         return False
 
-    if not is_index and extended_path:
-        with path.open("r") as f:
-            for line in f.readlines():
-                if match := re.search("{% extends [\"'](.*?)[\"'] %}", line):
-                    if match.group(1) == extended_path:
-                        return True
+    if metadata is None:
+        metadata = extract_template_metadata(path)
 
-    if "index.md" in str(path):
-        with path.open("r") as f:
-            for line in f.readlines():
-                if match := re.search(
-                    r"wrapper_template:\s*[\"']?(.*?)[\"']?$", line
-                ):
-                    template = match.group(1)
-                    if template in MARKDOWN_TEMPLATES:
-                        return True
+    if not is_index and extended_path and metadata["extends"] == extended_path:
+        return True
+
+    if (
+        "index.md" in str(path)
+        and metadata["wrapper_template"] in MARKDOWN_TEMPLATES
+    ):
+        return True
 
     # If the file does not share the extended path, check if it extends the
     # base html
-    return extends_base(path)
-
-
-def get_extended_path(path):
-    """Get the path extended by the file"""
-    with path.open("r") as f:
-        for line in f.readlines():
-            if ".html" in str(path):
-                if match := re.search("{% extends [\"'](.*?)[\"'] %}", line):
-                    return match.group(1)
+    if metadata["extends"] is None:
+        return False
+    return extended_template_reaches_base(
+        path, metadata["extends"], cache=template_cache
+    )
 
 
 def update_tags(tags, new_tags):
@@ -310,10 +336,23 @@ def create_node():
     }
 
 
-def scan_directory(path_name, base=None):
+def scan_directory(path_name, base=None, template_cache=None, workers=1):
     """
     We scan a given directory for valid pages and return a tree
+
+    With more than one worker, the subdirectories of path_name are scanned
+    in parallel by a thread pool. The tree is the same as a serial scan.
     """
+    if template_cache is None:
+        template_cache = TemplateCache()
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return _scan_directory(path_name, base, template_cache, executor)
+    return _scan_directory(path_name, base, template_cache)
+
+
+def _scan_directory(path_name, base, template_cache, executor=None):
     node_path = Path(path_name)
     node = create_node()
     node["name"] = path_name.split("/templates", 1)[-1]
@@ -330,22 +369,41 @@ def scan_directory(path_name, base=None):
     if base is None:
         base = node_path.absolute()
 
+    # Directory entries carry their file type, so each one is only stat'ed
+    # once
+    with os.scandir(node_path) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    files = [Path(entry.path) for entry in entries if entry.is_file()]
+    directories = [entry.path for entry in entries if entry.is_dir()]
+
     # This will be the base html file extended by the index.html
     extended_path = None
 
     is_index_page_valid = False
 
     # Check if an index.html file exists in this directory
-    (has_index, index_type) = check_has_index(node_path)
+    file_names = {file.name for file in files}
+    index_type = next(
+        (ext for ext in (".html", ".md") if f"index{ext}" in file_names),
+        None,
+    )
+    has_index = index_type is not None
     if has_index:
         index_path = node_path / ("index" + index_type)
+        metadata = extract_template_metadata(index_path)
         # Get the path extended by the index.html file
-        extended_path = get_extended_path(index_path)
+        if index_type == ".html":
+            extended_path = metadata["extends"]
         # If the file is valid, add it as a child
-        is_index_page_valid = is_valid_page(index_path, extended_path)
+        is_index_page_valid = is_valid_page(
+            index_path,
+            extended_path,
+            metadata=metadata,
+            template_cache=template_cache,
+        )
         if is_index_page_valid:
             # Get tags, add as child
-            tags = get_tags_rolling_buffer(index_path)
+            tags = get_tags_from_metadata(index_path, metadata)
             node = update_tags(node, tags)
             node["ext"] = index_type
             node["file_path"] = (
@@ -356,14 +414,23 @@ def scan_directory(path_name, base=None):
         node["ext"] = ".dir"
 
     # Cycle through other files in this directory
-    for child in node_path.iterdir():
-        # If the child is a file, check if it is a valid page
-        if child.is_file() and not is_index(child):
+    for child in files:
+        # Check if the file is a valid page
+        if (
+            not is_index(child)
+            and (not has_index or is_index_page_valid)
+            and not is_template(child)
+        ):
+            metadata = extract_template_metadata(child)
             # If the file is valid, add it as a child
-            if (not has_index or is_index_page_valid) and is_valid_page(
-                child, extended_path, is_index=False
+            if is_valid_page(
+                child,
+                extended_path,
+                is_index=False,
+                metadata=metadata,
+                template_cache=template_cache,
             ):
-                child_tags = get_tags_rolling_buffer(child)
+                child_tags = get_tags_from_metadata(child, metadata)
                 child_tags["ext"] = child.suffix
                 child_tags["file_path"] = (
                     f"repositories/{str(child).split('/repositories/')[1]}"
@@ -371,13 +438,21 @@ def scan_directory(path_name, base=None):
                 # If the child has no copydocs link, use the parent's link
                 if not child_tags.get("link") and extended_path:
                     child_tags["link"] = get_extended_copydoc(
-                        extended_path, base=base
+                        extended_path, base=base, cache=template_cache
                     )
                 node["children"].append(child_tags)
-        # If the child is a directory, scan it
-        if child.is_dir():
-            child_node = scan_directory(str(child), base=base)
-            if child_node.get("title") or child_node.get("children"):
-                node["children"].append(child_node)
+
+    # Scan the subdirectories, fanning them out over the executor if given.
+    # Their own subdirectories are scanned serially by the same worker.
+    def scan_child(child):
+        return _scan_directory(child, base, template_cache)
+
+    if executor:
+        child_nodes = executor.map(scan_child, directories)
+    else:
+        child_nodes = map(scan_child, directories)
+    for child_node in child_nodes:
+        if child_node.get("title") or child_node.get("children"):
+            node["children"].append(child_node)
 
     return node
@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import re
 from flask import Blueprint, current_app, jsonify, request
 import flask
@@ -36,6 +38,7 @@ from webapp.schemas import (
     ReportBugModel,
     RequestFeatureModel,
 )
+from webapp.scheduled_tasks import apply_jira_statuses
 from webapp.site_repository import SiteRepository
 from webapp.sso import login_required
 
@@ -391,11 +394,47 @@ def get_in_review_transition(jira, issue_id):
 def invalidate_cache(webpage: Webpage):
     project = Project.query.filter_by(id=webpage.project_id).first()
     site_repository = SiteRepository(project.name, current_app)
-    # clean the cache for a page changes to be reflected
-    site_repository.invalidate_cache()
+    # clean the cached section of the page for changes to be reflected
+    site_repository.invalidate_webpage(webpage)
     return True
 
 
+def is_signed_by_jira(body: bytes, signature: str | None) -> bool:
+    """Check the HMAC signature Jira sends webhook events with, in the
+    X-Hub-Signature header as sha256=<hex digest>.
+    """
+    secret = current_app.config.get("JIRA_WEBHOOK_SECRET")
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, f"sha256={digest}")
+
+
+@jira_blueprint.route("/jira-webhook", methods=["POST"])
+def jira_webhook():
+    """Receive Jira issue updated events, and save the new status of the
+    issue's tasks.
+    """
+    if not is_signed_by_jira(
+        request.get_data(), request.headers.get("X-Hub-Signature")
+    ):
+        return jsonify({"error": "Invalid signature"}), 403
+
+    event = request.get_json(force=True, silent=True) or {}
+    if event.get("webhookEvent") != "jira:issue_updated":
+        return jsonify({"message": "Event ignored"}), 200
+
+    try:
+        issue = event["issue"]
+        statuses = {issue["key"]: issue["fields"]["status"]["name"]}
+    except (KeyError, TypeError):
+        return jsonify({"error": "Invalid issue updated event"}), 400
+
+    jira_tasks = JiraTask.query.filter(JiraTask.jira_id.in_(statuses)).all()
+    changed_tasks = apply_jira_statuses(current_app, jira_tasks, statuses)
+    return jsonify({"updated": len(changed_tasks)}), 200
+
+
 @jira_blueprint.route("/playwright-cleanup", methods=["POST"])
 @login_required
 @validate()
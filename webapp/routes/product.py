@@ -77,7 +77,7 @@ def set_product(body: SetProductsModel):
         project = Project.query.filter_by(id=webpage.project_id).first()
         site_repository = SiteRepository(project.name, current_app)
         # clean the cache for a new product to appear in the tree
-        site_repository.invalidate_cache()
+        site_repository.invalidate_webpage(webpage)
 
     except IntegrityError as e:
         db.session.rollback()
@@ -172,8 +172,12 @@ def edit_product(product_id: int, body: AddProductModel):
 
         # Invalidate cache for all projects since the renamed product may
         # appear on pages across any project
-        for project in Project.query.all():
-            SiteRepository(project.name, current_app).invalidate_cache()
+        SiteRepository.invalidate_caches(
+            [
+                SiteRepository(project.name, current_app)
+                for project in Project.query.all()
+            ]
+        )
 
         return (
             jsonify(
@@ -209,8 +213,12 @@ def delete_product(product_id: int):
 
         # Invalidate cache for all projects since the product may be
         # assigned to pages across any project
-        for project in Project.query.all():
-            SiteRepository(project.name, current_app).invalidate_cache()
+        SiteRepository.invalidate_caches(
+            [
+                SiteRepository(project.name, current_app)
+                for project in Project.query.all()
+            ]
+        )
 
         return (
             jsonify(
@@ -1,10 +1,113 @@
-from flask import Blueprint, current_app, jsonify
+import gzip
+import threading
+import time
+import zlib
 
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from webapp.scheduled_tasks import rebuild_site_tree
 from webapp.site_repository import SiteRepository
 from webapp.sso import login_required
 
 tree_blueprint = Blueprint("tree", __name__, url_prefix="/api")
 
+# Responses smaller than this many bytes are not worth compressing
+COMPRESSION_MIN_SIZE = 1024
+# Maximum number of levels of children returned by get-subtree
+MAX_SUBTREE_DEPTH = 5
+
+# The gzipped start of the last tree response of each site, with the tree
+# version it was compressed for, and the compressor's state after it
+compressed_trees = {}
+compressed_trees_lock = threading.Lock()
+
+
+def set_tree_headers(response: Response, version: str | None):
+    """Let clients cache the tree, as long as they revalidate it with its
+    version on every request.
+    """
+    if version:
+        response.set_etag(version, weak=True)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def compress_response(response: Response):
+    """Gzip the response if the client accepts it"""
+    if (
+        "gzip" not in request.accept_encodings
+        or response.content_length is None
+        or response.content_length < COMPRESSION_MIN_SIZE
+    ):
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.content_encoding = "gzip"
+    return response
+
+
+def compress_tree_head(uri: str, tree) -> tuple[bytes, "zlib._Compress"]:
+    """Gzip the start of a tree response, up to the tree, and return it with
+    the compressor, to compress the rest of the response with.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    dumps = current_app.json.dumps
+    head = f'{{"name": {dumps(uri)}, "templates": {dumps(tree)}'
+    # Flush, so the compressor can be copied without the data it buffered
+    compressed = compressor.compress(head.encode("utf-8"))
+    compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressed, compressor
+
+
+def gzip_tree_response(uri: str, tree, version: str, fields: dict) -> bytes:
+    """Gzip a tree response. The tree is only serialized and compressed
+    once per version, and only the fields that change between requests, like
+    the age of the tree, are compressed for each one.
+    """
+    with compressed_trees_lock:
+        cached = compressed_trees.get(uri)
+    if cached is None or cached[0] != version:
+        head, compressor = compress_tree_head(uri, tree)
+        with compressed_trees_lock:
+            compressed_trees[uri] = (version, head, compressor)
+    else:
+        _, head, compressor = cached
+    compressor = compressor.copy()
+    tail = ", " + current_app.json.dumps(fields)[1:]
+    return (
+        head + compressor.compress(tail.encode("utf-8")) + compressor.flush()
+    )
+
+
+def queue_rebuild_if_stale(site_repository: SiteRepository, info: dict):
+    """Rebuild the tree in the background if it is stale, unless another
+    request already queued the rebuild.
+    """
+    if info["stale"] and site_repository.claim_tree_rebuild():
+        rebuild_site_tree(site_repository.repository_uri)
+
+
+def tree_response(uri: str, tree, info: dict, **fields):
+    built_at = info.get("built_at")
+    version = info.get("version")
+    fields = {
+        "version": version,
+        "age": int(time.time() - built_at) if built_at else None,
+        "stale": info.get("stale", False),
+        **fields,
+    }
+    if tree is not None and version and "gzip" in request.accept_encodings:
+        response = current_app.response_class(
+            gzip_tree_response(uri, tree, version, fields),
+            mimetype="application/json",
+        )
+        response.content_encoding = "gzip"
+        return set_tree_headers(response, version)
+
+    response = jsonify({"name": uri, "templates": tree, **fields})
+    return compress_response(set_tree_headers(response, version))
+
 
 @tree_blueprint.route(
     "/get-tree/<string:uri>",
@@ -17,17 +120,95 @@ tree_blueprint = Blueprint("tree", __name__, url_prefix="/api")
 @login_required
 def get_tree(uri: str, no_cache: bool = False):
     site_repository = SiteRepository(uri, current_app)
-    # Getting the site tree here ensures that both the cache and db are updated
-    tree = site_repository.get_tree_sync(no_cache)
+    if no_cache:
+        # Rebuild the tree now, updating both the cache and db
+        tree = site_repository.get_tree_sync(no_cache)
+        info = site_repository.get_tree_info() or {}
+    else:
+        # Check the client's version before loading the tree
+        info = site_repository.get_tree_info()
+        if info and request.if_none_match.contains_weak(info["version"]):
+            tree = None
+        else:
+            tree, info = site_repository.get_tree_async()
+
+        # Serve the last good tree, and rebuild it in the background if it
+        # is stale
+        queue_rebuild_if_stale(site_repository, info)
+
+        if tree is None:
+            response = Response(status=304)
+            return set_tree_headers(response, info["version"])
+
+    return tree_response(uri, tree, info)
+
+
+@tree_blueprint.route(
+    "/get-tree-delta/<string:uri>",
+    methods=["GET"],
+)
+@login_required
+def get_tree_delta(uri: str):
+    """Return the nodes added, changed and removed since the version of the
+    tree given in the since parameter. The full tree is returned instead if
+    the changes since that version are no longer known.
+    """
+    since = request.args.get("since", type=str, default="")
+    site_repository = SiteRepository(uri, current_app)
+    info = site_repository.get_tree_info()
+    changes = (
+        site_repository.get_tree_changes(since, info["version"])
+        if info and since
+        else None
+    )
+
+    if changes is None:
+        tree, info = site_repository.get_tree_async()
+        queue_rebuild_if_stale(site_repository, info)
+        return tree_response(uri, tree, info, full=True)
+
+    queue_rebuild_if_stale(site_repository, info)
+    return tree_response(uri, None, info, since=since, full=False, **changes)
+
+
+@tree_blueprint.route(
+    "/get-subtree/<string:uri>",
+    methods=["GET"],
+)
+@login_required
+def get_subtree(uri: str):
+    """Return a webpage, given by id or url, with depth levels of its
+    children. The direct children are paginated.
+    """
+    webpage_id = request.args.get("id", type=int)
+    webpage_url = request.args.get("url", type=str, default="").strip()
+    if webpage_url == "/":
+        webpage_url = ""
+    depth = request.args.get("depth", type=int, default=1)
+    page = request.args.get("page", type=int, default=1)
+    per_page = request.args.get("per_page", type=int, default=100)
+    if not 1 <= depth <= MAX_SUBTREE_DEPTH or page < 1 or per_page < 1:
+        return jsonify({"error": "Invalid depth or pagination"}), 400
+
+    site_repository = SiteRepository(uri, current_app)
+    webpage = site_repository.get_webpage(webpage_id, webpage_url)
+    if not webpage:
+        return jsonify({"error": "Webpage not found"}), 404
 
+    subtree, total = site_repository.get_subtree(
+        webpage,
+        depth=depth,
+        offset=(page - 1) * per_page,
+        limit=per_page,
+    )
     response = jsonify(
         {
             "name": uri,
-            "templates": tree,
+            "webpage": subtree,
+            "page": page,
+            "page_size": per_page,
+            "total": total,
+            "total_pages": (total + per_page - 1) // per_page,
         }
     )
-
-    # Disable caching for this response
-    response.cache_control.no_store = True
-
-    return response
+    return compress_response(response)
@@ -67,7 +67,7 @@ def set_reviewers():
     project = Project.query.filter_by(id=webpage.project_id).first()
     site_repository = SiteRepository(project.name, current_app)
     # clean the cache for a the new reviewers to appear in the tree
-    site_repository.invalidate_cache()
+    site_repository.invalidate_webpage(webpage)
 
     return jsonify({"message": "Successfully set reviewers"}), 200
 
@@ -90,7 +90,7 @@ def set_owner():
         project = Project.query.filter_by(id=webpage.project_id).first()
         site_repository = SiteRepository(project.name, current_app)
         # clean the cache for a new owner to appear in the tree
-        site_repository.invalidate_cache()
+        site_repository.invalidate_webpage(webpage)
 
     return jsonify({"message": "Successfully set owner"}), 200
 
@@ -64,7 +64,7 @@ def update_page_details(body: UpdatePageDetailsModel):
 
     project = Project.query.filter_by(id=webpage.project_id).first()
     site_repository = SiteRepository(project.name, current_app)
-    site_repository.invalidate_cache()
+    site_repository.invalidate_webpage(webpage)
 
     return jsonify({"message": "Successfully updated page details"}), 200
 
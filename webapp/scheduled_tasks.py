@@ -1,5 +1,7 @@
 import logging
 import os
+import time
+from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 import re
@@ -8,6 +10,8 @@ import yaml
 from flask import Flask
 
 from webapp import create_app
+from webapp.cache import Cache, LockTimeout
+from webapp.helper import batches
 from webapp.models import (
     Asset,
     JiraTask,
@@ -18,9 +22,11 @@ from webapp.models import (
     WebpageStatus,
     db,
 )
-from webapp.settings import BASE_DIR
-from webapp.site_repository import SiteRepository
+from webapp.jira import Jira, JiraError
+from webapp.settings import BASE_DIR, JIRA_WEBHOOK_SECRET
+from webapp.site_repository import SiteRepository, get_sync_lock_name
 from webapp.tasks import register_task
+from sqlalchemy import or_, update
 from sqlalchemy.orm import joinedload
 import gspread
 
@@ -28,12 +34,26 @@ logger = logging.getLogger(__name__)
 
 # Default delay between runs for updating the tree
 TASK_DELAY = int(os.getenv("TASK_DELAY", "30"))
-# Default delay between runs for updating Jira task statuses
-UPDATE_STATUS_DELAY = int(os.getenv("UPDATE_STATUS_DELAY", "5"))
+# Default delay between runs for updating Jira task statuses. Status changes
+# are pushed by the Jira webhook if it is set up, and polling only reconciles
+# the events it missed.
+UPDATE_STATUS_DELAY = int(
+    os.getenv("UPDATE_STATUS_DELAY", "60" if JIRA_WEBHOOK_SECRET else "5")
+)
 # Default delay between runs for parsing webpage assets
 PARSE_ASSETS_DELAY = int(os.getenv("PARSE_ASSETS_DELAY", "1440"))
 # Default delay between runs for parsing webpage stats
 FETCH_STATS_DELAY = int(os.getenv("FETCH_STATS_DELAY", "2880"))
+# Statuses of Jira tasks that don't change anymore
+TERMINAL_JIRA_STATUSES = (JIRATaskStatus.DONE, JIRATaskStatus.REJECTED)
+# The time of the last poll of each Jira project, and of its last full poll
+JIRA_WATERMARKS_KEY = "JIRA_STATUS_WATERMARKS"
+JIRA_POLL_LOCK = "JIRA_STATUS_POLL"
+# Seconds between full polls of the open tasks of a Jira project, which catch
+# anything the incremental polls missed
+JIRA_FULL_POLL_INTERVAL = 24 * 60 * 60
+# Jira projects are fetched weekly, and kept for two runs
+JIRA_PROJECTS_TTL = 2 * 7 * 24 * 60 * 60
 
 
 @register_task(delay=TASK_DELAY)
@@ -44,7 +64,15 @@ def load_site_trees() -> None:
 
     with app.app_context(), yaml_path.open("r") as f:
         data = yaml.safe_load(f)
+        # Read the sync locks of all the sites at once
+        sync_owners = app.config["CACHE"].get_lock_owners(
+            get_sync_lock_name(site) for site in data["sites"]
+        )
         for site in data["sites"]:
+            # The tree can't be built while the repository is being synced
+            if sync_owners[get_sync_lock_name(site)]:
+                logger.info(f"Skipping {site}, it is being synced")
+                continue
             logger.info(f"Loading site tree for {site}")
 
             try:
@@ -56,91 +84,219 @@ def load_site_trees() -> None:
                 logger.error(e, exc_info=True)
 
 
-@register_task(delay=UPDATE_STATUS_DELAY)
-def update_jira_statuses() -> None:
-    """Get the status of a Jira task and update it if it changed.
+@register_task()
+def rebuild_site_tree(uri: str) -> None:
+    """Rebuild the cached tree of a site, once it has been invalidated."""
+    app = create_app()
+    with app.app_context():
+        site_repository = SiteRepository(uri, app, db=db)
+        try:
+            site_repository.rebuild_tree()
+        except Exception as e:
+            logger.error(e, exc_info=True)
+        finally:
+            site_repository.release_tree_rebuild()
+
+
+def apply_jira_statuses(
+    app: Flask, jira_tasks: list[JiraTask], statuses: dict[str, str]
+) -> list[JiraTask]:
+    """Save the new statuses of Jira tasks in bulk, and invalidate the cached
+    sections of their webpages.
+
+    Webpages whose removal request was rejected are made available again.
 
     Args:
-        app (Flask): The Flask application instance.
+        jira_tasks (list[JiraTask]): The tasks to update.
+        statuses (dict): The status name of Jira issues, by key. Tasks whose
+            issue is missing are left unchanged.
 
+    Returns:
+        list[JiraTask]: The tasks whose status changed.
     """
-    app = create_app()
-    with app.app_context():
-        app.logger.info("Running scheduled task: update_jira_statuses")
+    changed_tasks = [
+        task
+        for task in jira_tasks
+        if task.jira_id in statuses
+        and task.status != statuses[task.jira_id].upper()
+    ]
+    if not changed_tasks:
+        return []
+
+    # Batch load the webpages of the changed tasks in a single query
+    webpage_ids = {task.webpage_id for task in changed_tasks}
+    webpages_dict = {
+        webpage.id: webpage
+        for webpage in Webpage.query.filter(Webpage.id.in_(webpage_ids))
+    }
+
+    task_updates = []
+    webpage_updates = []
+    changed_webpages = []
+    for task in changed_tasks:
+        old_status = task.status
+        new_status = statuses[task.jira_id].upper()
+        task_updates.append({"id": task.id, "status": new_status})
+        webpage = webpages_dict.get(task.webpage_id)
+
+        # Update webpage status from TO_DELETE to AVAILABLE when a removal
+        # request is rejected
+        if (
+            task.request_type == JiraTaskType.PAGE_REMOVAL
+            and old_status != JIRATaskStatus.REJECTED
+            and new_status == JIRATaskStatus.REJECTED
+            and webpage
+            and webpage.status == WebpageStatus.TO_DELETE
+        ):
+            webpage_updates.append(
+                {"id": webpage.id, "status": WebpageStatus.AVAILABLE}
+            )
+            app.logger.info(
+                f"Updated webpage {webpage.id} status from TO_DELETE to "
+                "AVAILABLE due to rejected removal request"
+            )
 
-        jira = app.config.get("JIRA")
-        if not jira:
-            app.logger.error("JIRA configuration not found")
-            return
+        # Collect webpages for cache invalidation
+        if webpage and webpage.project_id:
+            changed_webpages.append(webpage)
+
+    for batch in batches(task_updates):
+        db.session.execute(update(JiraTask), batch)
+    for batch in batches(webpage_updates):
+        db.session.execute(update(Webpage), batch)
+    db.session.commit()
+
+    # Batch load all projects that need cache invalidation
+    if changed_webpages:
+        project_ids = {webpage.project_id for webpage in changed_webpages}
+        projects = Project.query.filter(Project.id.in_(project_ids)).all()
+        site_repositories = {
+            project.id: SiteRepository(project.name, app)
+            for project in projects
+        }
+
+        # Invalidate the cached sections of the webpages whose Jira tasks
+        # have changed status, in one batch per project
+        webpages_by_project = defaultdict(list)
+        for webpage in changed_webpages:
+            webpages_by_project[webpage.project_id].append(webpage)
+        for project_id, webpages in webpages_by_project.items():
+            site_repositories[project_id].invalidate_webpages(webpages)
+
+    return changed_tasks
 
-        # Fetch all JiraTasks
-        jira_tasks = JiraTask.query.all()
 
-        if jira_tasks:
-            project_ids = set()
+def get_jira_project(jira_id: str) -> str:
+    """Return the key of the Jira project of an issue, e.g. WD for WD-123"""
+    return jira_id.rsplit("-", 1)[0]
 
-            # Collect all webpage_ids to batch load webpages
-            webpage_ids = {
-                task.webpage_id for task in jira_tasks if task.webpage_id
+
+def poll_jira_statuses(app: Flask, jira: Jira) -> list[JiraTask]:
+    """Fetch the statuses of the open Jira tasks, and save the ones that
+    changed.
+
+    Each Jira project has a watermark, the time of its last poll. Only the
+    issues updated since then are searched for, so a project without any
+    activity costs a single request. All the open tasks of a project are
+    polled if it has no watermark, or every JIRA_FULL_POLL_INTERVAL.
+
+    The watermarks are only advanced once the changes are saved, and polls
+    don't overlap, so no update is missed.
+
+    Returns:
+        list[JiraTask]: The tasks whose status changed.
+    """
+    cache = app.config["CACHE"]
+    try:
+        with cache.get_lock(JIRA_POLL_LOCK, timeout=0):
+            return _poll_jira_statuses(app, jira, cache)
+    except LockTimeout:
+        app.logger.info("Jira statuses are already being polled")
+        return []
+
+
+def _poll_jira_statuses(
+    app: Flask, jira: Jira, cache: Cache
+) -> list[JiraTask]:
+    # Tasks in a terminal status don't change anymore
+    jira_tasks = JiraTask.query.filter(
+        JiraTask.jira_id.isnot(None),
+        or_(
+            JiraTask.status.is_(None),
+            JiraTask.status.notin_(TERMINAL_JIRA_STATUSES),
+        ),
+    ).all()
+    if not jira_tasks:
+        return []
+
+    jira_ids_by_project = defaultdict(set)
+    for task in jira_tasks:
+        jira_ids_by_project[get_jira_project(task.jira_id)].add(task.jira_id)
+
+    # Issues updated while the poll runs are picked up by the next one
+    started_at = time.time()
+    watermarks = cache.get(JIRA_WATERMARKS_KEY) or {}
+    new_watermarks = {}
+    statuses = {}
+    for project, jira_ids in jira_ids_by_project.items():
+        watermark = watermarks.get(project)
+        if (
+            not watermark
+            or started_at - watermark["full_poll_at"] > JIRA_FULL_POLL_INTERVAL
+        ):
+            statuses.update(jira.get_issues_statuses(sorted(jira_ids)))
+            new_watermarks[project] = {
+                "updated_since": started_at,
+                "full_poll_at": started_at,
+            }
+        else:
+            statuses.update(
+                jira.get_updated_issues_statuses(
+                    project,
+                    sorted(jira_ids),
+                    since=watermark["updated_since"],
+                )
+            )
+            new_watermarks[project] = {
+                **watermark,
+                "updated_since": started_at,
             }
 
-            # Batch load all webpages in a single query
-            webpages_dict = {}
-            if webpage_ids:
-                webpages = Webpage.query.filter(
-                    Webpage.id.in_(webpage_ids)
-                ).all()
-                webpages_dict = {webpage.id: webpage for webpage in webpages}
-
-            for task in jira_tasks:
-                response = jira.get_issue_statuses(task.jira_id)
-                new_status = response["fields"]["status"]["name"].upper()
-
-                if task.status != new_status:
-                    old_status = task.status
-                    task.status = new_status
-
-                    # Get webpage from the pre-loaded dictionary
-                    webpage = webpages_dict.get(task.webpage_id)
-
-                    # Handle webpage status sync for removal requests
-                    if (
-                        task.request_type == JiraTaskType.PAGE_REMOVAL
-                        and old_status != JIRATaskStatus.REJECTED
-                        and new_status == JIRATaskStatus.REJECTED
-                    ):
-
-                        # Update webpage status from TO_DELETE to AVAILABLE
-                        # when removal request is rejected
-                        if (
-                            webpage
-                            and webpage.status == WebpageStatus.TO_DELETE
-                        ):
-                            webpage.status = WebpageStatus.AVAILABLE
-                            app.logger.info(
-                                f"Updated webpage {webpage.id} status from "
-                                "TO_DELETE to AVAILABLE due to rejected "
-                                "removal request"
-                            )
+    changed_tasks = apply_jira_statuses(app, jira_tasks, statuses)
+    cache.set(JIRA_WATERMARKS_KEY, {**watermarks, **new_watermarks})
+    return changed_tasks
 
-                    # Collect project IDs for cache invalidation
-                    if webpage and webpage.project_id:
-                        project_ids.add(webpage.project_id)
 
-            db.session.commit()
+@register_task(delay=UPDATE_STATUS_DELAY)
+def update_jira_statuses() -> None:
+    """Get the status of the open Jira tasks and update the ones that
+    changed.
+    """
+    app = create_app()
+    with app.app_context():
+        app.logger.info("Running scheduled task: update_jira_statuses")
 
-            # Batch load all projects that need cache invalidation
-            if project_ids:
-                projects = Project.query.filter(
-                    Project.id.in_(project_ids)
-                ).all()
+        jira = app.config.get("JIRA")
+        if not jira:
+            app.logger.error("JIRA configuration not found")
+            return
 
-                # Invalidate cache for all affected project trees
-                # where Jira tasks have changed status
-                for project in projects:
-                    site_repository = SiteRepository(project.name, app)
-                    # clean the cache for a new Jira task to appear in the tree
-                    site_repository.invalidate_cache()
+        # The app and its Jira client are this run's own
+        jira.max_retry_time = app.config["JIRA_POLL_MAX_RETRY_TIME"]
+        try:
+            changed_tasks = poll_jira_statuses(app, jira)
+        except JiraError as error:
+            # Nothing was saved, the next run polls the same issues again
+            app.logger.error(
+                f"Failed to poll Jira statuses: {error}, "
+                f"Jira requests: {dict(jira.stats)}"
+            )
+            return
+        app.logger.info(
+            f"Finished scheduled task: update_jira_statuses, "
+            f"{len(changed_tasks)} tasks changed, "
+            f"Jira requests: {dict(jira.stats)}"
+        )
 
 
 @register_task(delay=1)
@@ -268,7 +424,11 @@ def fetch_webpage_stats() -> None:
                     for row in rows
                     if "URL" in row and row["URL"]
                 }
-            app.config["CACHE"].set("PAGE_STATS_CACHE", index_data)
+            # Let the stats expire if the task stops running, rather than
+            # serving them indefinitely
+            app.config["CACHE"].set(
+                "PAGE_STATS_CACHE", index_data, ttl=2 * FETCH_STATS_DELAY * 60
+            )
         except Exception as e:
             app.logger.error(f"Error fetching webpage stats: {e}")
         app.logger.info("Finished scheduled task: fetch_webpage_stats")
@@ -303,7 +463,9 @@ def fetch_jira_projects() -> None:
                         "name": project["name"],
                     }
                 )
-            app.config["CACHE"].set("JIRA_PROJECTS_CACHE", projects_cache)
+            app.config["CACHE"].set(
+                "JIRA_PROJECTS_CACHE", projects_cache, ttl=JIRA_PROJECTS_TTL
+            )
         except Exception as e:
             app.logger.error(f"Error fetching Jira projects: {e}")
         app.logger.info("Finished scheduled task: fetch_jira_projects")
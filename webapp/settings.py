@@ -22,10 +22,33 @@ REDIS_DB_CONNECT_STRING = (
     if REDIS_HOST
     else get_flask_env("REDIS_DB_CONNECT_STRING")
 )
+# Codec for cached values, as "serializer:compressor". Codecs other than
+# the default, "json:zlib", need their package, e.g. orjson, msgpack or
+# zstandard, installed in every process that reads the cache.
+CACHE_CODEC = get_flask_env("CACHE_CODEC", "json:zlib")
+# Size in bytes of the in-process cache in front of Redis or files, or 0 to
+# disable it, and the seconds its entries are kept for
+CACHE_L1_MAX_SIZE = int(get_flask_env("CACHE_L1_MAX_SIZE", 64 * 1024 * 1024))
+CACHE_L1_TTL = int(get_flask_env("CACHE_L1_TTL", 300))
+# Seconds an in-process entry is served for before checking it is still the
+# one in Redis or files, which is how soon other workers' writes are seen
+CACHE_L1_CHECK_INTERVAL = float(get_flask_env("CACHE_L1_CHECK_INTERVAL", 2))
+# Cache files of at least this many bytes are memory mapped when read, or 0
+# to always read them into memory
+CACHE_MMAP_MIN_SIZE = int(get_flask_env("CACHE_MMAP_MIN_SIZE", 1024 * 1024))
+# Size in bytes above which the least recently read cache files are evicted,
+# or 0 to keep them all
+CACHE_FILE_MAX_SIZE = int(
+    get_flask_env("CACHE_FILE_MAX_SIZE", 512 * 1024 * 1024)
+)
 RABBITMQ_URI = environ.get("RABBITMQ_URI")
 DIRECTORY_API_TOKEN = get_flask_env("DIRECTORY_API_TOKEN")
 REPO_ORG = get_flask_env("REPO_ORG", "https://github.com/canonical")
 GH_TOKEN = get_flask_env("GH_TOKEN", "")
+# Depth of the initial clone of site repositories. 0 clones the full history.
+REPO_CLONE_DEPTH = int(get_flask_env("REPO_CLONE_DEPTH", 1))
+# Number of threads used to scan the templates of a site repository
+SCAN_WORKERS = int(get_flask_env("SCAN_WORKERS", 4))
 SECRET_KEY = get_flask_env("SECRET_KEY")
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SQLALCHEMY_DATABASE_URI = get_flask_env(
@@ -37,6 +60,28 @@ JIRA_CLIENT_SECRET = get_flask_env("JIRA_CLIENT_SECRET")
 JIRA_URL = get_flask_env("JIRA_URL")
 JIRA_LABELS = get_flask_env("JIRA_LABELS")
 JIRA_COPY_UPDATES_EPIC = get_flask_env("JIRA_COPY_UPDATES_EPIC")
+# Connections kept open to each Jira host, per process
+JIRA_POOL_SIZE = int(get_flask_env("JIRA_POOL_SIZE", 10))
+# Seconds to wait for a connection to Jira, and for its responses
+JIRA_CONNECT_TIMEOUT = float(get_flask_env("JIRA_CONNECT_TIMEOUT", 5))
+JIRA_READ_TIMEOUT = float(get_flask_env("JIRA_READ_TIMEOUT", 30))
+# Requests per second sent to Jira, per process, and retries of failed ones
+JIRA_RATE_LIMIT = float(get_flask_env("JIRA_RATE_LIMIT", 10))
+JIRA_MAX_RETRIES = int(get_flask_env("JIRA_MAX_RETRIES", 4))
+# Seconds spent retrying a request at most, waits included. Requests made
+# while a user waits must fail before the worker times out, the scheduled
+# poll can wait for Jira longer.
+JIRA_MAX_RETRY_TIME = float(get_flask_env("JIRA_MAX_RETRY_TIME", 10))
+JIRA_POLL_MAX_RETRY_TIME = float(
+    get_flask_env("JIRA_POLL_MAX_RETRY_TIME", 300)
+)
+# Failed requests in a row after which Jira isn't called for a while
+JIRA_CIRCUIT_THRESHOLD = int(get_flask_env("JIRA_CIRCUIT_THRESHOLD", 5))
+JIRA_CIRCUIT_RESET_TIMEOUT = float(
+    get_flask_env("JIRA_CIRCUIT_RESET_TIMEOUT", 60)
+)
+# Secret the Jira webhook signs its events with
+JIRA_WEBHOOK_SECRET = get_flask_env("JIRA_WEBHOOK_SECRET")
 GOOGLE_DRIVE_FOLDER_ID = get_flask_env("GOOGLE_DRIVE_FOLDER_ID")
 COPYDOC_TEMPLATE_ID = get_flask_env("COPYDOC_TEMPLATE_ID")
 GOOGLE_CREDENTIALS = {
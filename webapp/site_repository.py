@@ -1,31 +1,132 @@
+import hashlib
+import json
 import re
 import subprocess
 import time
 import traceback
 from collections.abc import Callable
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 from typing import TypedDict
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import select
+from git import Repo
+from git.exc import GitError
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import selectinload
 
+from webapp.cache import LockTimeout
 from webapp.helper import (
+    batches,
     convert_webpage_to_dict,
     get_or_create_project_id,
+    get_project_id,
     get_tree_struct,
 )
 from webapp.models import (
+    JiraTask,
     Project,
+    Reviewer,
     User,
     Webpage,
+    WebpageProduct,
     WebpageStatus,
     db,
     get_or_create,
 )
-from webapp.parse_tree import scan_directory
+from webapp.parse_tree import is_partial, is_template, scan_directory
 
 BACKGROUND_TASK_RUNNING_PREFIX = "BACKGROUND_TASK_RUNNING"
+# Seconds after which a queued tree rebuild that never started is forgotten
+TREE_REBUILD_TIMEOUT = 600
+# Number of tree versions kept in the changelog
+TREE_CHANGELOG_SIZE = 100
+# Scanned node keys and the webpage columns they are saved to
+WEBPAGE_SYNC_FIELDS = {
+    "title": "title",
+    "description": "description",
+    "link": "copy_doc_link",
+    "ext": "ext",
+    "file_path": "file_path",
+}
+# Relationships serialised for every webpage in the tree
+TREE_LOAD_OPTIONS = (
+    selectinload(Webpage.owner),
+    selectinload(Webpage.project),
+    selectinload(Webpage.reviewers).selectinload(Reviewer.user),
+    selectinload(Webpage.jira_tasks).selectinload(JiraTask.user),
+    selectinload(Webpage.webpage_products).selectinload(
+        WebpageProduct.products
+    ),
+)
+
+
+def get_sync_lock_name(repository_uri: str) -> str:
+    """Return the name of the lock held while a repository is synced"""
+    return f"{BACKGROUND_TASK_RUNNING_PREFIX}-{repository_uri}"
+
+
+def tree_digest(tree: dict) -> str:
+    """Return a digest of the contents of a tree"""
+    data = json.dumps(tree, sort_keys=True, default=str)
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def tree_version(index: dict) -> str:
+    """Return the version of a cached tree, derived from the digests of its
+    root and sections.
+    """
+    digests = [index["root_digest"]] + [
+        index["digests"][str(section_id)] for section_id in index["sections"]
+    ]
+    return hashlib.md5("".join(digests).encode("utf-8")).hexdigest()
+
+
+def flatten_nodes(tree: dict) -> dict:
+    """Return the nodes of a tree, without their children, by id"""
+    nodes = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        children = node.get("children", [])
+        nodes[node["id"]] = {
+            key: value for key, value in node.items() if key != "children"
+        }
+        stack.extend(children)
+    return nodes
+
+
+def diff_trees(old_tree: dict, new_tree: dict) -> dict:
+    """Return the nodes added, changed and removed between two trees"""
+    old_nodes = flatten_nodes(old_tree)
+    new_nodes = flatten_nodes(new_tree)
+    return {
+        "added": [
+            node
+            for webpage_id, node in new_nodes.items()
+            if webpage_id not in old_nodes
+        ],
+        "changed": [
+            node
+            for webpage_id, node in new_nodes.items()
+            if webpage_id in old_nodes and old_nodes[webpage_id] != node
+        ],
+        "removed": sorted(
+            webpage_id
+            for webpage_id in old_nodes
+            if webpage_id not in new_nodes
+        ),
+    }
+
+
+# Served when a site has no tree yet
+EMPTY_TREE = {
+    "name": "",
+    "title": "",
+    "description": "",
+    "copy_doc_link": "",
+    "children": [],
+}
 
 
 class SiteRepositoryError(Exception):
@@ -56,6 +157,15 @@ class SiteRepository:
         self.REPOSITORY_DIRECTORY = f"{base_dir}/repositories"
         self.repository_uri = repository_uri
         self.cache_key = f"{self.CACHE_KEY_PREFIX}_{repository_uri}"
+        self.index_key = f"{self.cache_key}_INDEX"
+        # The last tree that was built, kept across invalidations
+        self.last_good_key = f"{self.cache_key}_LAST_GOOD"
+        self.info_key = f"{self.cache_key}_INFO"
+        self.changelog_key = f"{self.cache_key}_CHANGELOG"
+        self.rebuild_key = (
+            f"{BACKGROUND_TASK_RUNNING_PREFIX}-TREE-{repository_uri}"
+        )
+        self.rebuild_lock_name = f"TREE_REBUILD_{repository_uri}"
         self.app = app
         self.logger = app.logger
         self.cache = app.config["CACHE"]
@@ -133,34 +243,272 @@ class SiteRepository:
             self.invalidate_cache()
             # Update the cache
             if self.cache:
-                self.cache.set(self.cache_key, tree)
+                self.set_fragments_in_cache(tree)
+                self.set_assembled_tree_in_cache(tree)
         except Exception as e:
             self.logger.exception(traceback.format_exc())
             self.logger.error(f"Unable to save tree to cache: {e}")
 
+    def set_assembled_tree_in_cache(self, tree):
+        """Cache the assembled tree, and keep it as the last good tree along
+        with its version and build time.
+        """
+        index = self.cache.get(self.index_key)
+        version = index["version"] if index else tree_digest(tree)
+        info = self.get_tree_info()
+        if info and info["version"] != version:
+            self.record_tree_changes(info["version"], version, tree)
+        self.cache.set(self.cache_key, tree)
+        self.cache.set(self.last_good_key, tree)
+        self.cache.set(
+            self.info_key,
+            {"version": version, "built_at": time.time(), "stale": False},
+        )
+
+    def record_tree_changes(self, old_version: str, version: str, tree):
+        """Append the changes from the last good tree to the given tree to
+        the changelog, dropping the oldest entries beyond
+        TREE_CHANGELOG_SIZE.
+        """
+        old_tree = self.cache.get(self.last_good_key)
+        if old_tree is None:
+            # Without the previous tree, earlier versions can't be updated
+            self.cache.set(self.changelog_key, None)
+            return
+        changelog = self.cache.get(self.changelog_key) or []
+        seq = changelog[-1]["seq"] + 1 if changelog else 1
+        entry = {"seq": seq, "from": old_version, "version": version}
+        entry.update(diff_trees(old_tree, tree))
+        changelog = [*changelog, entry][-TREE_CHANGELOG_SIZE:]
+        self.cache.set(self.changelog_key, changelog)
+
+    def get_tree_changes(self, since: str, version: str) -> dict | None:
+        """Return the nodes added, changed and removed between two versions
+        of the tree, or None if the changelog doesn't cover them.
+        """
+        if since == version:
+            return {"added": [], "changed": [], "removed": []}
+        changelog = self.cache.get(self.changelog_key) or []
+        start = next(
+            (i for i, entry in enumerate(changelog) if entry["from"] == since),
+            None,
+        )
+        if start is None:
+            return None
+
+        added, changed, removed = {}, {}, set()
+        current = since
+        for entry in changelog[start:]:
+            if entry["from"] != current:
+                return None
+            for node in entry["added"]:
+                if node["id"] in removed:
+                    removed.discard(node["id"])
+                    changed[node["id"]] = node
+                else:
+                    added[node["id"]] = node
+            for node in entry["changed"]:
+                if node["id"] in added:
+                    added[node["id"]] = node
+                else:
+                    changed[node["id"]] = node
+            for webpage_id in entry["removed"]:
+                if added.pop(webpage_id, None) is None:
+                    changed.pop(webpage_id, None)
+                    removed.add(webpage_id)
+            current = entry["version"]
+            if current == version:
+                return {
+                    "added": list(added.values()),
+                    "changed": list(changed.values()),
+                    "removed": sorted(removed),
+                }
+        return None
+
+    def get_tree_info(self) -> dict | None:
+        """Return the version and build time of the last good tree, and
+        whether it has been invalidated since.
+        """
+        return self.cache.get(self.info_key) if self.cache else None
+
     def invalidate_cache(self):
-        self.cache.set(self.cache_key, None)
+        self.invalidate_caches([self])
 
-    def get_tree_from_disk(self):
-        """Get a tree from a freshly cloned repository."""
-        # Check if a background task is active. if so do not proceed
-        if self.cache.get(
-            f"{BACKGROUND_TASK_RUNNING_PREFIX}-{self.repository_uri}",
-        ):
+    @staticmethod
+    def invalidate_caches(site_repositories: list["SiteRepository"]):
+        """Invalidate the cached trees of several sites, with one read and
+        one write to the cache.
+        """
+        if not site_repositories:
+            return
+        cache = site_repositories[0].cache
+        infos = cache.get_many(
+            site_repository.info_key for site_repository in site_repositories
+        )
+        values = {}
+        for site_repository in site_repositories:
+            values[site_repository.cache_key] = None
+            values[site_repository.index_key] = None
+            if info := infos.get(site_repository.info_key):
+                values[site_repository.info_key] = {**info, "stale": True}
+        cache.set_many(values)
+
+    def get_fragment_key(self, section_id: int) -> str:
+        return f"{self.cache_key}_SECTION_{section_id}"
+
+    def set_fragments_in_cache(self, tree):
+        """Cache each top level section of the tree as a separate fragment,
+        along with an index of the sections and the webpages they contain.
+        """
+        if "id" not in tree:
+            return
+        root = {key: value for key, value in tree.items() if key != "children"}
+        index = {
+            "root": root,
+            "root_digest": tree_digest(root),
+            "sections": [],
+            "digests": {},
+            "members": {str(tree["id"]): None},
+        }
+        for section in tree.get("children", []):
+            self.cache.set(self.get_fragment_key(section["id"]), section)
+            self._add_section_to_index(index, section)
+        index["version"] = tree_version(index)
+        self.cache.set(self.index_key, index)
+
+    def _add_section_to_index(self, index: dict, section: Tree):
+        """Record the digest and members of a section in the index"""
+        if section["id"] not in index["sections"]:
+            index["sections"].append(section["id"])
+        index["digests"][str(section["id"])] = tree_digest(section)
+        for node, _ in self._flatten_tree(section):
+            index["members"][str(node["id"])] = section["id"]
+
+    def get_tree_from_fragments(self):
+        """Assemble the tree from the cached section fragments, rebuilding the
+        invalidated ones from the database.
+
+        Return None if there is no index, or a section no longer exists.
+        """
+        if not self.cache or not (index := self.cache.get(self.index_key)):
             return None
 
+        tree = {**index["root"], "children": []}
+        rebuilt = []
+        for section_id in index["sections"]:
+            fragment_key = self.get_fragment_key(section_id)
+            section = self.cache.get(fragment_key)
+            if section is None:
+                section = self.get_subtree_from_db(section_id)
+                if section is None:
+                    return None
+                self.cache.set(fragment_key, section)
+                rebuilt.append(section)
+            tree["children"].append(section)
+
+        if rebuilt:
+            # Cached values may be shared, so update a copy of the index
+            index = {**index, "digests": dict(index["digests"])}
+            for section in rebuilt:
+                index["members"] = {
+                    webpage_id: member_section
+                    for webpage_id, member_section in index["members"].items()
+                    if member_section != section["id"]
+                }
+                self._add_section_to_index(index, section)
+            index["version"] = tree_version(index)
+            self.cache.set(self.index_key, index)
+            self.logger.info(
+                f"Rebuilt {len(rebuilt)} sections of {self.repository_uri}"
+            )
+        return tree
+
+    def invalidate_webpage(self, webpage: Webpage):
+        self.invalidate_webpages([webpage])
+
+    def invalidate_webpages(self, webpages: list[Webpage]):
+        """Invalidate the cached sections that contain the webpages, with one
+        read and one write to the cache.
+
+        The whole tree is invalidated if a webpage is the root, or isn't part
+        of a cached section, e.g. because it was just created.
+        """
+        cached = self.cache.get_many([self.index_key, self.info_key])
+        members = (cached[self.index_key] or {}).get("members", {})
+        section_ids = {members.get(str(webpage.id)) for webpage in webpages}
+        if None in section_ids:
+            self.invalidate_cache()
+            return
+
+        values = {
+            self.get_fragment_key(section_id): None
+            for section_id in section_ids
+        }
+        values[self.cache_key] = None
+        if info := cached[self.info_key]:
+            values[self.info_key] = {**info, "stale": True}
+        self.cache.set_many(values)
+
+    def claim_tree_rebuild(self) -> bool:
+        """Claim the rebuild of the tree, so concurrent requests don't all
+        queue a rebuild of the same site. Return False if a rebuild is already
+        queued or running.
+
+        The claim is set only if there is none, atomically, so only one of
+        several concurrent requests queues the rebuild. It expires after
+        TREE_REBUILD_TIMEOUT, in case the queued task never runs.
+        """
+        owners = self.cache.get_lock_owners([self.rebuild_lock_name])
+        if owners[self.rebuild_lock_name]:
+            return False
+        return self.cache.add(
+            self.rebuild_key, time.time(), ttl=TREE_REBUILD_TIMEOUT
+        )
+
+    def release_tree_rebuild(self):
+        self.cache.delete(self.rebuild_key)
+
+    def rebuild_tree(self) -> bool:
+        """Rebuild the tree under the rebuild lock. Return False if another
+        process is already rebuilding it.
+        """
+        try:
+            with self.cache.get_lock(self.rebuild_lock_name, timeout=0):
+                self.get_tree_sync()
+        except LockTimeout:
+            self.logger.info(f"{self.repository_uri} is already rebuilding")
+            return False
+        return True
+
+    def sync_repository(self) -> bool:
+        """Bring the local checkout of the repository up to date. Return False
+        if another process is already syncing it.
+        """
         github = self.app.config["github"]
-        github.clone_repository(self.repository_uri)
+        return github.clone_repository(self.repository_uri)
 
+    def get_templates_folder(self) -> Path:
         templates_folder = Path(self.repo_path + "/templates")
         templates_folder.mkdir(parents=True, exist_ok=True)
+        return templates_folder.absolute()
+
+    def scan_templates(self, path: Path | None = None):
+        """Scan the templates folder, or a directory within it, and return its
+        tree.
+        """
+        templates_folder = self.get_templates_folder()
+        path = path or templates_folder
 
         # Parse the templates, retry if a page is unavailable, as it might
         # still be being downloaded.
         retries = 5
         while retries > 0:
             try:
-                tree = scan_directory(str(templates_folder.absolute()))
+                tree = scan_directory(
+                    str(path),
+                    base=templates_folder,
+                    workers=self.app.config.get("SCAN_WORKERS", 1),
+                )
                 break
             except Exception as e:
                 retries -= 1
@@ -171,19 +519,175 @@ class SiteRepository:
 
         return tree
 
-    def get_new_tree(self):
+    def get_tree_from_disk(self):
+        """Get a tree from a freshly cloned repository."""
+        if not self.sync_repository():
+            return None
+        return self.scan_templates()
+
+    def get_head_commit(self) -> str | None:
+        """Return the SHA of the commit checked out in the repository."""
+        try:
+            return Repo(self.repo_path).head.commit.hexsha
+        except (GitError, ValueError) as e:
+            self.logger.warning(
+                f"Unable to read HEAD of {self.repository_uri}: {e}"
+            )
+            return None
+
+    def get_changed_templates(self, since: str, until: str) -> list | None:
+        """Return the paths, relative to the templates folder, of the files
+        that changed between two commits. Return None if the diff can't be
+        computed, e.g. because the old commit is no longer available.
+        """
+        try:
+            diff = Repo(self.repo_path).git.diff(
+                "--name-only",
+                "--no-renames",
+                since,
+                until,
+                "--",
+                "templates",
+            )
+        except GitError as e:
+            self.logger.warning(
+                f"Unable to diff {self.repository_uri} "
+                f"{since}..{until}: {e}"
+            )
+            return None
+        return [
+            path.removeprefix("templates/")
+            for path in diff.splitlines()
+            if path.startswith("templates/")
+        ]
+
+    def get_changed_directories(self, changed_files: list) -> list | None:
+        """Return the smallest set of template directories that need to be
+        rescanned for the changed files. Return None if the changes can
+        affect pages outside of their own directory, in which case the whole
+        tree has to be rescanned.
+        """
+        directories = set()
+        for changed_file in changed_files:
+            path = PurePosixPath(changed_file)
+            # Layouts and partials can be extended or included from anywhere
+            if is_template(path) or is_partial(path):
+                return None
+            directories.add(path.parent)
+
+        # Skip directories that are scanned as part of one of their parents
+        return sorted(
+            directory
+            for directory in directories
+            if not any(parent in directories for parent in directory.parents)
+        )
+
+    def _page_name(self, directory: PurePosixPath) -> str:
+        """Return the webpage name for a directory relative to templates"""
+        return "" if str(directory) == "." else f"/{directory}"
+
+    def update_webpages_for_directories(self, db: SQLAlchemy, directories):
+        """Rescan the given template directories and update the matching
+        webpages, without touching the rest of the tree.
+        """
+        project, _ = get_or_create(
+            db.session,
+            Project,
+            name=self.repository_uri,
+        )
+        templates_folder = self.get_templates_folder()
+
+        for directory in directories:
+            # Attach new directories to their closest existing ancestor
+            parent = None
+            while str(directory) != ".":
+                parent = Webpage.query.filter_by(
+                    project_id=project.id,
+                    name=self._page_name(directory.parent),
+                ).first()
+                if parent:
+                    break
+                directory = directory.parent
+
+            if not parent:
+                # The root itself changed, so there is no subtree to patch
+                self.create_webpages_for_tree(db, self.scan_templates())
+                return
+
+            path = templates_folder / directory
+            if not path.is_dir():
+                # Removed directories are kept, as in a full rescan
+                continue
+
+            node = self.scan_templates(path)
+            if not (node.get("title") or node.get("children")):
+                continue
+
+            self.logger.info(
+                f"Updating {self.repository_uri} pages under {node['name']}"
+            )
+            self.sync_webpages(db, node, parent_id=parent.id)
+
+        db.session.commit()
+
+    def set_last_commit(self, db: SQLAlchemy, commit_sha: str | None):
+        project, _ = get_or_create(
+            db.session,
+            Project,
+            name=self.repository_uri,
+        )
+        project.last_commit_sha = commit_sha
+        db.session.commit()
+
+    def get_new_tree(self, incremental: bool = False):
         """Get the tree from the repository, update the cache and save to the
         database.
 
+        When incremental is set, only the template directories that changed
+        since the last synchronised commit are rescanned, and None is returned
+        if the repository did not change at all.
         """
+        if not self.sync_repository():
+            return None
+
+        head = self.get_head_commit()
+        project = Project.query.filter_by(name=self.repository_uri).first()
+        last_commit = project.last_commit_sha if project else None
+
+        # Without a synced commit, or saved webpages, templates are all scanned
+        incremental = incremental and bool(head and last_commit)
+        if incremental and head == last_commit and self._has_webpages():
+            self.logger.info(
+                f"{self.repository_uri} unchanged at {head}, "
+                "skipping tree update"
+            )
+            return None
+
+        if incremental and self._has_webpages():
+            changed_files = self.get_changed_templates(last_commit, head)
+            if changed_files is not None:
+                directories = self.get_changed_directories(changed_files)
+                if directories is not None:
+                    self.update_webpages_for_directories(self.db, directories)
+                    self.set_last_commit(self.db, head)
+                    tree = get_tree_struct(
+                        db.session, self._get_webpages(eager=True)
+                    )
+                    self.logger.info(
+                        f"Tree updated for {self.repository_uri} from "
+                        f"{len(changed_files)} changed files"
+                    )
+                    return tree
+
         # Generate the base tree from the repository
-        base_tree = self.get_tree_from_disk()
+        base_tree = self.scan_templates()
 
         if base_tree:
             # Save the tree metadata to the database and return an updated tree
             # that has all fields
             tree = self.create_webpages_for_tree(self.db, base_tree)
             self.sort_tree_by_page_name(tree)
+            self.set_last_commit(self.db, head)
             self.logger.info(f"Tree loaded for {self.repository_uri}")
             return tree
         return None
@@ -197,43 +701,174 @@ class SiteRepository:
     def _has_incomplete_pages(self, webpages) -> bool:
         """At times, the tree might not be fully loaded at the point when saved
         to the database. This function returns whether a page is invalid.
+
+        The children of a root are looked up in the given webpages first, so
+        the database is only queried for a root none of them belongs to.
         """
+        parent_ids = {webpage.parent_id for webpage in webpages}
         for webpage in webpages:
-            children = (
-                self.db.session.execute(
-                    select(Webpage).where(
-                        Webpage.parent_id == webpage.id,
-                    ),
-                )
-                .scalars()
-                .all()
-            )
             if (webpage.parent_id and not (webpage.name or webpage.title)) or (
-                not webpage.parent_id and not children
+                not webpage.parent_id
+                and webpage.id not in parent_ids
+                and not self._has_children(webpage)
             ):
                 self.logger.warning(f"Page {webpage.id} is incomplete.")
                 return True
         return False
 
-    # This method is called when an endpoint is called from FE to get the tree
-    def get_tree_from_db(self):
-        """Get the tree from the database. If the tree is incomplete, reload
-        from the repository.
+    def _has_children(self, webpage) -> bool:
+        """Check whether any webpage, including the ones being deleted, has
+        the given webpage as its parent.
         """
-        if project_id := get_or_create_project_id(self.repository_uri):
-            webpages = (
+        query = (
+            select(Webpage.id).where(Webpage.parent_id == webpage.id).limit(1)
+        )
+        return self.db.session.execute(query).first() is not None
+
+    def _has_webpages(self) -> bool:
+        """Check whether the project has webpages that are not being
+        deleted, without loading them.
+        """
+        query = (
+            select(Webpage.id)
+            .where(Webpage.project_id == get_project_id(self.repository_uri))
+            .where(Webpage.status != WebpageStatus.TO_DELETE)
+            .limit(1)
+        )
+        return self.db.session.execute(query).first() is not None
+
+    def _get_webpages(self, eager: bool = False):
+        """Return the webpages of the project that are not being deleted.
+
+        When eager is set, the relationships serialised in the tree are loaded
+        along with the webpages, in a fixed number of queries.
+        """
+        project_id = get_project_id(self.repository_uri)
+        query = (
+            select(Webpage)
+            .where(
+                Webpage.project_id == project_id,
+            )
+            .where(Webpage.status != WebpageStatus.TO_DELETE)
+        )
+        if eager:
+            query = query.options(*TREE_LOAD_OPTIONS)
+        return self.db.session.execute(query).scalars().all()
+
+    def get_subtree_from_db(self, webpage_id: int):
+        """Get the tree rooted at a webpage from the database, loading its
+        descendants with a recursive query over parent_id.
+        """
+        subtree = (
+            select(Webpage.id)
+            .where(Webpage.id == webpage_id)
+            .where(Webpage.status != WebpageStatus.TO_DELETE)
+            .cte(recursive=True)
+        )
+        subtree = subtree.union_all(
+            select(Webpage.id)
+            .where(Webpage.parent_id == subtree.c.id)
+            .where(Webpage.status != WebpageStatus.TO_DELETE)
+        )
+        webpages = (
+            self.db.session.execute(
+                select(Webpage)
+                .where(Webpage.id.in_(select(subtree.c.id)))
+                .options(*TREE_LOAD_OPTIONS)
+            )
+            .scalars()
+            .all()
+        )
+        return get_tree_struct(db.session, webpages, root_id=webpage_id)
+
+    def get_webpage(self, webpage_id: int | None = None, url: str = ""):
+        """Return the project's webpage with the given id, or url if no id is
+        given.
+        """
+        query = (
+            select(Webpage)
+            .where(Webpage.project_id == get_project_id(self.repository_uri))
+            .where(Webpage.status != WebpageStatus.TO_DELETE)
+            .options(*TREE_LOAD_OPTIONS)
+        )
+        if webpage_id is not None:
+            query = query.where(Webpage.id == webpage_id)
+        else:
+            query = query.where(Webpage.url == url)
+        return self.db.session.execute(query).scalars().first()
+
+    def count_children(self, webpage_ids: list) -> dict:
+        """Return the number of children of each webpage, by id"""
+        counts = {}
+        for batch in batches(webpage_ids):
+            counts.update(
                 self.db.session.execute(
+                    select(Webpage.parent_id, func.count(Webpage.id))
+                    .where(Webpage.parent_id.in_(batch))
+                    .where(Webpage.status != WebpageStatus.TO_DELETE)
+                    .group_by(Webpage.parent_id)
+                ).all()
+            )
+        return counts
+
+    def get_subtree(
+        self,
+        webpage: Webpage,
+        depth: int = 1,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> tuple[dict, int]:
+        """Return a webpage with depth levels of its children, and the number
+        of its direct children.
+
+        Only the direct children from offset to limit are included. Every
+        node has a children_count, and the nodes on the last level have no
+        children key, as their children aren't loaded.
+        """
+        tree = convert_webpage_to_dict(webpage, webpage.owner, webpage.project)
+        total = self.count_children([webpage.id]).get(webpage.id, 0)
+        tree["children_count"] = total
+        level = [tree]
+        for level_number in range(depth):
+            nodes = {node["id"]: node for node in level}
+            for node in level:
+                node["children"] = []
+
+            children = []
+            for batch in batches(list(nodes)):
+                query = (
                     select(Webpage)
-                    .where(
-                        Webpage.project_id == project_id,
-                    )
-                    .where(Webpage.status != WebpageStatus.TO_DELETE),
+                    .where(Webpage.parent_id.in_(batch))
+                    .where(Webpage.status != WebpageStatus.TO_DELETE)
+                    .order_by(Webpage.name)
+                    .options(*TREE_LOAD_OPTIONS)
                 )
-                .scalars()
-                .all()
-            )
+                if level_number == 0:
+                    query = query.offset(offset).limit(limit)
+                children.extend(self.db.session.execute(query).scalars())
+
+            counts = self.count_children([child.id for child in children])
+            level = []
+            for child in children:
+                node = convert_webpage_to_dict(
+                    child, child.owner, child.project
+                )
+                node["children_count"] = counts.get(child.id, 0)
+                nodes[child.parent_id]["children"].append(node)
+                level.append(node)
+        return tree, total
+
+    # This method is called when an endpoint is called from FE to get the tree
+    def get_tree_from_db(self, load_repository: bool = True):
+        """Get the tree from the database. If the tree is incomplete, reload
+        from the repository, or return None if load_repository is not set.
+        """
+        if get_or_create_project_id(self.repository_uri):
+            webpages = self._get_webpages(eager=True)
             # build tree from repository in case DB table is empty
             if not webpages or self._has_incomplete_pages(webpages):
+                if not load_repository:
+                    return None
                 tree = self.get_new_tree()
             # otherwise, build tree from DB
             else:
@@ -249,6 +884,8 @@ class SiteRepository:
                     self.logger.info(
                         msg,
                     )
+                    if not load_repository:
+                        return None
                     tree = self.get_new_tree()
             return tree
         return None
@@ -257,83 +894,33 @@ class SiteRepository:
     def get_tree(self):
         """Get a new tree from the repository"""
 
-        new_tree = self.get_new_tree()
-        self.set_tree_in_cache(new_tree)
-
-    def __create_webpage_for_node__(
-        self,
-        db: SQLAlchemy,
-        node: dict,
-        project: Project,
-        owner: User,
-        parent_id: int,
-    ):
-        """Create a webpage from a node in the tree."""
-        # Get a webpage for this name and project, or create a new one
-        webpage, created = get_or_create(
-            db.session,
-            Webpage,
-            name=node["name"],
-            url=node["name"],
-            project_id=project.id,
-            commit=False,
-        )
-
-        # If instance is new, update the owner and project fields
-        if created:
-            webpage.owner_id = owner.id
-            webpage.project_id = project.id
-
-        # Update the fields
-        webpage.title = node["title"]
-        webpage.description = node["description"]
-        webpage.copy_doc_link = node["link"]
-        webpage.parent_id = parent_id
-        webpage.ext = node["ext"]
-        webpage.file_path = node["file_path"]
-        if webpage.status == WebpageStatus.NEW:
-            webpage.status = WebpageStatus.AVAILABLE
+        new_tree = self.get_new_tree(incremental=True)
+        # Keep the cached tree if the repository did not change
+        if new_tree:
+            self.set_tree_in_cache(new_tree)
 
-        db.session.add(webpage)
-        db.session.flush()
-
-        webpage_dict = convert_webpage_to_dict(webpage, owner, project)
+    def _flatten_tree(self, tree: Tree, parent_name: str | None = None):
+        """Return (node, parent name) pairs for every node in the tree,
+        depth first.
+        """
+        nodes = [(tree, parent_name)]
+        for child in tree.get("children", []):
+            nodes.extend(self._flatten_tree(child, tree["name"]))
+        return nodes
 
-        # Return a dict with the webpage fields
-        return {**node, **webpage_dict}
+    def sync_webpages(self, db: SQLAlchemy, tree: Tree, parent_id=None):
+        """Create or update the webpages for each node in a scanned tree.
 
-    def __create_webpages_for_children__(
-        self,
-        db,
-        children,
-        project,
-        owner,
-        parent_id,
-    ):
-        """Recursively create webpages for each child in the tree."""
-        for child in children:
-            # Create a webpage for the root node
-            webpage_dict = self.__create_webpage_for_node__(
-                db,
-                child,
-                project,
-                owner,
-                parent_id,
-            )
-            # Update the child node with the webpage fields
-            child.update(webpage_dict)
-            if child.get("children"):
-                # Create webpages for the children recursively
-                self.__create_webpages_for_children__(
-                    db,
-                    child["children"],
-                    project,
-                    owner,
-                    webpage_dict["id"],
-                )
+        Existing webpages are loaded in one query and compared with the tree
+        in memory. New webpages are inserted in batches, then the fields and
+        parent links of every changed webpage are updated in a second batched
+        pass, once the ids of the new webpages are known.
 
-    def create_webpages_for_tree(self, db: SQLAlchemy, tree: Tree):
-        """Create webpages for each node in the tree."""
+        Args:
+            tree (Tree): The scanned tree, or a subtree of it.
+            parent_id (int): The id of the webpage the root of the tree
+                belongs to, if it is a subtree.
+        """
         # Get the default project and owner for new webpages
         project, _ = get_or_create(
             db.session,
@@ -342,26 +929,100 @@ class SiteRepository:
         )
         owner, _ = get_or_create(db.session, User, name="Default")
 
-        # Create a webpage for the root node
-        webpage_dict = self.__create_webpage_for_node__(
-            db,
-            tree,
-            project,
-            owner,
-            None,
-        )
+        # If a name appears more than once, the last node wins as it did when
+        # webpages were updated one at a time
+        nodes = {
+            node["name"]: (node, parent_name)
+            for node, parent_name in self._flatten_tree(tree)
+        }
 
-        # Create webpages for the children recursively
-        self.__create_webpages_for_children__(
-            db,
-            webpage_dict["children"],
-            project,
-            owner,
-            webpage_dict["id"],
+        # Index the existing webpages by name, keeping the oldest duplicate
+        existing = {
+            row.name: row
+            for row in db.session.execute(
+                select(
+                    Webpage.id,
+                    Webpage.name,
+                    Webpage.status,
+                    Webpage.parent_id,
+                    *(
+                        getattr(Webpage, column)
+                        for column in WEBPAGE_SYNC_FIELDS.values()
+                    ),
+                )
+                .where(
+                    Webpage.project_id == project.id,
+                    Webpage.url == Webpage.name,
+                )
+                .order_by(Webpage.id.desc())
+            )
+        }
+
+        def node_fields(node):
+            return {
+                column: node[key]
+                for key, column in WEBPAGE_SYNC_FIELDS.items()
+            }
+
+        # Insert the new webpages, without their parents
+        new_webpages = [
+            {
+                "name": name,
+                "url": name,
+                "project_id": project.id,
+                "owner_id": owner.id,
+                **node_fields(node),
+            }
+            for name, (node, _) in nodes.items()
+            if name not in existing
+        ]
+        ids = {name: row.id for name, row in existing.items()}
+        existing_ids = set(ids.values())
+        for batch in batches(new_webpages):
+            result = db.session.execute(
+                insert(Webpage).returning(Webpage.id, Webpage.name),
+                batch,
+            )
+            ids.update({row.name: row.id for row in result})
+
+        # Update changed fields and resolve the parents of all webpages
+        updates = []
+        for name, (node, parent_name) in nodes.items():
+            values = {
+                **node_fields(node),
+                "parent_id": (
+                    parent_id if parent_name is None else ids[parent_name]
+                ),
+                "status": WebpageStatus.AVAILABLE,
+            }
+            row = existing.get(name)
+            if row:
+                if row.status != WebpageStatus.NEW:
+                    values["status"] = row.status
+                if all(
+                    getattr(row, key) == value for key, value in values.items()
+                ):
+                    continue
+            elif values["parent_id"] is None:
+                continue
+            updates.append({"id": ids[name], **values})
+
+        for batch in batches(updates):
+            db.session.execute(update(Webpage), batch)
+
+        updated = sum(1 for row in updates if row["id"] in existing_ids)
+        self.logger.info(
+            f"Synced {len(nodes)} pages for {self.repository_uri}: "
+            f"{len(new_webpages)} created, {updated} updated"
         )
 
+    def create_webpages_for_tree(self, db: SQLAlchemy, tree: Tree):
+        """Create webpages for each node in the tree, and return the tree of
+        the project's webpages.
+        """
+        self.sync_webpages(db, tree)
         db.session.commit()
-        return webpage_dict
+        return get_tree_struct(db.session, self._get_webpages(eager=True))
 
     def get_tree_sync(self, no_cache: bool = False):
         """Try to get the tree from the cache, database or repository."""
@@ -369,6 +1030,11 @@ class SiteRepository:
         if not no_cache and (tree := self.get_tree_from_cache()):
             return tree
 
+        # Then try to assemble it from the cached sections
+        if not no_cache and (tree := self.get_tree_from_fragments()):
+            self.set_assembled_tree_in_cache(tree)
+            return tree
+
         self.logger.info(f"Loading {self.repository_uri} from database")
 
         # Load the tree from database
@@ -380,12 +1046,33 @@ class SiteRepository:
             return tree
 
         # Or just return an empty tree
-        return {
-            "name": "",
-            "title": "",
-            "description": "",
-            "copy_doc_link": "",
-            "children": [],
+        return dict(EMPTY_TREE, children=[])
+
+    def get_tree_async(self) -> tuple[Tree, dict]:
+        """Get the tree without waiting for it to be rebuilt.
+
+        Return the tree along with its version, build time and whether it is
+        stale. Once invalidated, the last good tree is returned as stale until
+        the caller rebuilds it in the background. The repository is never
+        loaded here, so the tree is empty and stale until it is first built.
+        """
+        info = self.get_tree_info()
+        if info and not info["stale"]:
+            if (tree := self.get_tree_from_cache()) is not None:
+                return tree, info
+
+        if info and (tree := self.cache.get(self.last_good_key)) is not None:
+            return tree, {**info, "stale": True}
+
+        self.logger.info(f"Loading {self.repository_uri} from database")
+        if tree := self.get_tree_from_db(load_repository=False):
+            self.set_tree_in_cache(tree)
+            return tree, self.get_tree_info()
+
+        return dict(EMPTY_TREE, children=[]), {
+            "version": None,
+            "built_at": None,
+            "stale": True,
         }
 
     def add_pages_to_list(self, tree, page_list: list):
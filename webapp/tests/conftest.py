@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import event
+
+from webapp import create_app
+from webapp.cache import FileCache
+from webapp.models import db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app backed by a throwaway SQLite database and file cache."""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/test.db")
+    app = create_app()
+    app.config["BASE_DIR"] = str(tmp_path)
+    app.config["CACHE"] = FileCache(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def queries(app):
+    """The SQL statements executed while the test runs."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
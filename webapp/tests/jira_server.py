@@ -0,0 +1,165 @@
+"""A local fake of the parts of the Jira Cloud API the Jira client uses, for
+tests and benchmarks.
+"""
+
+import json
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+CLOUD_ID = "cloud-id"
+SITE_URL = "https://example.atlassian.net"
+API_PATH = f"/ex/jira/{CLOUD_ID}/rest/api/3"
+KEY_IN_PATTERN = re.compile(r"key in \(([^)]*)\)")
+UPDATED_PATTERN = re.compile(r'project = "([^"]+)" AND updated >= "-(\d+)m"')
+
+
+class FakeJiraHandler(BaseHTTPRequestHandler):
+    server: "FakeJira"
+    # Keep connections open between requests, like Jira. Headers and bodies
+    # are written separately, so send them without waiting for ACKs.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body, headers: dict = {}):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> dict:
+        return json.loads(self.body or b"{}")
+
+    def issue(self, key: str) -> dict:
+        return {
+            "key": key,
+            "fields": {"status": {"name": self.server.issues[key]}},
+        }
+
+    def handle_request(self, method: str):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length", 0))
+        self.body = self.rfile.read(length)
+        self.server.requests.append((method, path))
+        self.server.client_ports.add(self.client_address[1])
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if path.startswith(API_PATH) and self.server.errors:
+            status, headers = self.server.errors.pop(0)
+            return self.send_json(status, {"errorMessages": []}, headers)
+
+        if (method, path) == ("POST", "/oauth/token"):
+            return self.send_json(
+                200, {"access_token": "token", "expires_in": 3600}
+            )
+        if (method, path) == ("GET", "/oauth/token/accessible-resources"):
+            return self.send_json(200, [{"id": CLOUD_ID, "url": SITE_URL}])
+        if method == "GET" and path.startswith(f"{API_PATH}/issue/"):
+            key = path.rsplit("/", 1)[-1]
+            if key not in self.server.issues:
+                return self.send_json(404, {"errorMessages": ["Not found"]})
+            return self.send_json(200, self.issue(key))
+        if (method, path) == ("POST", f"{API_PATH}/search/jql"):
+            return self.search(self.read_json())
+        self.send_json(404, {"errorMessages": [f"No route for {path}"]})
+
+    def search(self, payload: dict):
+        """Search issues by key, like Jira, which rejects the whole query if
+        one of the keys doesn't exist, and by project and update time.
+        """
+        keys = list(self.server.issues)
+        if match := KEY_IN_PATTERN.search(payload["jql"]):
+            keys = [k.strip().strip('"') for k in match.group(1).split(",")]
+            missing = [key for key in keys if key not in self.server.issues]
+            if missing:
+                return self.send_json(
+                    400,
+                    {"errorMessages": [f"Issue {missing[0]} does not exist"]},
+                )
+        if match := UPDATED_PATTERN.search(payload["jql"]):
+            project, minutes = match.groups()
+            since = time.time() - int(minutes) * 60
+            keys = [
+                key
+                for key in keys
+                if key.startswith(f"{project}-")
+                and self.server.updated.get(key, 0) >= since
+            ]
+
+        start = int(payload.get("nextPageToken") or 0)
+        end = start + payload.get("maxResults", 50)
+        body = {
+            "issues": [self.issue(key) for key in keys[start:end]],
+            "isLast": end >= len(keys),
+        }
+        if not body["isLast"]:
+            body["nextPageToken"] = str(end)
+        self.send_json(200, body)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+
+class FakeJira(ThreadingHTTPServer):
+    """A fake Jira server, listening on a local port.
+
+    Args:
+        issues: The status name of each issue, by key.
+        latency: Seconds to wait before answering each request.
+        ssl_context: A server SSL context, to serve HTTPS.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        issues: dict[str, str] | None = None,
+        latency=0.0,
+        ssl_context: ssl.SSLContext | None = None,
+    ):
+        super().__init__(("127.0.0.1", 0), FakeJiraHandler)
+        if ssl_context:
+            self.socket = ssl_context.wrap_socket(
+                self.socket, server_side=True
+            )
+        self.issues = issues if issues is not None else {}
+        # Update times of the issues, by key. Issues without one are old.
+        self.updated = {}
+        self.latency = latency
+        # Error statuses and headers to answer the next API requests with
+        self.errors = []
+        self.requests = []
+        # Local ports of the connections requests were received on
+        self.client_ports = set()
+        scheme = "https" if ssl_context else "http"
+        self.url = f"{scheme}://127.0.0.1:{self.server_port}"
+
+    def set_status(self, key: str, status: str):
+        self.issues[key] = status
+        self.updated[key] = time.time()
+
+    def fail(self, status: int, times=1, retry_after: str | None = None):
+        """Answer the next API requests with an error status"""
+        headers = {"Retry-After": retry_after} if retry_after else {}
+        self.errors.extend([(status, headers)] * times)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,285 @@
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from webapp.cache import (
+    COMPRESSORS,
+    SERIALIZERS,
+    Codec,
+    FileCache,
+    LockTimeout,
+    LRUCache,
+    TieredCache,
+)
+
+VALUE = {"name": "", "children": [{"name": "/a", "title": "A", "id": 1}]}
+
+
+@pytest.mark.parametrize(
+    "serializer,compressor", itertools.product(SERIALIZERS, COMPRESSORS)
+)
+def test_codecs_round_trip(serializer, compressor):
+    codec = Codec(serializer, compressor)
+    data = codec.encode(VALUE)
+    assert data.startswith(Codec.HEADER_MARK)
+    # Values can be decoded without knowing their codec
+    assert Codec.from_name("json:none").decode(data) == VALUE
+
+
+def test_file_cache_codecs(app):
+    app.config["CACHE_CODEC"] = "json:zlib"
+    cache = FileCache(app)
+    cache.set("tree", VALUE)
+    assert cache.get("tree") == VALUE
+
+    # Entries written before codecs were introduced are plain JSON
+    path = Path(cache.cache_path) / f"{cache.CACHE_PREFIX}_legacy"
+    path.write_text('{"name": "legacy"}')
+    assert cache.get("legacy") == {"name": "legacy"}
+
+    # Entries written with an unavailable codec are misses
+    path.write_bytes(Codec.HEADER_MARK + b"pickle:none\n...")
+    assert cache.get("legacy") is None
+
+
+def test_unavailable_codec():
+    with pytest.raises(ValueError):
+        Codec.from_name("pickle:zlib")
+    # The default codec doesn't depend on what is installed
+    assert Codec.from_name().name == "json:zlib"
+
+
+def test_tiered_cache(app):
+    app.config["CACHE_L1_MAX_SIZE"] = 1024
+    # Two workers sharing the same files
+    worker, other_worker = (TieredCache(app, FileCache(app)) for _ in "ab")
+
+    worker.set("tree", VALUE)
+    assert worker.get("tree") == VALUE
+    # Every read gets its own copy
+    tree = worker.get("tree")
+    tree["name"] = "modified"
+    assert worker.get("tree") == VALUE
+    assert worker.stats()["l1"]["hits"] == 2
+    assert worker.stats()["l1"]["misses"] == 1
+
+    # L2 isn't checked again for check_interval seconds
+    worker.check_interval = 60
+    stamps = []
+    get_stamp = worker.backend.get_stamp
+    worker.backend.get_stamp = lambda key: stamps.append(key) or get_stamp(key)
+    assert worker.get("tree") == VALUE
+    assert stamps == []
+
+    # Then values set in other workers are reloaded
+    worker.check_interval = 0
+    other_worker.set("tree", {"name": "changed"})
+    assert worker.get("tree") == {"name": "changed"}
+    assert stamps
+    assert worker.stats()["l1"]["stale"] == 1
+
+
+def test_lru_cache_limits():
+    lru = LRUCache(max_size=10, ttl=60)
+    lru.set("a", "A", "1", 4)
+    lru.set("b", "B", "1", 4)
+    assert lru.get("a")[:2] == ("A", "1")
+    # The least recently used entry is evicted
+    lru.set("c", "C", "1", 4)
+    assert lru.get("b") is None
+    assert lru.get("a") and lru.get("c")
+    assert lru.size == 8 and lru.evictions == 1
+    # Entries larger than the cache are not kept
+    lru.set("d", "D", "1", 11)
+    assert lru.get("d") is None
+
+    # Checks are only recorded for the cached stamp
+    checked_at = lru.get("a")[2]
+    lru.mark_checked("a", "2")
+    assert lru.get("a")[2] == checked_at
+    lru.mark_checked("a", "1")
+    assert lru.get("a")[2] > checked_at
+
+    lru.ttl = -1
+    lru.set("e", "E", "1", 1)
+    assert lru.get("e") is None
+
+
+@pytest.mark.parametrize("mmap_min_size", [0, 1])
+def test_file_cache_concurrent_writes(app, mmap_min_size):
+    app.config["CACHE_MMAP_MIN_SIZE"] = mmap_min_size
+    cache = FileCache(app)
+    values = [{"version": i, "data": "x" * 100_000} for i in range(20)]
+    cache.set("tree", values[0])
+
+    def write(value):
+        cache.set("tree", value)
+
+    def read(_):
+        # Readers always see a whole value, never a missing or partial file
+        return cache.get("tree")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        writes = executor.map(write, values)
+        reads = list(executor.map(read, range(200)))
+        list(writes)
+
+    assert all(value in values for value in reads)
+    assert cache.get("tree") in values
+    # No temporary files are left behind
+    assert sorted(os.listdir(cache.cache_path)) == sorted(
+        [f"{cache.CACHE_PREFIX}_tree", cache.LOCK_DIR]
+    )
+
+    cache.delete("tree")
+    assert cache.get("tree") is None
+    cache.delete("tree")
+
+
+def test_file_cache_ttl(app):
+    cache = FileCache(app)
+    cache.set("stats", VALUE, ttl=60)
+    cache.set("projects", VALUE, ttl=-1)
+    assert cache.get("stats") == VALUE
+    # Expired entries are misses, and their files are removed
+    assert cache.get("projects") is None
+    assert not os.path.exists(
+        cache.get_file_path(f"{cache.CACHE_PREFIX}_projects")
+    )
+
+
+def test_file_cache_eviction(app):
+    app.config["CACHE_FILE_MAX_SIZE"] = 0
+    cache = FileCache(app)
+    for key in "abc":
+        cache.set(key, {"data": "x" * 1000})
+    # Access times are recorded on reads, a then c then b
+    for i, key in enumerate("acb"):
+        path = cache.get_file_path(f"{cache.CACHE_PREFIX}_{key}")
+        os.utime(path, ns=(i, os.stat(path).st_mtime_ns))
+    assert cache.get("a") is not None
+
+    # The least recently read entries are evicted first
+    cache.max_size = cache.stats()["bytes"] - 1
+    cache.evict()
+    assert cache.get("c") is None
+    assert cache.get("a") and cache.get("b")
+
+    # Writes only measure the cache again once it grows past its size
+    cache.max_size = cache.size + 10
+    listings = []
+    list_files = cache.list_files
+    cache.list_files = lambda: listings.append(1) or list_files()
+    cache.set("a", {"data": "y"})
+    assert listings == []
+    path = cache.get_file_path(f"{cache.CACHE_PREFIX}_b")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns))
+    cache.set("d", {"data": "x" * 1000})
+    assert listings == [1]
+    assert cache.get("b") is None
+    assert cache.size == cache.stats()["bytes"] <= cache.max_size
+
+
+def test_file_cache_stats(app):
+    cache = FileCache(app)
+    cache.set("SITE_REPOSITORY_ubuntu.com", VALUE)
+    cache.set("SITE_REPOSITORY_canonical.com_INDEX", VALUE)
+    cache.set("PAGE_STATS_CACHE", VALUE)
+    cache.set("expired", VALUE, ttl=-1)
+    cache.get("expired")
+
+    stats = cache.stats()
+    assert stats["entries"] == 3
+    assert stats["prefixes"]["SITE_REPOSITORY"]["entries"] == 2
+    assert stats["prefixes"]["PAGE_STATS_CACHE"]["entries"] == 1
+    assert stats["bytes"] == sum(
+        prefix["bytes"] for prefix in stats["prefixes"].values()
+    )
+
+
+@pytest.mark.parametrize("tiered", [False, True])
+def test_cache_batches(app, tiered):
+    app.config["CACHE_L1_MAX_SIZE"] = 1024
+    cache = FileCache(app)
+    if tiered:
+        cache = TieredCache(app, cache)
+    cache.set("a", "stale")
+    cache.get("a")
+
+    cache.set_many({"a": VALUE, "b": [1, 2], "c": None})
+    assert cache.get_many(["a", "b", "missing"]) == {
+        "a": VALUE,
+        "b": [1, 2],
+        "missing": None,
+    }
+    assert cache.get("a") == VALUE
+
+    cache.delete_many(["a", "b", "missing"])
+    assert cache.get_many("ab") == {"a": None, "b": None}
+    assert cache.stats()["entries"] == 1
+
+
+@pytest.mark.parametrize("tiered", [False, True])
+def test_cache_add(app, tiered):
+    cache = FileCache(app)
+    if tiered:
+        cache = TieredCache(app, cache)
+
+    # Only one of several concurrent adds sets the key
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        added = list(executor.map(lambda i: cache.add("claim", i), range(16)))
+    assert added.count(True) == 1
+    assert cache.get("claim") == added.index(True)
+
+    # Expired values are replaced
+    assert cache.add("expiring", 1, ttl=-1)
+    assert cache.add("expiring", 2, ttl=60)
+    assert not cache.add("expiring", 3)
+    assert cache.get("expiring") == 2
+
+
+def hold_lock_and_die(app, name):
+    FileCache(app).get_lock(name).acquire()
+    os._exit(0)
+
+
+def test_cache_lock(app):
+    cache = FileCache(app)
+    lock = cache.get_lock("sync", ttl=0.3, timeout=0)
+    other = cache.get_lock("sync", timeout=0.2)
+    assert lock.acquire()
+    assert cache.get_lock_owners(["sync", "free"]) == {
+        "sync": lock.token,
+        "free": None,
+    }
+
+    # Other owners wait for the timeout, and can't release the lock
+    start = time.monotonic()
+    with pytest.raises(LockTimeout):
+        with other:
+            pass
+    assert time.monotonic() - start >= 0.2
+    assert not cache.release_lock("sync", "not-the-owner")
+
+    # The lock is renewed while held
+    time.sleep(0.5)
+    assert not lock.lost
+    assert cache.get_lock_owners(["sync"])["sync"] == lock.token
+
+    lock.release()
+    assert cache.get_lock_owners(["sync"])["sync"] is None
+    with other:
+        assert cache.get_lock_owners(["sync"])["sync"] == other.token
+
+    # Locks held by crashed processes are released
+    process = multiprocessing.get_context("fork").Process(
+        target=hold_lock_and_die, args=(app, "sync")
+    )
+    process.start()
+    process.join()
+    assert cache.get_lock("sync", timeout=0).acquire()
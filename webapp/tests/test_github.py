@@ -0,0 +1,101 @@
+import shutil
+
+import pytest
+from git import Repo
+from git.exc import GitCommandError
+
+from webapp import create_app
+from webapp.cache import FileCache
+from webapp.github import SYNC_METRICS_KEY, GitHub
+from webapp.site_repository import get_sync_lock_name
+
+
+def commit_file(repo: Repo, name: str, content: str):
+    path = f"{repo.working_tree_dir}/{name}"
+    with open(path, "w") as f:
+        f.write(content)
+    repo.index.add([name])
+    return repo.index.commit(f"Update {name}")
+
+
+@pytest.fixture
+def origin(tmp_path):
+    repo = Repo.init(tmp_path / "org" / "site.com.git", initial_branch="main")
+    commit_file(repo, "index.html", "v1")
+    return repo
+
+
+@pytest.fixture
+def github(tmp_path, monkeypatch, origin):
+    monkeypatch.setattr("webapp.github.REPO_ORG", f"file://{tmp_path / 'org'}")
+    app = create_app()
+    app.config["BASE_DIR"] = str(tmp_path)
+    app.config["CACHE"] = FileCache(app)
+    github = GitHub(app)
+    github.REPOSITORY_PATH = tmp_path / "repositories"
+    github.REPOSITORY_PATH.mkdir()
+    return github
+
+
+def test_clone_then_fetch(github, origin):
+    github.clone_repository("site.com")
+    checkout = github.REPOSITORY_PATH / "site.com"
+    assert (checkout / "index.html").read_text() == "v1"
+
+    new_commit = commit_file(origin, "index.html", "v2")
+    github.clone_repository("site.com")
+
+    assert (checkout / "index.html").read_text() == "v2"
+    assert Repo(checkout).head.commit.hexsha == new_commit.hexsha
+    metrics = github.cache.get(SYNC_METRICS_KEY)["site.com"]
+    assert metrics["clone"]["count"] == 1
+    assert metrics["fetch"]["count"] == 1
+
+
+def test_corrupt_checkout_falls_back_to_clone(github, origin):
+    github.clone_repository("site.com")
+    checkout = github.REPOSITORY_PATH / "site.com"
+    shutil.rmtree(checkout / ".git")
+
+    github.clone_repository("site.com")
+
+    assert Repo(checkout).head.commit.hexsha == origin.head.commit.hexsha
+    metrics = github.cache.get(SYNC_METRICS_KEY)["site.com"]
+    assert metrics["clone"]["count"] == 2
+
+
+def test_missing_objects_fall_back_to_clone(github, origin):
+    github.clone_repository("site.com")
+    checkout = github.REPOSITORY_PATH / "site.com"
+    for pack in (checkout / ".git" / "objects" / "pack").iterdir():
+        pack.unlink()
+    for objects in (checkout / ".git" / "objects").glob("[0-9a-f][0-9a-f]"):
+        shutil.rmtree(objects)
+
+    github.clone_repository("site.com")
+
+    assert Repo(checkout).head.commit.hexsha == origin.head.commit.hexsha
+    metrics = github.cache.get(SYNC_METRICS_KEY)["site.com"]
+    assert metrics["clone"]["count"] == 2
+
+
+def test_fetch_errors_keep_the_checkout(github, origin):
+    github.clone_repository("site.com")
+    checkout = github.REPOSITORY_PATH / "site.com"
+    Repo(checkout).remotes.origin.set_url(f"{checkout}-unreachable")
+
+    with pytest.raises(GitCommandError):
+        github.clone_repository("site.com")
+
+    assert (checkout / "index.html").read_text() == "v1"
+    metrics = github.cache.get(SYNC_METRICS_KEY)["site.com"]
+    assert metrics["clone"]["count"] == 1
+    assert "fetch" not in metrics
+
+
+def test_sync_is_skipped_while_locked(github, origin):
+    with github.cache.get_lock(get_sync_lock_name("site.com"), timeout=0):
+        assert not github.clone_repository("site.com")
+    assert not (github.REPOSITORY_PATH / "site.com").exists()
+
+    assert github.clone_repository("site.com")
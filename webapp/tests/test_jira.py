@@ -0,0 +1,354 @@
+import hmac
+import json
+import time
+
+import pytest
+import requests
+
+from webapp.jira import (
+    Jira,
+    JiraRequestError,
+    JiraUnavailableError,
+    RateLimiter,
+)
+from webapp.models import (
+    JiraTask,
+    JIRATaskStatus,
+    JiraTaskType,
+    Webpage,
+    WebpageStatus,
+    db,
+)
+from webapp.routes.jira import jira_blueprint
+from webapp.scheduled_tasks import JIRA_WATERMARKS_KEY, poll_jira_statuses
+from webapp.site_repository import SiteRepository
+from webapp.tests.jira_server import API_PATH, SITE_URL, FakeJira
+from webapp.tests.test_site_repository import add_page_details, make_tree
+
+SEARCH = ("POST", f"{API_PATH}/search/jql")
+ISSUE = ("GET", f"{API_PATH}/issue/WD-1")
+
+
+@pytest.fixture
+def jira_server(monkeypatch):
+    with FakeJira() as server:
+        monkeypatch.setattr(Jira, "API_URL", server.url)
+        monkeypatch.setattr(Jira, "AUTH_URL", server.url)
+        monkeypatch.setattr(Jira, "RETRY_BACKOFF", 0.01)
+        # Start with a new session, rate limiter and circuit breaker
+        monkeypatch.setattr(Jira, "_session", None)
+        yield server
+
+
+@pytest.fixture
+def jira(jira_server):
+    return Jira(
+        url=SITE_URL,
+        client_id="id",
+        client_secret="secret",
+        labels=[],
+        copy_updates_epic="WD-1",
+        sites_maintenance_epic=None,
+    )
+
+
+def test_get_issues_statuses_in_batches(jira, jira_server, monkeypatch):
+    monkeypatch.setattr(Jira, "SEARCH_BATCH_SIZE", 10)
+    jira_server.issues.update({f"WD-{i}": "In Progress" for i in range(25)})
+    keys = [f"WD-{i}" for i in range(25)]
+    jira_server.requests.clear()
+
+    assert jira.get_issues_statuses(keys) == jira_server.issues
+    assert jira_server.requests == [SEARCH] * 3
+
+    # Batches with a deleted issue are fetched one issue at a time
+    jira_server.requests.clear()
+    statuses = jira.get_issues_statuses(["WD-1", "WD-deleted", "WD-2"])
+    assert statuses == {"WD-1": "In Progress", "WD-2": "In Progress"}
+    assert len(jira_server.requests) == 4
+
+
+def test_get_updated_issues_statuses(jira, jira_server, monkeypatch):
+    monkeypatch.setattr(Jira, "SEARCH_BATCH_SIZE", 10)
+    jira_server.issues.update({f"WD-{i}": "In Progress" for i in range(25)})
+    since = time.time()
+    for key in ("WD-1", "WD-2", "WD-20"):
+        jira_server.set_status(key, "Done")
+    keys = [f"WD-{i}" for i in range(20)]
+    jira_server.requests.clear()
+
+    # Only the given issues are searched for, in batches
+    statuses = jira.get_updated_issues_statuses("WD", keys, since)
+    assert statuses == {"WD-1": "Done", "WD-2": "Done"}
+    assert jira_server.requests == [SEARCH] * 2
+
+    # Batches with a deleted issue are fetched one issue at a time
+    statuses = jira.get_updated_issues_statuses(
+        "WD", ["WD-1", "WD-deleted"], since
+    )
+    assert statuses == {"WD-1": "Done"}
+
+
+def test_poll_jira_statuses(app, jira, jira_server):
+    site_repository = SiteRepository("site.com", app)
+    site_repository.sync_webpages(db, make_tree(2, 3))
+    db.session.commit()
+    add_page_details(Webpage.query.all())
+    site_repository.set_tree_in_cache(site_repository.get_tree_from_db())
+
+    tasks = JiraTask.query.order_by(JiraTask.id).all()
+    jira_server.issues.update({task.jira_id: "Untriaged" for task in tasks})
+    # Tasks in a terminal status aren't polled
+    tasks[0].status = JIRATaskStatus.DONE
+    jira_server.issues[tasks[0].jira_id] = "In Progress"
+    tasks[1].status = JIRATaskStatus.IN_PROGRESS
+    jira_server.issues[tasks[1].jira_id] = "In Review"
+    # Rejected removal requests make their webpage available again
+    tasks[2].request_type = JiraTaskType.PAGE_REMOVAL
+    tasks[2].webpages.status = WebpageStatus.TO_DELETE
+    jira_server.issues[tasks[2].jira_id] = "Rejected"
+    db.session.commit()
+    task_ids = [task.id for task in tasks]
+    webpage_id = tasks[2].webpage_id
+    jira_server.requests.clear()
+
+    changed_tasks = poll_jira_statuses(app, jira)
+
+    assert sorted(task.id for task in changed_tasks) == task_ids[1:3]
+    assert jira_server.requests == [SEARCH]
+    db.session.expire_all()
+    statuses = [
+        db.session.get(JiraTask, task_id).status for task_id in task_ids
+    ]
+    assert statuses[:3] == [
+        JIRATaskStatus.DONE,
+        JIRATaskStatus.IN_REVIEW,
+        JIRATaskStatus.REJECTED,
+    ]
+    assert set(statuses[3:]) == {JIRATaskStatus.UNTRIAGED}
+    webpage = db.session.get(Webpage, webpage_id)
+    assert webpage.status == WebpageStatus.AVAILABLE
+    assert site_repository.get_tree_info()["stale"]
+
+    # The next polls only search for the issues updated since the last one
+    jira_server.requests.clear()
+    assert poll_jira_statuses(app, jira) == []
+    assert jira_server.requests == [SEARCH]
+
+    jira_server.set_status(tasks[3].jira_id, "Blocked")
+    jira_server.issues[tasks[4].jira_id] = "Blocked"
+    changed_tasks = poll_jira_statuses(app, jira)
+    assert [task.id for task in changed_tasks] == [task_ids[3]]
+    assert jira_server.requests == [SEARCH] * 2
+
+    # Watermarks are advanced once the changes are saved
+    watermarks = app.config["CACHE"].get(JIRA_WATERMARKS_KEY)
+    assert watermarks["WD"]["updated_since"] > watermarks["WD"]["full_poll_at"]
+
+
+def sign(body: bytes, secret: str = "secret") -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, "sha256").hexdigest()
+
+
+def test_jira_webhook(app):
+    app.config["JIRA_WEBHOOK_SECRET"] = "secret"
+    app.register_blueprint(jira_blueprint)
+    client = app.test_client()
+    site_repository = SiteRepository("site.com", app)
+    site_repository.sync_webpages(db, make_tree(2, 3))
+    db.session.commit()
+    webpage = Webpage.query.filter_by(name="/section-1/page-1").one()
+    add_page_details([webpage])
+    webpage.status = WebpageStatus.TO_DELETE
+    webpage.jira_tasks[0].request_type = JiraTaskType.PAGE_REMOVAL
+    db.session.commit()
+    site_repository.set_tree_in_cache(site_repository.get_tree_from_db())
+    webpage_id, jira_id = webpage.id, webpage.jira_tasks[0].jira_id
+
+    body = json.dumps(
+        {
+            "webhookEvent": "jira:issue_updated",
+            "issue": {
+                "key": jira_id,
+                "fields": {"status": {"name": "Rejected"}},
+            },
+        }
+    ).encode()
+    for signature in (None, sign(body, "other secret")):
+        headers = {"X-Hub-Signature": signature} if signature else {}
+        response = client.post("/api/jira-webhook", data=body, headers=headers)
+        assert response.status_code == 403
+
+    response = client.post(
+        "/api/jira-webhook", data=body, headers={"X-Hub-Signature": sign(body)}
+    )
+    assert response.json == {"updated": 1}
+    db.session.expire_all()
+    task = JiraTask.query.filter_by(jira_id=jira_id).one()
+    assert task.status == JIRATaskStatus.REJECTED
+    assert (
+        db.session.get(Webpage, webpage_id).status == WebpageStatus.AVAILABLE
+    )
+    assert site_repository.get_tree_info()["stale"]
+
+    # Other events are acknowledged, and ignored
+    body = json.dumps({"webhookEvent": "jira:issue_created"}).encode()
+    response = client.post(
+        "/api/jira-webhook", data=body, headers={"X-Hub-Signature": sign(body)}
+    )
+    assert response.status_code == 200
+
+
+def test_jira_session_is_pooled(jira, jira_server):
+    other_jira = Jira(
+        url=SITE_URL,
+        client_id="id",
+        client_secret="secret",
+        labels=[],
+        copy_updates_epic="WD-1",
+        sites_maintenance_epic=None,
+    )
+    jira_server.issues["WD-1"] = "Done"
+    jira_server.client_ports.clear()
+
+    for client in (jira, other_jira, jira):
+        client.get_issue_statuses("WD-1")
+
+    # Every request reuses the same connection
+    assert jira.get_session() is other_jira.get_session()
+    assert len(jira_server.client_ports) == 1
+
+    # Rotated tokens only change the Authorization header
+    jira._access_token = "rotated"
+    assert jira.get_jira_client().headers["Authorization"] == "Bearer rotated"
+
+    # Slow responses time out
+    jira.timeout = (1, 0.1)
+    jira.max_retries = 0
+    jira_server.latency = 0.5
+    with pytest.raises(JiraRequestError) as error:
+        jira.get_issue_statuses("WD-1")
+    assert isinstance(error.value.__cause__, requests.exceptions.ReadTimeout)
+
+
+def test_jira_retries(jira, jira_server):
+    jira_server.issues["WD-1"] = "Done"
+    jira_server.requests.clear()
+
+    # Throttled requests are retried after the delay Jira asks for
+    jira_server.fail(429, times=2, retry_after="0.2")
+    start = time.perf_counter()
+    assert jira.get_issue_statuses("WD-1")["key"] == "WD-1"
+    assert time.perf_counter() - start >= 0.4
+    assert jira_server.requests == [ISSUE] * 3
+    assert Jira.stats["throttled"] == 2
+    assert Jira.stats["retries"] == 2
+
+    # Searches are retried on server errors, with a backoff
+    jira_server.fail(502)
+    assert jira.get_issues_statuses(["WD-1"]) == {"WD-1": "Done"}
+    assert Jira.stats["retries"] == 3
+
+    # Requests that might have been processed aren't retried
+    jira_server.requests.clear()
+    jira_server.fail(500)
+    with pytest.raises(JiraRequestError) as error:
+        jira.create_task("Summary", Jira.SUBTASK, "", None, "reporter")
+    assert error.value.status_code == 500
+    assert len(jira_server.requests) == 1
+
+    # Nor are requests Jira asks to wait too long for
+    jira_server.fail(429, retry_after="3600")
+    with pytest.raises(JiraRequestError) as error:
+        jira.get_issue_statuses("WD-1")
+    assert error.value.status_code == 429
+    assert len(jira_server.requests) == 2
+
+    # Failures don't stop the polls halfway
+    jira_server.fail(503, times=jira.max_retries + 1)
+    with pytest.raises(JiraRequestError):
+        jira.get_issues_statuses(["WD-1"])
+    assert Jira.stats["failures"] == 3
+
+
+def test_jira_circuit_breaker(jira, jira_server):
+    jira_server.issues["WD-1"] = "Done"
+    jira.max_retries = 0
+    jira_server.fail(503, times=jira.circuit_threshold)
+    for _ in range(jira.circuit_threshold):
+        with pytest.raises(JiraRequestError):
+            jira.get_issue_statuses("WD-1")
+
+    # Jira isn't called while the circuit is open
+    jira_server.requests.clear()
+    with pytest.raises(JiraUnavailableError):
+        jira.get_issue_statuses("WD-1")
+    assert jira_server.requests == []
+    assert Jira.stats["short_circuited"] == 1
+
+    # Then a request probes it, and closes the circuit once it answers
+    Jira._circuit_breaker.reset_timeout = 0
+    assert jira.get_issue_statuses("WD-1")["key"] == "WD-1"
+    jira_server.fail(503)
+    with pytest.raises(JiraRequestError):
+        jira.get_issue_statuses("WD-1")
+    assert jira.get_issue_statuses("WD-1")["key"] == "WD-1"
+
+    # Throttled probes leave the circuit open, for the next call to probe
+    jira_server.fail(503, times=jira.circuit_threshold)
+    for _ in range(jira.circuit_threshold):
+        with pytest.raises(JiraRequestError):
+            jira.get_issue_statuses("WD-1")
+    jira_server.fail(429)
+    with pytest.raises(JiraRequestError):
+        jira.get_issue_statuses("WD-1")
+    assert Jira._circuit_breaker.opened_at is not None
+
+    # As do probes that fail in any other way
+    session = jira.get_session()
+    request = session.request
+    session.request = lambda *args, **kwargs: 1 / 0
+    with pytest.raises(ZeroDivisionError):
+        jira.get_issue_statuses("WD-1")
+    session.request = request
+    assert jira.get_issue_statuses("WD-1")["key"] == "WD-1"
+    assert Jira._circuit_breaker.opened_at is None
+
+
+def test_jira_retry_time(jira, jira_server):
+    jira_server.issues["WD-1"] = "Done"
+    jira.max_retry_time = 0.5
+
+    # Retries stop before the time is spent, rather than wait past it
+    jira_server.fail(429, times=3, retry_after="0.3")
+    start = time.perf_counter()
+    with pytest.raises(JiraRequestError) as error:
+        jira.get_issue_statuses("WD-1")
+    assert error.value.status_code == 429
+    assert len(jira_server.requests) == 4
+    assert time.perf_counter() - start < 0.5
+
+    # Requests held back by a pause fail without waiting for it to end
+    Jira._rate_limiter.pause(60)
+    with pytest.raises(JiraRequestError) as error:
+        jira.get_issue_statuses("WD-1")
+    assert error.value.status_code == 429
+    assert len(jira_server.requests) == 4
+    assert time.perf_counter() - start < 0.5
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=100)
+    start = time.perf_counter()
+    # Bursts are let through, then requests are spaced out
+    for _ in range(100):
+        limiter.acquire()
+    assert time.perf_counter() - start < 0.1
+    for _ in range(50):
+        limiter.acquire()
+    assert time.perf_counter() - start >= 0.45
+
+    limiter.pause(0.2)
+    start = time.perf_counter()
+    assert limiter.acquire() >= 0.15
+    assert time.perf_counter() - start >= 0.15
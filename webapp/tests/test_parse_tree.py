@@ -0,0 +1,144 @@
+from pathlib import Path
+
+import pytest
+
+from webapp.parse_tree import (
+    TemplateCache,
+    extends_base,
+    extract_template_metadata,
+    get_tags_from_metadata,
+    scan_directory,
+)
+
+TEMPLATES = {
+    "index.html": """{% extends "base.html" %}
+{% block title %}Home{% endblock %}
+{% block meta_description %}
+  A description that spans
+  several lines
+{% endblock %}
+{% block meta_copydoc %}https://docs.google.com/d/1{% endblock %}
+""",
+    "search.html": """{% extends "base.html" %}
+{% block title %}Search{% if query %} for '{{ query }}'{% endif %}\
+{% endblock %}
+{% block description %}Fallback description{% endblock description %}
+{% block copydoc %}https://docs.google.com/d/2{% endblock %}
+""",
+    "legal/index.md": """---
+wrapper_template: "legal/_base_legal_markdown.html"
+title: "Legal"
+meta_description: Terms and conditions
+---
+# Legal
+""",
+    "partial.html": "<p>No metadata</p>\n",
+}
+
+
+@pytest.fixture
+def templates(tmp_path):
+    templates = tmp_path / "repositories" / "site.com" / "templates"
+    for name, content in TEMPLATES.items():
+        path = templates / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    (templates / "base.html").write_text("")
+    return templates
+
+
+@pytest.mark.parametrize(
+    "name, extends, title, description, link",
+    [
+        (
+            "index.html",
+            "base.html",
+            "Home",
+            "A description that spans    several lines",
+            "https://docs.google.com/d/1",
+        ),
+        (
+            "search.html",
+            "base.html",
+            " for '{{ query }}'",
+            "Fallback description",
+            "https://docs.google.com/d/2",
+        ),
+        ("legal/index.md", None, "Legal", "Terms and conditions", None),
+        ("partial.html", None, None, None, None),
+    ],
+)
+def test_get_tags_from_metadata(
+    templates, name, extends, title, description, link
+):
+    path = templates / name
+    metadata = extract_template_metadata(path)
+    tags = get_tags_from_metadata(path, metadata)
+
+    assert metadata["extends"] == extends
+    assert tags["title"] == title
+    assert tags["description"] == description
+    assert tags["link"] == link
+
+
+def test_extract_template_metadata(templates):
+    metadata = extract_template_metadata(templates / "legal/index.md")
+    assert metadata["wrapper_template"] == "legal/_base_legal_markdown.html"
+    assert metadata["title"] == "Legal"
+    assert metadata["description"] == "Terms and conditions"
+
+
+def test_scan_directory(templates):
+    tree = scan_directory(str(templates))
+    assert tree["title"] == "Home"
+    assert sorted(child["name"] for child in tree["children"]) == [
+        "/legal",
+        "/search",
+    ]
+
+
+def test_extends_base_detects_cycles(templates):
+    (templates / "loop-a.html").write_text('{% extends "loop-b.html" %}')
+    (templates / "loop-b.html").write_text('{% extends "loop-a.html" %}')
+    cache = TemplateCache()
+
+    assert not extends_base(templates / "loop-a.html", cache=cache)
+    assert cache.extends[str(templates / "loop-b.html")] == {
+        "reaches_base": False,
+        "parent": "loop-a.html",
+    }
+
+
+def test_scan_directory_reads_layouts_once(templates, monkeypatch):
+    (templates / "_base_section.html").write_text('{% extends "base.html" %}')
+    for page in range(5):
+        (templates / "pages" / f"page-{page}.html").parent.mkdir(exist_ok=True)
+        (templates / "pages" / f"page-{page}.html").write_text(
+            '{% extends "/_base_section.html" %}'
+        )
+
+    opened = []
+    path_open = Path.open
+    monkeypatch.setattr(
+        Path,
+        "open",
+        lambda path, *args, **kwargs: opened.append(path.name)
+        or path_open(path, *args, **kwargs),
+    )
+    tree = scan_directory(str(templates))
+
+    pages = next(c for c in tree["children"] if c["name"] == "/pages")
+    assert len(pages["children"]) == 5
+    assert opened.count("_base_section.html") == 1
+
+
+def test_parallel_scan_matches_serial_scan(templates):
+    for section in range(3):
+        for page in range(3):
+            path = templates / f"section-{section}" / f"page-{page}.html"
+            path.parent.mkdir(exist_ok=True)
+            path.write_text(TEMPLATES["search.html"])
+
+    assert scan_directory(str(templates), workers=4) == scan_directory(
+        str(templates)
+    )
@@ -1,4 +1,24 @@
+import json
+from pathlib import Path, PurePosixPath
+
+import pytest
+from git import Repo
+from sqlalchemy import update
+
 from webapp import create_app
+from webapp.github import GitHub
+from webapp.helper import get_tree_struct
+from webapp.models import (
+    JiraTask,
+    Product,
+    Project,
+    Reviewer,
+    User,
+    Webpage,
+    WebpageProduct,
+    WebpageStatus,
+    db,
+)
 from webapp.site_repository import SiteRepository
 
 
@@ -9,3 +29,340 @@ def test_initialize_site_repository():
         app,
     )
     assert site_repository.repository_uri == "ubuntu.com"
+
+
+PAGE = """{{% extends "base.html" %}}
+{{% block title %}}{title}{{% endblock %}}
+"""
+
+
+def commit_templates(repo: Repo, files: dict):
+    for name, content in files.items():
+        path = Path(repo.working_tree_dir) / "templates" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        repo.index.add([f"templates/{name}"])
+    return repo.index.commit("Update templates")
+
+
+@pytest.fixture
+def origin(tmp_path):
+    repo = Repo.init(tmp_path / "org" / "site.com.git", initial_branch="main")
+    commit_templates(
+        repo,
+        {
+            "base.html": "",
+            "index.html": PAGE.format(title="Home"),
+            "data/index.html": PAGE.format(title="Data"),
+            "data/spark.html": PAGE.format(title="Spark"),
+            "cloud/index.html": PAGE.format(title="Cloud"),
+        },
+    )
+    return repo
+
+
+@pytest.fixture
+def site_repository(app, tmp_path, monkeypatch, origin):
+    monkeypatch.setattr("webapp.github.REPO_ORG", f"file://{tmp_path / 'org'}")
+    github = GitHub(app)
+    github.REPOSITORY_PATH = tmp_path / "repositories"
+    github.REPOSITORY_PATH.mkdir()
+    app.config["github"] = github
+    return SiteRepository("site.com", app)
+
+
+def get_titles():
+    return {page.name: page.title for page in Webpage.query.all()}
+
+
+def test_get_changed_directories(app):
+    site_repository = SiteRepository("site.com", app)
+    assert site_repository.get_changed_directories(
+        ["data/spark.html", "data/kafka/index.html", "cloud/index.md"]
+    ) == [PurePosixPath("cloud"), PurePosixPath("data")]
+    # Layouts can be extended from anywhere, so the whole tree is rescanned
+    assert (
+        site_repository.get_changed_directories(
+            ["data/spark.html", "data/_layout.html"]
+        )
+        is None
+    )
+
+
+def test_incremental_tree_update(
+    site_repository, origin, monkeypatch, queries
+):
+    site_repository.get_tree()
+    assert get_titles()["/data/spark"] == "Spark"
+    project = Project.query.filter_by(name="site.com").one()
+    assert project.last_commit_sha == origin.head.commit.hexsha
+
+    # An unchanged repository is neither parsed nor written to the database
+    def fail(*args, **kwargs):
+        raise AssertionError("Unexpected scan")
+
+    queries.clear()
+    with monkeypatch.context() as m:
+        m.setattr(site_repository, "scan_templates", fail)
+        assert site_repository.get_new_tree(incremental=True) is None
+    # nor are its webpages loaded
+    assert not [
+        query
+        for query in queries
+        if "FROM webpages" in query and "LIMIT" not in query
+    ]
+
+    commit_templates(
+        origin,
+        {
+            "data/spark.html": PAGE.format(title="Apache Spark"),
+            "data/kafka/index.html": PAGE.format(title="Kafka"),
+        },
+    )
+    scanned = []
+    scan_templates = site_repository.scan_templates
+    monkeypatch.setattr(
+        site_repository,
+        "scan_templates",
+        lambda path=None: scanned.append(path) or scan_templates(path),
+    )
+    tree = site_repository.get_new_tree(incremental=True)
+
+    assert [path.name for path in scanned] == ["data"]
+    assert get_titles()["/data/spark"] == "Apache Spark"
+    assert get_titles()["/data/kafka"] == "Kafka"
+    data = next(c for c in tree["children"] if c["name"] == "/data")
+    assert {c["name"] for c in data["children"]} == {
+        "/data/kafka",
+        "/data/spark",
+    }
+
+
+def make_tree(sections: int, pages: int, title: str = "Page"):
+    def node(name, children=()):
+        return {
+            "name": name,
+            "title": f"{title} {name}",
+            "description": None,
+            "link": None,
+            "ext": ".html",
+            "file_path": f"repositories/site.com/templates{name}.html",
+            "children": list(children),
+        }
+
+    return node(
+        "",
+        [
+            node(
+                f"/section-{s}",
+                [node(f"/section-{s}/page-{p}") for p in range(pages)],
+            )
+            for s in range(sections)
+        ],
+    )
+
+
+@pytest.mark.parametrize("pages", [2, 20])
+def test_sync_webpages_in_bulk(app, queries, pages):
+    site_repository = SiteRepository("site.com", app)
+    site_repository.sync_webpages(db, make_tree(3, pages))
+    db.session.commit()
+    statements = len(queries)
+
+    webpages = {page.name: page for page in Webpage.query.all()}
+    assert len(webpages) == 1 + 3 + 3 * pages
+    assert webpages[""].parent_id is None
+    assert webpages["/section-1/page-1"].parent_id == webpages["/section-1"].id
+    assert webpages["/section-1"].parent_id == webpages[""].id
+
+    # Only the changed page is updated
+    tree = make_tree(3, pages)
+    tree["children"][1]["children"][1]["title"] = "Changed"
+    queries.clear()
+    site_repository.sync_webpages(db, tree)
+    db.session.commit()
+    assert sum("UPDATE" in query for query in queries) == 1
+    db.session.expire_all()
+    assert Webpage.query.filter_by(title="Changed").count() == 1
+
+    # The number of statements doesn't depend on the number of pages
+    assert statements <= 10
+
+
+@pytest.mark.parametrize("pages", [2, 20])
+def test_get_tree_struct(app, queries, pages):
+    site_repository = SiteRepository("site.com", app)
+    site_repository.sync_webpages(db, make_tree(3, pages))
+    db.session.commit()
+    db.session.expire_all()
+    webpages = Webpage.query.all()
+
+    queries.clear()
+    tree = get_tree_struct(db.session, webpages)
+
+    assert tree["name"] == ""
+    assert [child["name"] for child in tree["children"]] == [
+        f"/section-{s}" for s in range(3)
+    ]
+    section = tree["children"][1]
+    assert len(section["children"]) == pages
+    assert section["children"][0]["name"] == "/section-1/page-0"
+    # Projects and owners are loaded once, not per page
+    assert sum("FROM projects" in query for query in queries) <= 1
+    assert sum("FROM users" in query for query in queries) <= 1
+
+
+def add_page_details(webpages):
+    """Give each webpage an owner, a reviewer, a Jira task and a product."""
+    for webpage in webpages:
+        user = User(name=f"User {webpage.id}")
+        product = Product(name=f"Product {webpage.id}")
+        webpage.owner = user
+        db.session.add_all(
+            [
+                Reviewer(user=user, webpages=webpage),
+                JiraTask(
+                    jira_id=f"WD-{webpage.id}", user=user, webpages=webpage
+                ),
+                WebpageProduct(products=product, webpages=webpage),
+            ]
+        )
+    db.session.commit()
+
+
+def test_tree_from_db_query_count(app, queries):
+    site_repository = SiteRepository("site.com", app)
+    counts = []
+    for pages in (2, 20):
+        site_repository.sync_webpages(db, make_tree(3, pages))
+        db.session.commit()
+        add_page_details(Webpage.query.filter(~Webpage.reviewers.any()).all())
+        db.session.expire_all()
+
+        queries.clear()
+        tree = get_tree_struct(
+            db.session, site_repository._get_webpages(eager=True)
+        )
+        counts.append(len(queries))
+
+        page = tree["children"][0]["children"][0]
+        assert page["owner"]["name"] == page["reviewers"][0]["name"]
+        assert page["jira_tasks"][0]["jira_id"] == f"WD-{page['id']}"
+        assert page["products"][0]["name"] == f"Product {page['id']}"
+        # The tree can be cached
+        assert json.loads(json.dumps(tree)) == tree
+
+    # The number of queries doesn't depend on the number of pages
+    assert counts[0] == counts[1]
+
+
+def test_has_incomplete_pages(app, queries):
+    site_repository = SiteRepository("site.com", app)
+    site_repository.sync_webpages(db, make_tree(3, 20))
+    db.session.commit()
+    webpages = site_repository._get_webpages()
+
+    queries.clear()
+    assert not site_repository._has_incomplete_pages(webpages)
+    assert queries == []
+
+    root = next(page for page in webpages if page.parent_id is None)
+    section = next(page for page in webpages if page.parent_id == root.id)
+    section.name, section.title = "", None
+    assert site_repository._has_incomplete_pages(webpages)
+
+    # Children that are being deleted still count for the root
+    db.session.execute(
+        update(Webpage)
+        .where(Webpage.parent_id == root.id)
+        .values(status=WebpageStatus.TO_DELETE)
+    )
+    assert not site_repository._has_incomplete_pages([root])
+    db.session.execute(
+        update(Webpage)
+        .where(Webpage.parent_id == root.id)
+        .values(parent_id=None)
+    )
+    assert site_repository._has_incomplete_pages([root])
+
+
+def test_invalidate_webpage_rebuilds_its_section(app):
+    site_repository = SiteRepository("site.com", app)
+    site_repository.sync_webpages(db, make_tree(3, 5))
+    db.session.commit()
+    site_repository.set_tree_in_cache(site_repository.get_tree_from_db())
+    version = site_repository.cache.get(site_repository.index_key)["version"]
+
+    webpage = Webpage.query.filter_by(name="/section-1/page-2").one()
+    webpage.owner = User(name="New owner")
+    db.session.commit()
+    site_repository.invalidate_webpage(webpage)
+
+    sections = Webpage.query.filter(Webpage.name.like("/section-_")).all()
+    fragments = {
+        section.name: site_repository.cache.get(
+            site_repository.get_fragment_key(section.id)
+        )
+        for section in sections
+    }
+    assert fragments["/section-1"] is None
+    assert fragments["/section-0"] is not None
+    assert site_repository.get_tree_from_cache() is None
+
+    tree = site_repository.get_tree_sync()
+    page = tree["children"][1]["children"][2]
+    assert page["name"] == "/section-1/page-2"
+    assert page["owner"]["name"] == "New owner"
+    assert tree == site_repository.get_tree_from_db()
+    index = site_repository.cache.get(site_repository.index_key)
+    assert index["version"] != version
+
+    # Several webpages are invalidated at once
+    site_repository.invalidate_webpages(
+        Webpage.query.filter(Webpage.name.like("/section-_/page-1")).all()
+    )
+    assert all(
+        site_repository.cache.get(site_repository.get_fragment_key(s.id))
+        is None
+        for s in sections
+    )
+    assert site_repository.get_tree_info()["stale"]
+    assert site_repository.get_tree_sync() == tree
+
+    # Changes to the root invalidate the whole tree
+    site_repository.invalidate_webpage(Webpage.query.filter_by(name="").one())
+    assert site_repository.cache.get(site_repository.index_key) is None
+
+
+def test_get_tree_async_serves_last_good_tree(app):
+    site_repository = SiteRepository("site.com", app)
+    # Nothing is built, and the repository isn't loaded in the request
+    tree, info = site_repository.get_tree_async()
+    assert tree["children"] == [] and info["stale"]
+
+    site_repository.sync_webpages(db, make_tree(3, 5))
+    db.session.commit()
+    tree, info = site_repository.get_tree_async()
+    assert not info["stale"]
+    assert site_repository.get_tree_async() == (tree, info)
+
+    webpage = Webpage.query.filter_by(name="/section-1/page-2").one()
+    webpage.title = "Changed"
+    db.session.commit()
+    site_repository.invalidate_webpage(webpage)
+
+    stale_tree, stale_info = site_repository.get_tree_async()
+    assert stale_tree == tree
+    assert stale_info == {**info, "stale": True}
+    assert site_repository.claim_tree_rebuild()
+    assert not site_repository.claim_tree_rebuild()
+
+    # The background rebuild
+    site_repository.get_tree_sync()
+    site_repository.release_tree_rebuild()
+
+    new_tree, new_info = site_repository.get_tree_async()
+    assert not new_info["stale"]
+    assert new_info["version"] != info["version"]
+    assert new_tree["children"][1]["children"][2]["title"] == "Changed"
+    assert site_repository.claim_tree_rebuild()
@@ -0,0 +1,155 @@
+import gzip
+import json
+
+import pytest
+
+from webapp.models import Webpage, WebpageStatus, db
+from webapp.routes import tree
+from webapp.routes.tree import tree_blueprint
+from webapp.site_repository import SiteRepository
+from webapp.tests.test_site_repository import make_tree
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    app.config["SECRET_KEY"] = "secret"
+    app.register_blueprint(tree_blueprint)
+    rebuilds = []
+    monkeypatch.setattr(
+        "webapp.routes.tree.rebuild_site_tree", rebuilds.append
+    )
+    client = app.test_client()
+    client.rebuilds = rebuilds
+    with client.session_transaction() as session:
+        session["openid"] = {"email": "user@example.com"}
+    SiteRepository("site.com", app).sync_webpages(db, make_tree(3, 20))
+    db.session.commit()
+    return client
+
+
+def test_get_tree_conditional_requests(client):
+    response = client.get("/api/get-tree/site.com")
+    assert response.status_code == 200
+    assert response.cache_control.no_cache
+    assert not response.cache_control.no_store
+    data = response.get_json()
+    etag, weak = response.get_etag()
+    assert weak and etag == data["version"]
+    assert not data["stale"]
+
+    response = client.get(
+        "/api/get-tree/site.com", headers={"If-None-Match": f'W/"{etag}"'}
+    )
+    assert response.status_code == 304
+    assert response.get_etag() == (etag, True)
+    assert client.rebuilds == []
+
+    # Once invalidated, the stale tree is served and rebuilt once
+    site_repository = SiteRepository("site.com", client.application)
+    site_repository.invalidate_webpage(db.session.get(Webpage, 5))
+    for _ in range(2):
+        response = client.get(
+            "/api/get-tree/site.com", headers={"If-None-Match": f'"{etag}"'}
+        )
+        assert response.status_code == 304
+    assert client.rebuilds == ["site.com"]
+
+
+def test_get_tree_gzip(client, monkeypatch):
+    compressed = []
+    monkeypatch.setattr(tree, "compressed_trees", {})
+    monkeypatch.setattr(
+        tree,
+        "compress_tree_head",
+        lambda *args, f=tree.compress_tree_head: compressed.append(1)
+        or f(*args),
+    )
+    headers = {"Accept-Encoding": "gzip"}
+    response = client.get("/api/get-tree/site.com", headers=headers)
+    assert response.content_encoding == "gzip"
+    assert "Accept-Encoding" in response.vary
+    data = json.loads(gzip.decompress(response.get_data()))
+    assert len(data["templates"]["children"]) == 3
+    assert data == client.get("/api/get-tree/site.com").get_json()
+
+    # The tree is only compressed again once its version changes
+    response = client.get("/api/get-tree/site.com", headers=headers)
+    assert json.loads(gzip.decompress(response.get_data())) == data
+    assert compressed == [1]
+
+    site_repository = SiteRepository("site.com", client.application)
+    webpage = db.session.get(Webpage, 5)
+    webpage.title = "Changed"
+    db.session.commit()
+    site_repository.invalidate_webpage(webpage)
+    response = client.get("/api/get-tree/site.com", headers=headers)
+    assert json.loads(gzip.decompress(response.get_data()))["stale"]
+    site_repository.get_tree_sync()
+    response = client.get("/api/get-tree/site.com", headers=headers)
+    new_data = json.loads(gzip.decompress(response.get_data()))
+    assert new_data["version"] != data["version"]
+    assert compressed == [1, 1]
+
+
+def test_get_tree_delta(client):
+    site_repository = SiteRepository("site.com", client.application)
+    version = client.get("/api/get-tree/site.com").get_json()["version"]
+
+    webpage = Webpage.query.filter_by(name="/section-1/page-2").one()
+    webpage.title = "Changed"
+    db.session.commit()
+    site_repository.invalidate_webpage(webpage)
+    site_repository.get_tree_sync()
+
+    removed = Webpage.query.filter_by(name="/section-2/page-0").one()
+    removed.status = WebpageStatus.TO_DELETE
+    db.session.commit()
+    site_repository.invalidate_webpage(removed)
+    site_repository.get_tree_sync()
+    removed_id = removed.id
+
+    data = client.get(f"/api/get-tree-delta/site.com?since={version}").json
+    assert not data["full"]
+    assert data["version"] == site_repository.get_tree_info()["version"]
+    assert data["added"] == []
+    assert [node["title"] for node in data["changed"]] == ["Changed"]
+    assert data["removed"] == [removed_id]
+
+    data = client.get(f"/api/get-tree-delta/site.com?since={data['version']}")
+    assert data.json["changed"] == [] and data.json["removed"] == []
+
+    # Unknown versions get the full tree
+    data = client.get("/api/get-tree-delta/site.com?since=unknown").json
+    assert data["full"]
+    assert len(data["templates"]["children"]) == 3
+
+
+def test_get_subtree(client, queries):
+    response = client.get("/api/get-subtree/site.com?url=/")
+    data = response.get_json()
+    assert data["total"] == 3
+    root = data["webpage"]
+    assert root["children_count"] == 3
+    assert [child["name"] for child in root["children"]] == [
+        f"/section-{s}" for s in range(3)
+    ]
+    assert all(child["children_count"] == 20 for child in root["children"])
+    assert "children" not in root["children"][0]
+
+    section_id = root["children"][1]["id"]
+    queries.clear()
+    data = client.get(
+        f"/api/get-subtree/site.com?id={section_id}&page=2&per_page=8"
+    ).get_json()
+    assert data["total"] == 20 and data["total_pages"] == 3
+    children = data["webpage"]["children"]
+    assert len(children) == 8
+    assert children[0]["children_count"] == 0
+    # Only the requested level is loaded
+    assert sum("FROM webpages" in query for query in queries) <= 4
+
+    data = client.get("/api/get-subtree/site.com?url=/&depth=2").get_json()
+    assert len(data["webpage"]["children"][2]["children"]) == 20
+
+    assert client.get("/api/get-subtree/site.com?id=999").status_code == 404
+    assert client.get("/api/get-subtree/site.com?depth=0").status_code == 400